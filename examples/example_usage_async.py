@@ -8,23 +8,22 @@ async def main():
     username = input("Username: (leave empty to use PLUXEE_USERNAME env variable)")
     password = input("password: (leave empty to use PLUXEE_PASSWORD env variable)")
 
-    pc = PluxeeAsyncClient(username, password)
-
-    balance = await pc.get_balance()
-    print(balance)
-    # Will return a PluxeeBalance object with those attributes
-    # lunch_pass: 89.19
-    # eco_pass: 396.16
-    # gift_pass: 0.0
-    # conso_pass: 0.0
-
-    transactions = await pc.get_transactions(PassType.LUNCH, date.today() - timedelta(days=60), date.today() - timedelta(days=30))
-    print(transactions)
-    # Will return a list of PluxeeTransaction object with those attributes
-    # date: 2024-06-19
-    # amount: -75.24
-    # detail: Paiement classique
-    # merchant: Colruyt Food Retail
+    async with PluxeeAsyncClient(username, password) as pc:
+        balance = await pc.get_balance()
+        print(balance)
+        # Will return a PluxeeBalance object with those attributes
+        # lunch_pass: 89.19
+        # eco_pass: 396.16
+        # gift_pass: 0.0
+        # conso_pass: 0.0
+
+        transactions = await pc.get_transactions(PassType.LUNCH, date.today() - timedelta(days=60), date.today() - timedelta(days=30))
+        print(transactions)
+        # Will return a list of PluxeeTransaction object with those attributes
+        # date: 2024-06-19
+        # amount: -75.24
+        # detail: Paiement classique
+        # merchant: Colruyt Food Retail
 
 
 if __name__ == "__main__":
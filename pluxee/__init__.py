@@ -1,9 +1,15 @@
 from .exceptions import PluxeeAPIError, PluxeeLoginError
 from .base_pluxee_client import PassType, PluxeeBalance, PluxeeTransaction, _PluxeeClient
 from .pluxee_client import PluxeeClient
+from .session_pool import PluxeeSessionPool
+from .transaction_columns import PluxeeTransactionColumns
+from .transaction_store import TransactionStore
+from .response_cache import ResponseCache
+from .transaction_sync import TransactionSyncState
 from .aia_chaser import AIASession
 
 try:
     from .pluxee_async_client import PluxeeAsyncClient
+    from .async_session_pool import PluxeeAsyncSessionPool
 except ImportError:
     pass
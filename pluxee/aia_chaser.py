@@ -2,14 +2,21 @@
 This code comes from https://github.com/milahu/python-aia/tree/use-cryptography-module.
 """
 
+import asyncio
 import logging
 import os
 import re
 import select
 import socket
 import ssl
+import tempfile
+import threading
 import time
-from functools import lru_cache, partial
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from functools import partial
 from urllib.parse import urlsplit
 from urllib.request import Request, urlopen
 
@@ -51,36 +58,6 @@ class InvalidCAError(AIAError):
     pass
 
 
-class CachedMethod:
-    """
-    A ``functools.lru_cache`` cache decorator for methods,
-    but applied on each bound method (i.e., in the instance)
-    in order to avoid memory leak issues relating to
-    caching an unbound method directly from the owner class.
-    """
-
-    def __init__(self, maxsize=128, typed=False):
-        if callable(maxsize):
-            self.func = maxsize
-            self.maxsize = None
-        else:
-            self.maxsize = maxsize
-        self.typed = typed
-
-    def __call__(self, func):
-        self.func = func
-        return self
-
-    def __set_name__(self, owner, name):
-        self.name = name
-
-    def __get__(self, instance, owner):
-        bound_method = partial(self.func, instance)
-        result = lru_cache(self.maxsize, self.typed)(bound_method)
-        setattr(instance, self.name, result)
-        return result
-
-
 def get_cn_of_name(name):
     for attr in name:
         if attr.rfc4514_attribute_name == "CN":
@@ -101,6 +78,23 @@ def get_ca_issuers_of_cert(cert):
     return ca_issuers
 
 
+def get_dns_names_of_cert(cert):
+    """
+    Lowercase DNS names of a pyopenssl certificate:
+    its subject alternative names, or its CN when it has none.
+    """
+    cert = cert.to_cryptography()
+    try:
+        san_extension = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName)
+        names = san_extension.value.get_values_for_type(x509.DNSName)
+    except x509.extensions.ExtensionNotFound:
+        names = []
+    if not names:
+        common_name = get_cn_of_name(cert.subject)
+        names = [common_name] if common_name else []
+    return list(dict.fromkeys(name.lower() for name in names))
+
+
 def openssl_get_cert_info(cert_der):
     """
     Get issuer, subject and AIA CA issuers (``aia_ca_issuers``)
@@ -115,6 +109,21 @@ def openssl_get_cert_info(cert_der):
     return cert_info
 
 
+def get_not_after_of_cadata(cadata):
+    """
+    Timestamp of the earliest ``notAfter`` of the PEM certificates in cadata.
+    """
+    certs = x509.load_pem_x509_certificates(cadata.encode("ascii"))
+    return min(cert.not_valid_after_utc.timestamp() for cert in certs)
+
+
+def get_not_after_of_certs(certs):
+    """
+    Timestamp of the earliest ``notAfter`` of the pyopenssl certificates.
+    """
+    return min(cert.to_cryptography().not_valid_after_utc.timestamp() for cert in certs)
+
+
 def print_cert(cert, label=None, indent=""):
     if label:
         print(indent + label + ":")
@@ -144,6 +153,40 @@ def print_chain(cert_chain, label=None):
         print_cert(cert, f"cert {idx}", "  ")
 
 
+def _cache_put(cache, key, value, maxsize=128):
+    # limit cache size
+    # fifo cache. simpler than lru cache
+    while len(cache) >= maxsize:
+        del cache[next(iter(cache))]
+    cache[key] = value
+
+
+def _has_expired(cert):
+    # time.time, like the expiry of the cached chains
+    return get_not_after_of_certs([cert]) <= time.time()
+
+
+def _get_leaf_sha256(cert_chain):
+    return cert_chain[0].to_cryptography().fingerprint(hashes.SHA256())
+
+
+def _split_host_port(host):
+    if ":" in host:
+        host, port = host.split(":")
+        return host, int(port)
+    return host, 443
+
+
+def _remove_cafiles(cafile_from_host, old_cafiles):
+    for path in [path for _cadata, path in cafile_from_host.values()] + old_cafiles:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+    cafile_from_host.clear()
+    old_cafiles.clear()
+
+
 class AIASession:
 
     def __init__(
@@ -152,7 +195,10 @@ class AIASession:
         cafile=None,
         cache_db=None,
         cache_dir=None,
+        chain_cache_db=None,
         verify_depth=100,  # default is -1 = infinite
+        max_fetch_workers=4,
+        cadata_cache_size=128,
         # TODO load/store trusted root certs
         # trusted_db=None,
         # trusted_dir=None,
@@ -160,38 +206,157 @@ class AIASession:
         """
         Create a new session.
         Downloaded certificates are cached in cache_dir or cache_db.
+        Verified certificate chains are cached in chain_cache_db,
+        which can be shared by many processes.
+        A cached chain is used only while the server presents the same leaf cert.
+        At most max_fetch_workers CA issuer certificates are downloaded at once.
+        The chains of the cadata_cache_size most recently used names are kept in memory,
+        and the SSL contexts of the cadata_cache_size most recently used hosts.
         """
+        if cadata_cache_size < 1:
+            raise ValueError(f"Invalid cadata_cache_size '{cadata_cache_size}'. Must be at least 1")
         logger.debug("creating AIASession")
         self.user_agent = user_agent
+        self.max_fetch_workers = max_fetch_workers
         self.cafile = cafile
         if not cafile:
             import certifi
 
             self.cafile = certifi.where()
         self.cache_db = cache_db
-        self.cache_db_con = None
-        self.cache_db_cur = None
         self.cache_dir = cache_dir
+        self.chain_cache_db = chain_cache_db
+        # the session can be shared by many threads.
+        # each thread gets its own database connections
+        self._local = threading.local()
+        self._db_cons = list()
+        # guards the caches
+        self._lock = threading.RLock()
+        # host -> [lock held while the chain of host is resolved, number of threads using the lock]
+        self._host_locks = dict()
+        # downloads the CA issuer certs, created on the first missing cert
+        self._fetch_executor = None
+        # (event loop, host) -> task resolving the chain of host
+        self._async_chases = dict()
         self._ssl_context = OpenSSL.SSL.Context(method=OpenSSL.SSL.TLS_CLIENT_METHOD)
         if verify_depth:
             self._ssl_context.set_verify_depth(verify_depth)
         # logger.debug(f"verify_depth = {self._ssl_context.get_verify_depth()}")
         # this throws OpenSSL.SSL.Error if cafile is missing or empty
         self._ssl_context.load_verify_locations(cafile=self.cafile)
-        self._cadata_from_host_regex = dict()
-        self._trusted_root_certs = list()
+        # name of the leaf cert, like "example.com" or "*.example.com",
+        # or requested host -> (cadata, host_regex, expiry timestamp).
+        # an LRU cache, looked up with the host and with the wildcard name matching the host
+        self._cadata_from_name = OrderedDict()
+        self.cadata_cache_size = cadata_cache_size
+        self.cadata_cache_hits = 0
+        self.cadata_cache_misses = 0
+        # shared by the sync and the async methods
+        # host -> (host cert chain, expiry timestamp)
+        self._host_cert_chain_from_host = dict()
+        self._ca_issuer_cert_from_url = dict()
+        # sha256 digest -> trusted root cert
+        self._trusted_root_certs = dict()
+        # the cert store of aia_chase, built from cafile and the trusted root certs.
+        # it is built again when the trusted root certs change
+        self._chase_cert_store = None
+        # DER names of the certs of the chase cert store
+        self._chase_trusted_subjects = None
+        # (host, purpose) -> (ssl_context, expiry timestamp, cadata)
+        # an LRU cache of cadata_cache_size entries, like the cadata cache
+        self._ssl_context_from_host = OrderedDict()
+        # host -> (cadata, path of the PEM file holding cadata)
+        self._cafile_from_host = dict()
+        # paths of the replaced PEM files, a request can still be reading them
+        self._old_cafiles = list()
+        self._cafile_finalizer = weakref.finalize(self, _remove_cafiles, self._cafile_from_host, self._old_cafiles)
+
+    def close(self):
+        """
+        Remove the PEM files written by ``cafile_from_url``,
+        stop the download threads and close the database connections of every thread.
+        The session can still be used afterwards, it is closed again the same way.
+        """
+        with self._lock:
+            self._cafile_finalizer()
+        with self._lock:
+            executor, self._fetch_executor = self._fetch_executor, None
+        if executor is not None:
+            # the threads must be done before their connections are closed
+            executor.shutdown(wait=True)
+        with self._lock:
+            for con in self._db_cons:
+                con.close()
+            self._db_cons.clear()
+            self._local = threading.local()
+
+    @property
+    def cache_db_con(self):
+        """The cache_db connection of the current thread."""
+        return getattr(self._local, "cache_db_con", None)
+
+    @property
+    def cache_db_cur(self):
+        """The cache_db cursor of the current thread."""
+        return getattr(self._local, "cache_db_cur", None)
+
+    @property
+    def chain_cache_db_con(self):
+        """The chain_cache_db connection of the current thread."""
+        return getattr(self._local, "chain_cache_db_con", None)
+
+    def _connect_db(self, path, **kwargs):
+        import sqlite3
+
+        # the connection is only used by the current thread,
+        # but is closed by the thread calling close
+        con = sqlite3.connect(path, check_same_thread=False, **kwargs)
+        with self._lock:
+            self._db_cons.append(con)
+        return con
+
+    @contextmanager
+    def _host_lock(self, host):
+        # the lock of a host is forgotten once no thread uses it,
+        # so a lock is never dropped while a thread holds it or waits for it
+        with self._lock:
+            entry = self._host_locks.get(host)
+            if entry is None:
+                entry = self._host_locks[host] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._host_locks[host]
+
+    def _get_fetch_executor(self):
+        with self._lock:
+            if self._fetch_executor is None:
+                # threads are only started when needed,
+                # and are reused by the next chases with their database connections
+                self._fetch_executor = ThreadPoolExecutor(max_workers=self.max_fetch_workers, thread_name_prefix="aia-fetch")
+            return self._fetch_executor
 
-    @CachedMethod
     def get_host_cert_chain(self, host, timeout=5):
         """
         Get the certificate chain from the target host,
         without checking it, without fetching missing certs.
+        The chain is kept until its first certificate expires.
         """
+        host_cert_chain = self._cached_host_cert_chain(host)
+        if host_cert_chain is not None:
+            return host_cert_chain
+        host_cert_chain = self._download_host_cert_chain(host, timeout)
+        self._cache_host_cert_chain(host, host_cert_chain)
+        return host_cert_chain
+
+    def _download_host_cert_chain(self, host, timeout):
         logger.debug(f"Downloading TLS certificate chain from https://{host}")
-        port = 443
-        if ":" in host:
-            host, port = host.split(":")
-            port = int(port)
+        host, port = _split_host_port(host)
         # https://stackoverflow.com/a/67212703/10440128
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         conn = OpenSSL.SSL.Connection(self._ssl_context, socket=sock)
@@ -220,18 +385,81 @@ class AIASession:
 
         conn.close()
 
-        host_cert_chain = conn.get_peer_cert_chain()
+        return conn.get_peer_cert_chain()
 
+    async def async_get_host_cert_chain(self, host, timeout=5):
+        """
+        Same to the ``get_host_cert_chain`` method, but the handshake
+        runs on asyncio streams, through a pyopenssl memory BIO.
+        """
+        host_cert_chain = self._cached_host_cert_chain(host)
+        if host_cert_chain is not None:
+            return host_cert_chain
+        host_cert_chain = await self._async_download_host_cert_chain(host, timeout)
+        self._cache_host_cert_chain(host, host_cert_chain)
         return host_cert_chain
 
+    async def _async_download_host_cert_chain(self, host, timeout):
+        logger.debug(f"Downloading TLS certificate chain from https://{host}")
+        hostname, port = _split_host_port(host)
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(hostname, port), timeout)
+        try:
+            conn = OpenSSL.SSL.Connection(self._ssl_context, None)
+            conn.set_tlsext_host_name(hostname.encode())
+            conn.set_connect_state()
+            await asyncio.wait_for(self._async_do_handshake(conn, reader, writer), timeout)
+        finally:
+            writer.close()
+        return conn.get_peer_cert_chain()
+
+    def _cached_host_cert_chain(self, host):
+        with self._lock:
+            cached = self._host_cert_chain_from_host.get(host)
+            if cached is None:
+                return None
+            if time.time() >= cached[1]:
+                # the server has renewed its cert by now
+                del self._host_cert_chain_from_host[host]
+                return None
+            return cached[0]
+
+    def _cache_host_cert_chain(self, host, host_cert_chain):
+        if not host_cert_chain:
+            return
+        with self._lock:
+            _cache_put(self._host_cert_chain_from_host, host, (host_cert_chain, get_not_after_of_certs(host_cert_chain)))
+
+    @staticmethod
+    async def _async_do_handshake(conn, reader, writer):
+        while True:
+            try:
+                conn.do_handshake()
+                done = True
+            except OpenSSL.SSL.WantReadError:
+                done = False
+            # send the records written by openssl to the memory BIO
+            while True:
+                try:
+                    data = conn.bio_read(65536)
+                except OpenSSL.SSL.WantReadError:
+                    break
+                writer.write(data)
+            await writer.drain()
+            if done:
+                return
+            data = await reader.read(65536)
+            if not data:
+                raise ConnectionError("connection closed during the TLS handshake")
+            conn.bio_write(data)
+
     def _init_cache_db(self):
         if self.cache_db_con:
             return
         import sqlite3
 
         os.makedirs(os.path.dirname(self.cache_db), exist_ok=True)
-        self.cache_db_con = sqlite3.connect(self.cache_db)
-        self.cache_db_cur = self.cache_db_con.cursor()
+        self._local.cache_db_con = self._connect_db(self.cache_db)
+        self._local.cache_db_cur = self.cache_db_con.cursor()
         # note: we do not store the cert's fetch time for better privacy
         # TODO use nssdb format? https://github.com/milahu/nssdb-py
         # how does chrome cache the fetched certs?
@@ -250,6 +478,67 @@ class AIASession:
             if str(exc) != "table certs already exists":
                 raise
 
+    def _init_chain_cache_db(self):
+        if self.chain_cache_db_con:
+            return
+        if os.path.dirname(self.chain_cache_db):
+            os.makedirs(os.path.dirname(self.chain_cache_db), exist_ok=True)
+        # wait for the writers of other processes instead of failing
+        con = self._connect_db(self.chain_cache_db, timeout=30)
+        # readers do not block the writer, and the writer does not block the readers
+        con.execute("PRAGMA journal_mode=WAL")
+        query = "\n".join(
+            [
+                "CREATE TABLE IF NOT EXISTS chains (",
+                "  host TEXT PRIMARY KEY,",
+                "  leaf_sha256 BLOB NOT NULL,",
+                "  cadata TEXT NOT NULL,",
+                "  not_after REAL NOT NULL",
+                ")",
+            ]
+        )
+        with con:
+            con.execute(query)
+        self._local.chain_cache_db_con = con
+
+    def _read_chain_cache(self, host, host_cert_chain):
+        """
+        Get the verified certificate chain of host from chain_cache_db,
+        or None when there is none, when a certificate of the chain expired,
+        or when the leaf cert of the chain is not the one in host_cert_chain,
+        the chain presented by the server now.
+        """
+        if not self.chain_cache_db or not host_cert_chain:
+            # caching is disabled, or the server sent no cert
+            return None
+        self._init_chain_cache_db()
+        query = "select cadata from chains where host = ? and leaf_sha256 = ? and not_after > ?"
+        args = (host, _get_leaf_sha256(host_cert_chain), time.time())
+        row = self.chain_cache_db_con.execute(query, args).fetchone()
+        if not row:
+            # the server can have a new leaf cert, issued by another CA
+            logger.debug(f"not found chain in chain_cache_db: {host}")
+            return None
+        logger.debug(f"found chain in chain_cache_db: {host}")
+        certs = x509.load_pem_x509_certificates(row[0].encode("ascii"))
+        return [OpenSSL.crypto.X509.from_cryptography(cert) for cert in certs]
+
+    def _write_chain_cache(self, host, cert_chain, cadata):
+        """
+        Store the verified certificate chain of host in chain_cache_db,
+        with the fingerprint of the leaf cert,
+        until the earliest ``notAfter`` of the chain.
+        """
+        if not self.chain_cache_db:
+            # caching is disabled
+            return
+        logger.debug(f"adding chain to chain_cache_db: {host}")
+        self._init_chain_cache_db()
+        query = "insert or replace into chains (host, leaf_sha256, cadata, not_after) values (?, ?, ?, ?)"
+        args = (host, _get_leaf_sha256(cert_chain), cadata, get_not_after_of_cadata(cadata))
+        with self.chain_cache_db_con:
+            self.chain_cache_db_con.execute(query, args)
+
     def _read_cert_cache(self, url_parsed):
         if not self.cache_dir and not self.cache_db:
             # caching is disabled
@@ -269,7 +558,8 @@ class AIASession:
                 # for OpenSSL.crypto.X509StoreContext
                 # cert = x509.load_der_x509_certificate(cert_der)
                 cert = OpenSSL.crypto.load_certificate(OpenSSL.crypto.FILETYPE_ASN1, cert_der)
-                return cert
+                if not _has_expired(cert):
+                    return cert
         if self.cache_dir:
             cache_path = self.cache_dir + "/" + url_parsed.netloc + url_parsed.path
             if os.path.exists(cache_path):
@@ -280,7 +570,8 @@ class AIASession:
                 # for OpenSSL.crypto.X509StoreContext
                 # cert = x509.load_der_x509_certificate(cert_der)
                 cert = OpenSSL.crypto.load_certificate(OpenSSL.crypto.FILETYPE_ASN1, cert_der)
-                return cert
+                if not _has_expired(cert):
+                    return cert
         logger.debug(f"not found cert in cache: {url}")
 
     def _write_cert_cache(self, url_parsed, cert):
@@ -292,7 +583,8 @@ class AIASession:
         if self.cache_db:
             logger.debug(f"adding cert to cache_db: {url}")
             self._init_cache_db()
-            query = "insert into certs (url, cert_der) values (?, ?)"
+            # another thread or process can have added the cert meanwhile
+            query = "insert or replace into certs (url, cert_der) values (?, ?)"
             args = (url, cert_der)
             cur = self.cache_db_cur.execute(query, args)
             if cur.rowcount != 1:
@@ -374,7 +666,6 @@ class AIASession:
 
         raise AIAError(f"failed to parse cert from cert_bytes {cert_bytes.hex()}")
 
-    @CachedMethod
     def _get_ca_issuer_cert(self, url, timeout=5):
         """
         Get an intermediary DER (binary) certificate in the chain
@@ -382,16 +673,20 @@ class AIASession:
         as the CA Issuer URI in the AIA extension
         of the previous "node" (certificate) of the chain.
         """
+        cert = self._cached_ca_issuer_cert(url)
+        if cert is not None:
+            return cert
         url_parsed = urlsplit(url)
         if url_parsed.scheme != "http":
             # ERR_DISALLOWED_URL_SCHEME
             raise AIASchemeError("Invalid CA issuer certificate URI protocol")
         cert = self._read_cert_cache(url_parsed)
         if cert:
+            with self._lock:
+                _cache_put(self._ca_issuer_cert_from_url, url, cert)
             return cert
         logger.debug(f"Downloading CA issuer certificate from {url}")
         req = Request(url=url, headers={"User-Agent": self.user_agent})
-        # TODO async? asyncio + aiohttp
         with urlopen(req, timeout=timeout) as resp:
             if resp.status != 200:
                 raise AIADownloadError(f"HTTP {resp.status} (CA Issuer Cert.)")
@@ -403,8 +698,64 @@ class AIASession:
             # AiaRequest::AddCompletedFetchToResults
             cert = self._load_cert_from_bytes(cert_bytes)
             self._write_cert_cache(url_parsed, cert)
+            with self._lock:
+                _cache_put(self._ca_issuer_cert_from_url, url, cert)
             return cert
 
+    async def _async_get_ca_issuer_cert(self, session, urls):
+        """
+        Same to the ``_get_ca_issuer_cert`` method, but downloads with aiohttp,
+        from all the CA Issuer URIs of the certificate at once.
+        The first certificate downloaded wins.
+        """
+        for url in urls:
+            cert = self._cached_ca_issuer_cert(url)
+            if cert is not None:
+                return cert
+        urls = [url for url in urls if urlsplit(url).scheme == "http"]
+        if not urls:
+            # ERR_DISALLOWED_URL_SCHEME
+            raise AIASchemeError("Invalid CA issuer certificate URI protocol")
+        tasks = [asyncio.ensure_future(self._async_download_ca_issuer_cert(session, url)) for url in urls]
+        errors = []
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    return await next_done
+                except Exception as exc:
+                    errors.append(exc)
+            raise errors[0]
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _async_download_ca_issuer_cert(self, session, url):
+        url_parsed = urlsplit(url)
+        loop = asyncio.get_running_loop()
+        caching = self.cache_dir or self.cache_db
+        cert = None
+        if caching:
+            # the cert cache blocks, it runs in the download threads
+            cert = await loop.run_in_executor(self._get_fetch_executor(), self._read_cert_cache, url_parsed)
+        if not cert:
+            logger.debug(f"Downloading CA issuer certificate from {url}")
+            async with session.get(url) as resp:
+                if resp.status != 200:
+                    raise AIADownloadError(f"HTTP {resp.status} (CA Issuer Cert.)")
+                cert_bytes = await resp.read()
+            cert = self._load_cert_from_bytes(cert_bytes)
+            if caching:
+                await loop.run_in_executor(self._get_fetch_executor(), self._write_cert_cache, url_parsed, cert)
+        with self._lock:
+            _cache_put(self._ca_issuer_cert_from_url, url, cert)
+        return cert
+
+    def _cached_ca_issuer_cert(self, url):
+        cert = self._ca_issuer_cert_from_url.get(url)
+        if cert is None or _has_expired(cert):
+            return None
+        return cert
+
     def add_trusted_root_cert_file(self, cert_file):
         with open(cert_file, "rb") as f:
             cert_bytes = f.read()
@@ -426,12 +777,13 @@ class AIASession:
         if cert.get_issuer() != cert.get_subject():
             raise ValueError("must be a self-signed cert")
         cert_digest = cert.digest("sha256")
-        for c in self._trusted_root_certs:
-            if c.digest("sha256") == cert_digest:
+        with self._lock:
+            if cert_digest in self._trusted_root_certs:
                 return False  # cert already was added
-        digest_hex = cert_digest  # .decode("ascii").replace(":", "").lower()
-        logger.debug(f"adding trusted root cert {digest_hex}")
-        self._trusted_root_certs.append(cert)
+            digest_hex = cert_digest  # .decode("ascii").replace(":", "").lower()
+            logger.debug(f"adding trusted root cert {digest_hex}")
+            self._trusted_root_certs[cert_digest] = cert
+            self._chase_cert_store = None
         return True  # cert was added
 
     def remove_trusted_root_cert(self, cert):
@@ -441,10 +793,46 @@ class AIASession:
             cert = OpenSSL.crypto.X509.from_cryptography(cert)
         assert isinstance(cert, OpenSSL.crypto.X509)
         cert_digest = cert.digest("sha256")
-        len1 = len(self._trusted_root_certs)
-        self._trusted_root_certs = list(filter(lambda c: c.digest("sha256") != cert_digest, self._trusted_root_certs))
-        len2 = len(self._trusted_root_certs)
-        return len1 != len2  # return True if cert was removed
+        with self._lock:
+            if self._trusted_root_certs.pop(cert_digest, None) is None:
+                return False
+            # the store can not forget a cert, it is built again
+            self._chase_cert_store = None
+        self._forget_chains_of_root_cert(cert)
+        return True  # cert was removed
+
+    def _forget_chains_of_root_cert(self, root_cert):
+        """
+        Remove the cached chains ending in root_cert, in memory and in chain_cache_db,
+        so they are chased again with the remaining trusted root certs.
+        """
+        # the cadata of a chain holds the PEM of each of its certs
+        root_pem = dump_certificate(FILETYPE_PEM, root_cert).decode("ascii")
+        root_digest = root_cert.digest("sha256")
+        with self._lock:
+            for name, cached in list(self._cadata_from_name.items()):
+                if root_pem in cached[0]:
+                    del self._cadata_from_name[name]
+            for key, cached in list(self._ssl_context_from_host.items()):
+                if root_pem in cached[2]:
+                    del self._ssl_context_from_host[key]
+            for host, (host_cert_chain, _not_after) in list(self._host_cert_chain_from_host.items()):
+                if host_cert_chain[-1].get_issuer() == root_cert.get_subject() or any(
+                    cert.digest("sha256") == root_digest for cert in host_cert_chain
+                ):
+                    del self._host_cert_chain_from_host[host]
+            for url, cert in list(self._ca_issuer_cert_from_url.items()):
+                if cert.digest("sha256") == root_digest:
+                    del self._ca_issuer_cert_from_url[url]
+            for host, cached in list(self._cafile_from_host.items()):
+                if root_pem in cached[0]:
+                    # removed on close, a request can still be reading it
+                    self._old_cafiles.append(cached[1])
+                    del self._cafile_from_host[host]
+        if self.chain_cache_db:
+            self._init_chain_cache_db()
+            with self.chain_cache_db_con:
+                self.chain_cache_db_con.execute("delete from chains where instr(cadata, ?) > 0", (root_pem,))
 
     def aia_chase(self, host, timeout=5):
         """
@@ -487,64 +875,163 @@ class AIASession:
         # not necessarily a chain with leaf_cert
         rest_certs = host_cert_chain[1:]
 
-        # local cert store so we can add temporary certs
-        # https://www.pyopenssl.org/en/stable/api/crypto.html#x509store-objects
-        cert_store = self._ssl_context.get_cert_store()
+        cert_store = self._get_chase_cert_store()
+
+        missing_certs = []
+
+        for _verify_chain_idx in range(self._get_chase_depth()):
+            verified_cert_chain, cert = self._verify_chain_step(cert_store, leaf_cert, rest_certs, missing_certs)
+            if verified_cert_chain is not None:
+                return verified_cert_chain, missing_certs
+            # usually, the whole missing part of the chain is fetched here,
+            # and the next verification succeeds
+            missing_certs.extend(self._walk_ca_issuer_certs(cert, [leaf_cert] + rest_certs + missing_certs, timeout))
 
-        # add trusted root certs
-        for cert in self._trusted_root_certs:
-            cert_store.add_cert(cert)
+        # on success, we return from the previous for loop
+        raise AIAError("exceeded verify_depth")
 
+    def _walk_ca_issuer_certs(self, cert, known_certs, timeout):
+        """
+        Fetch the missing issuer of cert, then the issuer of that issuer, and so on,
+        without verifying the whole chain between the fetches.
+        The walk stops at a self-signed cert, at a cert issued by a known cert,
+        or at a cert issued by a trusted cert. Only names are compared,
+        the chain is verified once, by the caller, when the walk is done.
+        """
+        fetched_certs = []
+        known_subjects = {known_cert.get_subject().der() for known_cert in known_certs}
+        trusted_subjects = self._get_chase_trusted_subjects()
+        for _fetch_idx in range(self._get_chase_depth()):
+            logger.debug(f"fetching missing issuer cert for cert {cert.get_subject()}")
+            issuer_cert = self._fetch_ca_issuer_cert(get_ca_issuers_of_cert(cert), timeout)
+            logger.debug(f"issuer_cert subject {issuer_cert.get_subject()}")
+            fetched_certs.append(issuer_cert)
+            if issuer_cert.get_issuer() == issuer_cert.get_subject():
+                break
+            if issuer_cert.get_issuer().der() in known_subjects:
+                break
+            if issuer_cert.get_issuer().der() in trusted_subjects or issuer_cert.get_subject().der() in trusted_subjects:
+                break
+            known_subjects.add(issuer_cert.get_subject().der())
+            if not get_ca_issuers_of_cert(issuer_cert):
+                break
+            cert = issuer_cert
+        return fetched_certs
+
+    def _fetch_ca_issuer_cert(self, urls, timeout):
+        """
+        Get the CA issuer cert from the first of the CA Issuer URIs that answers.
+        Alternate URIs are downloaded at the same time.
+        """
+        if len(urls) == 1:
+            return self._get_ca_issuer_cert(urls[0], timeout)
+        executor = self._get_fetch_executor()
+        futures = [executor.submit(self._get_ca_issuer_cert, url, timeout) for url in urls]
+        errors = []
+        try:
+            for future in as_completed(futures):
+                try:
+                    return future.result()
+                except Exception as exc:
+                    errors.append(exc)
+            raise errors[0]
+        finally:
+            for future in futures:
+                future.cancel()
+
+    async def async_aia_chase(self, host, timeout=5):
+        """
+        Same to the ``aia_chase`` method, but the host certificate chain
+        and the missing certs are downloaded with asyncio and aiohttp.
+        """
+        import aiohttp
+
+        host_cert_chain = await self.async_get_host_cert_chain(host, timeout)
+        if not host_cert_chain:
+            return None, None
+
+        leaf_cert = host_cert_chain[0]
+        rest_certs = host_cert_chain[1:]
+        cert_store = self._get_chase_cert_store()
         missing_certs = []
 
+        async with aiohttp.ClientSession(
+            headers={"User-Agent": self.user_agent},
+            timeout=aiohttp.ClientTimeout(total=timeout),
+        ) as session:
+            for _verify_chain_idx in range(self._get_chase_depth()):
+                verified_cert_chain, cert = self._verify_chain_step(cert_store, leaf_cert, rest_certs, missing_certs)
+                if verified_cert_chain is not None:
+                    return verified_cert_chain, missing_certs
+                logger.debug(f"fetching missing issuer cert for cert {cert.get_subject()}")
+                issuer_cert = await self._async_get_ca_issuer_cert(session, get_ca_issuers_of_cert(cert))
+                logger.debug(f"issuer_cert subject {issuer_cert.get_subject()}")
+                missing_certs.append(issuer_cert)
+
+        raise AIAError("exceeded verify_depth")
+
+    def _get_chase_cert_store(self):
+        with self._lock:
+            if self._chase_cert_store is None:
+                # a dedicated store: the store of _ssl_context is left untouched
+                # https://www.pyopenssl.org/en/stable/api/crypto.html#x509store-objects
+                cert_store = OpenSSL.crypto.X509Store()
+                cert_store.load_locations(self.cafile)
+                for cert in self._trusted_root_certs.values():
+                    cert_store.add_cert(cert)
+                # the names of the certs of the store, for the walk of the missing issuers
+                with open(self.cafile, "rb") as f:
+                    cafile_certs = x509.load_pem_x509_certificates(f.read())
+                self._chase_trusted_subjects = {cert.subject.public_bytes() for cert in cafile_certs} | {
+                    cert.get_subject().der() for cert in self._trusted_root_certs.values()
+                }
+                self._chase_cert_store = cert_store
+            return self._chase_cert_store
+
+    def _get_chase_trusted_subjects(self):
+        with self._lock:
+            self._get_chase_cert_store()
+            return self._chase_trusted_subjects
+
+    def _get_chase_depth(self):
         # avoid infinite loop
         verify_depth = self._ssl_context.get_verify_depth()
         if verify_depth == -1:
             verify_depth = 1000
+        return verify_depth
 
-        for _verify_chain_idx in range(verify_depth):
-
-            # logger.debug("verify_chain_idx", verify_chain_idx)
-
-            cert_store_ctx = OpenSSL.crypto.X509StoreContext(cert_store, leaf_cert, rest_certs + missing_certs)
+    def _verify_chain_step(self, cert_store, leaf_cert, rest_certs, missing_certs):
+        """
+        Verify the chain once.
+        Return the verified chain, or the cert whose issuer is missing.
+        """
+        cert_store_ctx = OpenSSL.crypto.X509StoreContext(cert_store, leaf_cert, rest_certs + missing_certs)
 
-            try:
-                cert_store_ctx.verify_certificate()
-                # full chain is valid
+        try:
+            cert_store_ctx.verify_certificate()
+            # full chain is valid
+            return self._get_verified_cert_chain(cert_store_ctx), None
+
+        except OpenSSL.crypto.X509StoreContextError as exc:
+
+            if exc.errors[0] == 20:
+                # exc.errors [20, 1, 'unable to get local issuer certificate']
+                cert = exc.certificate
+                if len(get_ca_issuers_of_cert(cert)) == 0:
+                    raise AIAError("unable to get local issuer certificate: " "cert has no aia_ca_issuers")
+                return None, cert
+
+            if exc.errors[0] == 19:
+                # exc.errors [19, 1, 'self-signed certificate in certificate chain']
+                logger.debug("chain ends with untrusted root cert. " "hint: aia_session.add_trusted_root_cert(cert)")
+                # add return values to exception
+                # exc._aia_verified_cert_chain[-1] is the untrusted root cert
                 verified_cert_chain = self._get_verified_cert_chain(cert_store_ctx)
-                return verified_cert_chain, missing_certs
-
-            except OpenSSL.crypto.X509StoreContextError as exc:
-
-                if exc.errors[0] == 20:
-                    # exc.errors [20, 1, 'unable to get local issuer certificate']
-                    cert = exc.certificate
-                    logger.debug(f"fetching missing issuer cert for cert {cert.get_subject()}")
-                    aia_ca_issuers = get_ca_issuers_of_cert(cert)
-                    logger.debug("aia_ca_issuers", aia_ca_issuers)
-                    if len(aia_ca_issuers) == 0:
-                        raise AIAError("unable to get local issuer certificate: " "cert has no aia_ca_issuers")
-                    issuer_cert = self._get_ca_issuer_cert(aia_ca_issuers[0], timeout)
-                    logger.debug("issuer_cert subject", issuer_cert.get_subject())
-                    # logger.debug("issuer_cert issuer ", issuer_cert.get_issuer())
-                    missing_certs.append(issuer_cert)
-                    # print_chain(missing_certs, "missing_certs")
-                    continue
+                exc._aia_verified_cert_chain = verified_cert_chain
+                exc._aia_missing_certs = missing_certs
+                raise exc
 
-                if exc.errors[0] == 19:
-                    # exc.errors [19, 1, 'self-signed certificate in certificate chain']
-                    logger.debug("chain ends with untrusted root cert. " "hint: aia_session.add_trusted_root_cert(cert)")
-                    # add return values to exception
-                    # exc._aia_verified_cert_chain[-1] is the untrusted root cert
-                    verified_cert_chain = self._get_verified_cert_chain(cert_store_ctx)
-                    exc._aia_verified_cert_chain = verified_cert_chain
-                    exc._aia_missing_certs = missing_certs
-                    raise exc
-
-                raise
-
-        # on success, we return from the previous for loop
-        raise AIAError("exceeded verify_depth")
+            raise
 
     def _get_verified_cert_chain(self, cert_store_ctx):
         # based on OpenSSL.crypto._verify_certificate
@@ -596,50 +1083,140 @@ class AIASession:
 
         logger.debug(f"cadata_and_host_regex_from_host {host}")
 
-        for host_regex in self._cadata_from_host_regex:
-            logger.debug(f"host_regex {host_regex}")
-            if host_regex.fullmatch(host):
-                logger.debug("cadata_and_host_regex_from_host read cache")
-                # read cache
-                cadata = self._cadata_from_host_regex[host_regex]
-                return cadata, host_regex
+        cached = self._cached_cadata_and_host_regex(host)
+        if cached is not None:
+            return cached
 
         logger.debug("cadata_and_host_regex_from_host cache miss")
 
+        # only one thread resolves the chain of a host, the other threads wait for it
+        with self._host_lock(host):
+            cached = self._cached_cadata_and_host_regex(host, count=False)
+            if cached is not None:
+                return cached
+
+            if self.chain_cache_db:
+                # the cached chain must start with the leaf cert presented now.
+                # the handshake is reused by aia_chase on a miss
+                cert_chain = self._read_chain_cache(host, self.get_host_cert_chain(host, timeout))
+                if cert_chain is not None:
+                    return self._cache_cadata_and_host_regex(cert_chain, host)
+
+            # note: this can throw
+            cert_chain, _missing_certs = self.aia_chase(host, timeout)
+
+            cadata, host_regex = self._cache_cadata_and_host_regex(cert_chain, host)
+            self._write_chain_cache(host, cert_chain, cadata)
+            return cadata, host_regex
+
+    async def async_cadata_and_host_regex_from_host(self, host, only_missing=False, timeout=5):
+        """Same to the ``cadata_and_host_regex_from_host`` method, but with ``async_aia_chase``."""
+        host = host.lower()
+
+        cached = self._cached_cadata_and_host_regex(host)
+        if cached is not None:
+            return cached
+
+        # only one task resolves the chain of a host, the other coroutines await it
+        loop = asyncio.get_running_loop()
+        key = (loop, host)
+        with self._lock:
+            task = self._async_chases.get(key)
+            if task is None:
+                task = loop.create_task(self._async_resolve_cadata_and_host_regex(host, timeout))
+                self._async_chases[key] = task
+                task.add_done_callback(partial(self._async_chase_done, key))
+        # a cancelled coroutine does not cancel the chase of the others
+        return await asyncio.shield(task)
+
+    def _async_chase_done(self, key, task):
+        with self._lock:
+            del self._async_chases[key]
+        if not task.cancelled():
+            # the error is raised to the awaiting coroutines, if any is left
+            task.exception()
+
+    async def _async_resolve_cadata_and_host_regex(self, host, timeout):
+        loop = asyncio.get_running_loop()
+
+        if self.chain_cache_db:
+            host_cert_chain = await self.async_get_host_cert_chain(host, timeout)
+            # sqlite blocks, it runs in the download threads
+            cert_chain = await loop.run_in_executor(self._get_fetch_executor(), self._read_chain_cache, host, host_cert_chain)
+            if cert_chain is not None:
+                return self._cache_cadata_and_host_regex(cert_chain, host)
+
         # note: this can throw
-        cert_chain, _missing_certs = self.aia_chase(host, timeout)
+        cert_chain, _missing_certs = await self.async_aia_chase(host, timeout)
+
+        cadata, host_regex = self._cache_cadata_and_host_regex(cert_chain, host)
+        await loop.run_in_executor(self._get_fetch_executor(), self._write_chain_cache, host, cert_chain, cadata)
+        return cadata, host_regex
+
+    async def async_cadata_from_host(self, host, **kwargs):
+        """Same to the ``cadata_from_host`` method, but with ``async_aia_chase``."""
+        cadata, _host_regex = await self.async_cadata_and_host_regex_from_host(host, **kwargs)
+        return cadata
 
+    def _cached_cadata_and_host_regex(self, host, count=True):
+        hostname, _port = _split_host_port(host)
+        # a wildcard only matches the leftmost label
+        wildcard_name = "*." + hostname.partition(".")[2]
+        with self._lock:
+            for name in (hostname, wildcard_name):
+                cached = self._cadata_from_name.get(name)
+                if cached is None:
+                    continue
+                if time.time() >= cached[2]:
+                    # the chain expired: it is chased again, from a new handshake
+                    del self._cadata_from_name[name]
+                    self._host_cert_chain_from_host.pop(host, None)
+                    continue
+                self._cadata_from_name.move_to_end(name)
+                if count:
+                    self.cadata_cache_hits += 1
+                return cached[0], cached[1]
+            if count:
+                self.cadata_cache_misses += 1
+        return None
+
+    def _cache_cadata_and_host_regex(self, cert_chain, host=None):
         target_cert = cert_chain[0]
 
         cadata = "\n".join(dump_certificate(FILETYPE_PEM, cert).decode("ascii") for cert in cert_chain)
 
-        def get_cn_of_name(subject):
-            for component in subject.get_components():
-                if component[0].decode() == "CN":
-                    return component[1].decode()
-            return None
-
-        # Example usage:
-        # Assuming `target_cert` is an X509 object from pyOpenSSL
-        target_name = get_cn_of_name(target_cert.get_subject()).lower()
+        hostname = _split_host_port(host)[0] if host else None
+        # like "example.com" or "*.example.com"
+        target_names = get_dns_names_of_cert(target_cert) or [hostname]
 
-        # If you expect wildcard domains like "*.example.com", you can handle them as follows
-        if target_name.startswith("*."):
-            target_name = target_name[2:]  # Remove the "*."
+        name_regexes = []
+        for target_name in target_names:
+            # "*.example.com" matches a single label before example.com
+            if target_name.startswith("*."):
+                name_regexes.append("[^.]+\\." + re.escape(target_name[2:]))
+            else:
+                name_regexes.append(re.escape(target_name))
 
         # host can have port. target_name has no port
         # port is between 0 and 65535 inclusive
-        host_regex = target_name.replace(".", "\\.").replace("*", ".*") + "(?::[0-9]{1,5})?"
-        host_regex = re.compile(host_regex)
+        host_regex = re.compile("(?:" + "|".join(name_regexes) + ")(?::[0-9]{1,5})?")
 
-        # limit cache size
-        # fifo cache. simpler than lru cache
-        while len(self._cadata_from_host_regex) > 128:
-            key = next(iter(self._cadata_from_host_regex))
-            del self._cadata_from_host_regex[key]
+        # the entry expires with the host cert chain it was chased from
+        not_after = get_not_after_of_certs(cert_chain)
 
-        # write cache
-        self._cadata_from_host_regex[host_regex] = cadata
+        # the entry is found with every name of the leaf cert,
+        # and with the requested host, which can be covered by a wildcard name
+        names = list(dict.fromkeys(target_names + ([hostname] if hostname else [])))
+        cached = (cadata, host_regex, not_after)
+
+        with self._lock:
+            # write cache
+            for name in names:
+                self._cadata_from_name[name] = cached
+                self._cadata_from_name.move_to_end(name)
+            # limit cache size
+            while len(self._cadata_from_name) > self.cadata_cache_size:
+                self._cadata_from_name.popitem(last=False)
 
         return cadata, host_regex
 
@@ -648,25 +1225,104 @@ class AIASession:
         url_parsed = urlsplit(url)
         return self.cadata_from_host(url_parsed.netloc, **kwargs)
 
+    def cafile_from_url(self, url):
+        """
+        Path to a PEM file with the certification chain of the URL host,
+        to be used as a CA bundle (e.g. ``requests.Session.verify``).
+        The file is written once per host and is only rewritten
+        when the chain changes, so it can be reused across requests.
+        The replaced files are kept until ``close``,
+        as other threads can still be using them.
+        """
+        host = urlsplit(url).netloc.lower()
+        cadata = self.cadata_from_url(url)
+        with self._lock:
+            cached = self._cafile_from_host.get(host)
+            if cached and cached[0] == cadata:
+                return cached[1]
+            if not self._cafile_finalizer.alive:
+                # the session is used again after close
+                self._cafile_finalizer = weakref.finalize(self, _remove_cafiles, self._cafile_from_host, self._old_cafiles)
+            fd, path = tempfile.mkstemp(suffix=".pem")
+            try:
+                os.write(fd, cadata.encode("utf-8"))
+            finally:
+                os.close(fd)
+            self._cafile_from_host[host] = (cadata, path)
+            if cached:
+                self._old_cafiles.append(cached[1])
+        return path
+
+    def cached_ssl_context_from_host(self, host, purpose=ssl.Purpose.SERVER_AUTH):
+        """
+        SSLContext previously built by ``ssl_context_from_host``,
+        or None when there is none or when a certificate of its chain expired.
+        """
+        key = (host.lower(), purpose)
+        with self._lock:
+            cached = self._ssl_context_from_host.get(key)
+            if cached is None:
+                return None
+            if time.time() >= cached[1]:
+                del self._ssl_context_from_host[key]
+                return None
+            self._ssl_context_from_host.move_to_end(key)
+            return cached[0]
+
+    def cached_ssl_context_from_url(self, url, purpose=ssl.Purpose.SERVER_AUTH):
+        """Façade to the ``cached_ssl_context_from_host`` method."""
+        return self.cached_ssl_context_from_host(urlsplit(url).netloc, purpose)
+
     def ssl_context_from_host(self, host, purpose=ssl.Purpose.SERVER_AUTH, **kwargs):
         """
         SSLContext instance for a single host name
         that gets (and validates) its certificate chain from AIA.
+        The context is shared between calls
+        until the first certificate of its chain expires.
         """
-        return ssl.create_default_context(
-            purpose=purpose,
-            cadata=self.cadata_from_host(host, **kwargs),
-        )
+        host = host.lower()
+        context = self.cached_ssl_context_from_host(host, purpose)
+        if context is not None:
+            return context
+        cadata = self.cadata_from_host(host, **kwargs)
+        return self._cache_ssl_context(host, purpose, cadata)
+
+    async def async_ssl_context_from_host(self, host, purpose=ssl.Purpose.SERVER_AUTH, **kwargs):
+        """
+        Same to the ``ssl_context_from_host`` method,
+        but the certificate chain is downloaded without blocking the event loop.
+        """
+        host = host.lower()
+        context = self.cached_ssl_context_from_host(host, purpose)
+        if context is not None:
+            return context
+        cadata = await self.async_cadata_from_host(host, **kwargs)
+        return self._cache_ssl_context(host, purpose, cadata)
+
+    def _cache_ssl_context(self, host, purpose, cadata):
+        context = ssl.create_default_context(purpose=purpose, cadata=cadata)
+        not_after = get_not_after_of_cadata(cadata)
+        with self._lock:
+            self._ssl_context_from_host[(host, purpose)] = (context, not_after, cadata)
+            self._ssl_context_from_host.move_to_end((host, purpose))
+            # limit cache size
+            while len(self._ssl_context_from_host) > self.cadata_cache_size:
+                self._ssl_context_from_host.popitem(last=False)
+        return context
 
     def ssl_context_from_url(self, url, purpose=ssl.Purpose.SERVER_AUTH):
         """
         Same to the ``ssl_context_from_host`` method,
         but with the host name obtained from the given URL.
         """
-        return ssl.create_default_context(
-            purpose=purpose,
-            cadata=self.cadata_from_url(url),
-        )
+        return self.ssl_context_from_host(urlsplit(url).netloc, purpose)
+
+    async def async_ssl_context_from_url(self, url, purpose=ssl.Purpose.SERVER_AUTH):
+        """
+        Same to the ``async_ssl_context_from_host`` method,
+        but with the host name obtained from the given URL.
+        """
+        return await self.async_ssl_context_from_host(urlsplit(url).netloc, purpose)
 
     def urlopen(self, url, data=None, timeout=None):
         """Same to ``urllib.request.urlopen``, but handles AIA."""
@@ -0,0 +1,100 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import aiohttp
+
+from .aia_chaser import AIASession
+from .pluxee_async_client import PluxeeAsyncClient
+from .session_pool import _CookieJarPool
+
+
+class PluxeeAsyncSessionPool(_CookieJarPool):
+    """
+    Keeps the login of many accounts, sharing a single connector.
+
+    Only the cookie jar of each account is kept, at most ``maxsize`` of them, the least recently used being evicted.
+    A client of an account still in the pool does not log in again.
+
+    Args:
+        maxsize: The maximum number of accounts kept logged in (defaults to 1024).
+        language: The pluxee website language (either 'fr' or 'nl', defaults to 'fr').
+        timeout: Request timeout in seconds (defaults to 30).
+        limit: Maximum number of simultaneous connections of the shared connector (defaults to 100).
+        parser: The HTML parser backend, either 'html.parser', 'lxml' or 'bs4' (defaults to 'html.parser').
+        aia_session: The AIASession resolving the certificate chain of the website (defaults to a new one, closed with the pool).
+
+    Attrs:
+        hits: The number of clients given a cookie jar holding a login cookie.
+        misses: The number of clients given an empty cookie jar, that will log in.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        language: str = 'fr',
+        timeout: int = 30,
+        limit: int = 100,
+        parser: Optional[str] = None,
+        aia_session: Optional[AIASession] = None,
+    ):
+        super().__init__(maxsize, aiohttp.CookieJar)
+        self._language = language
+        self._timeout = timeout
+        self._limit = limit
+        self._parser = parser
+        self._connector: Optional[aiohttp.TCPConnector] = None
+        self._owns_aia_session = aia_session is None
+        self._aia_session = aia_session or AIASession()
+
+    async def __aenter__(self) -> 'PluxeeAsyncSessionPool':
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def _get_connector(self) -> aiohttp.TCPConnector:
+        if self._connector is None:
+            url = f"https://{PluxeeAsyncClient.DOMAIN}/{self._language}"
+            ssl_context = self._aia_session.cached_ssl_context_from_url(url)
+            if ssl_context is None:
+                ssl_context = await self._aia_session.async_ssl_context_from_url(url)
+            if self._connector is None:
+                self._connector = aiohttp.TCPConnector(ssl=ssl_context, limit=self._limit)
+        return self._connector
+
+    @asynccontextmanager
+    async def client(self, username: str, password: str) -> AsyncIterator[PluxeeAsyncClient]:
+        """Get a client of the account, using the cookie jar of the pool and the shared connector.
+
+        Args:
+            username: The pluxee username.
+            password: The pluxee password.
+        """
+        async with aiohttp.ClientSession(
+            connector=await self._get_connector(),
+            connector_owner=False,
+            cookie_jar=self._checkout(username, password),
+            timeout=aiohttp.ClientTimeout(total=self._timeout),
+        ) as session:
+            client = PluxeeAsyncClient(
+                username,
+                password,
+                self._language,
+                session=session,
+                timeout=self._timeout,
+                parser=self._parser,
+                aia_session=self._aia_session,
+            )
+            try:
+                yield client
+            finally:
+                await client.close()
+
+    async def close(self):
+        """Forget every login and close the shared connector."""
+        self._jars.clear()
+        if self._connector is not None:
+            await self._connector.close()
+            self._connector = None
+        if self._owns_aia_session:
+            self._aia_session.close()
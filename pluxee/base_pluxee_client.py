@@ -1,12 +1,16 @@
 import os
-from datetime import date, datetime
+import time
+from datetime import date
+from email.utils import parsedate_to_datetime
 from enum import Enum
-from typing import List, Optional, Type, Union
+from functools import total_ordering
+from typing import Dict, List, Optional, Tuple, Type, Union
 
 import requests
-from bs4 import BeautifulSoup
 
+from . import parsers
 from .exceptions import PluxeeAPIError, PluxeeLoginError
+from .response_cache import CachedResponse, ResponseCache
 
 try:
     import aiohttp
@@ -31,14 +35,46 @@ class PassType(str, Enum):
     GIFT = "GIFT"
 
 
-class PluxeeBalance:
+class _Record:
+    # An immutable record without __dict__. The order of __slots__ is the order of the constructor arguments.
+
+    __slots__: Tuple[str, ...] = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def as_tuple(self) -> tuple:
+        """The values in the order of the constructor arguments."""
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def _key(self) -> tuple:
+        return self.as_tuple()
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __reduce__(self):
+        return type(self), self.as_tuple()
+
+
+class PluxeeBalance(_Record):
     """The balance of each pass."""
 
+    __slots__ = ("lunch_pass", "eco_pass", "gift_pass", "conso_pass")
+
     def __init__(self, lunch_pass: float, eco_pass: float, gift_pass: float, conso_pass: float):
-        self.lunch_pass = lunch_pass
-        self.eco_pass = eco_pass
-        self.gift_pass = gift_pass
-        self.conso_pass = conso_pass
+        object.__setattr__(self, "lunch_pass", lunch_pass)
+        object.__setattr__(self, "eco_pass", eco_pass)
+        object.__setattr__(self, "gift_pass", gift_pass)
+        object.__setattr__(self, "conso_pass", conso_pass)
 
     def __str__(self):
         return f"lunch_pass: {self.lunch_pass}\neco_pass: {self.eco_pass}\ngift_pass: {self.gift_pass}\nconso_pass: {self.conso_pass}"
@@ -47,14 +83,25 @@ class PluxeeBalance:
         return self.__str__()
 
 
-class PluxeeTransaction:
-    """A payment or the reception of your pass."""
+@total_ordering
+class PluxeeTransaction(_Record):
+    """A payment or the reception of your pass. Transactions are ordered by date, amount, merchant and detail."""
+
+    __slots__ = ("date", "amount", "detail", "merchant")
 
     def __init__(self, date: date, amount: float, detail: str, merchant: str):
-        self.date = date
-        self.amount = amount
-        self.detail = detail
-        self.merchant = merchant
+        object.__setattr__(self, "date", date)
+        object.__setattr__(self, "amount", amount)
+        object.__setattr__(self, "detail", detail)
+        object.__setattr__(self, "merchant", merchant)
+
+    def _key(self) -> tuple:
+        return self.date, self.amount, self.merchant, self.detail
+
+    def __lt__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self._key() < other._key()
 
     def __str__(self):
         return f"date: {self.date}\namount: {self.amount}\ndetail: {self.detail}\nmerchant: {self.merchant}"
@@ -78,6 +125,8 @@ class _PluxeeClient:
         password: The pluxee password.
         language: The pluxee website language (either 'fr' or 'nl', defaults to 'fr').
         timeout: Request timeout in seconds (defaults to 30).
+        parser: The HTML parser backend, either 'html.parser', 'lxml' or 'bs4' (defaults to 'html.parser').
+        response_cache: A cache of the downloaded pages, which can be shared between clients (defaults to None, no cache).
 
     Attrs:
         username: The pluxee username.
@@ -87,23 +136,25 @@ class _PluxeeClient:
 
     DOMAIN = "users.pluxee.be"
 
-    LUNCH_PASS_SELECTOR = (
-        'body > div > header > div.header-fixed > div.balance-block > div > ul > li > a[href*="LUNCH"] > span.balance--price'
-    )
-    ECO_PASS_SELECTOR = (
-        'body > div > header > div.header-fixed > div.balance-block > div > ul > li > a[href*="ECO"] > span.balance--price'
-    )
-    GIFT_PASS_SELECTOR = (
-        'body > div > header > div.header-fixed > div.balance-block > div > ul > li > a[href*="GIFT"] > span.balance--price'
-    )
-    CONSO_PASS_SELECTOR = (
-        'body > div > header > div.header-fixed > div.balance-block > div > ul > li > a[href*="CONSO"] > span.balance--price'
-    )
-    TRANSACTION_SELECTOR = "body > div.dialog-off-canvas-main-canvas > div > div > div.transaction--section > div.transaction-list--section > div.transactions-list--table > div > table > tbody > tr"
-    TRANSACTION_TABLE_SELECTOR = "body > div.dialog-off-canvas-main-canvas > div > div > div.transaction--section > div.transaction-list--section > div.transactions-list--table > div > table"
+    LUNCH_PASS_SELECTOR = parsers.LUNCH_PASS_SELECTOR
+    ECO_PASS_SELECTOR = parsers.ECO_PASS_SELECTOR
+    GIFT_PASS_SELECTOR = parsers.GIFT_PASS_SELECTOR
+    CONSO_PASS_SELECTOR = parsers.CONSO_PASS_SELECTOR
+    TRANSACTION_SELECTOR = parsers.TRANSACTION_SELECTOR
+    TRANSACTION_TABLE_SELECTOR = parsers.TRANSACTION_TABLE_SELECTOR
+
+    LOGGED_IN_MARKER = "logout"
+    LOGGED_IN_SCAN_LIMIT = 32768
 
     def __init__(
-        self, username: str, password: str, language: str = 'fr', session: Optional[Session_Type] = None, timeout: int = 30
+        self,
+        username: str,
+        password: str,
+        language: str = 'fr',
+        session: Optional[Session_Type] = None,
+        timeout: int = 30,
+        parser: Optional[str] = None,
+        response_cache: Optional[ResponseCache] = None,
     ):
         if language not in _TRANSACTION_PATHS:
             raise ValueError(f"Invalid language '{language}'. Must be one of: {list(_TRANSACTION_PATHS.keys())}")
@@ -116,29 +167,102 @@ class _PluxeeClient:
         self._base_url_balance = f"{self._base_url_localized}"
         self._base_url_transactions = f"{self._base_url_localized}/{_TRANSACTION_PATHS[self._language]}"
         self._session = session
+        self._parser = parsers.get_parser(parser)
+        self._response_cache = response_cache
+        # Set by each login, they schedule the keep-alive refresh.
+        self._logged_in_at: Optional[float] = None
+        self._cookie_expires_at: Optional[float] = None
+        # Set once the website accepted the credentials, the transaction store is only served after that.
+        self._credentials_checked = False
+
+    @staticmethod
+    def _parse_cookie_expiry(set_cookie: str, now: Optional[float] = None) -> Optional[float]:
+        """Get the expiry timestamp of the first cookie of a ``set-cookie`` header, None for a session cookie."""
+        expires_at = None
+        for attribute in set_cookie.split(";")[1:]:
+            name, _, value = attribute.strip().partition("=")
+            name = name.lower()
+            if name == "max-age":
+                try:
+                    # Max-Age has precedence over Expires.
+                    return (time.time() if now is None else now) + int(value)
+                except ValueError:
+                    continue
+            if name == "expires":
+                try:
+                    expires_at = parsedate_to_datetime(value).timestamp()
+                except (TypeError, ValueError):
+                    pass
+        return expires_at
+
+    def _record_login(self, set_cookie: str):
+        self._credentials_checked = True
+        self._logged_in_at = time.time()
+        self._cookie_expires_at = self._parse_cookie_expiry(set_cookie, self._logged_in_at)
+
+    def _next_login_delay(self, refresh_interval: float, margin: float) -> float:
+        """Get the number of seconds before the keep-alive has to log in again."""
+        if self._logged_in_at is None:
+            return 0.0
+        if self._cookie_expires_at is None:
+            refresh_at = self._logged_in_at + refresh_interval
+        else:
+            # Never refresh in the first half of the cookie life, a short lived cookie does not make the loop spin.
+            half_life = self._logged_in_at + (self._cookie_expires_at - self._logged_in_at) / 2
+            refresh_at = max(self._cookie_expires_at - margin, half_life)
+        return max(0.0, refresh_at - time.time())
+
+    def _is_logged_in(self, status_code: int, url: str, content: Union[str, bytes]) -> bool:
+        """Tell whether a page was served to a logged in session, without scanning or copying the whole page."""
+        if status_code >= 400 or "/user/login" in url:
+            return False
+        # The logout link is in the header, at the top of the page.
+        marker = self.LOGGED_IN_MARKER if isinstance(content, str) else self.LOGGED_IN_MARKER.encode()
+        return content.find(marker, 0, self.LOGGED_IN_SCAN_LIMIT) != -1
+
+    def _get_cached_response(
+        self, url: str, params: Dict[str, Union[str, int]]
+    ) -> Tuple[Optional[str], Optional[CachedResponse]]:
+        if self._response_cache is None:
+            return None, None
+        # Scoped to the credentials, a wrong password never reads the pages of the account.
+        key = self._response_cache.key(self._username, self._password, url, params)
+        return key, self._response_cache.get(key)
+
+    def _cache_response(self, key: Optional[str], response: _ResponseWrapper, headers) -> _ResponseWrapper:
+        # Only the pages of a logged in session are cached.
+        if key is not None and response.status_code == 200:
+            self._response_cache.put(key, response.content, response.status_code, headers)
+        return response
 
     @staticmethod
     def _price_to_float(price) -> float:
         return float(price.replace("€", "").replace(",", ".").replace("EUR", "").strip().replace(" ", ""))
 
-    def _parse_balance_from_response(self, response: _ResponseWrapper) -> PluxeeBalance:
-        soup = BeautifulSoup(response.content, features="html.parser")
-
-        lunch_tag = soup.select_one(self.LUNCH_PASS_SELECTOR)
-        lunch = self._price_to_float(lunch_tag.text) if lunch_tag is not None else 0
-
-        eco_tag = soup.select_one(self.ECO_PASS_SELECTOR)
-        eco = self._price_to_float(eco_tag.text) if eco_tag is not None else 0
-
-        gift_tag = soup.select_one(self.GIFT_PASS_SELECTOR)
-        gift = self._price_to_float(gift_tag.text) if gift_tag is not None else 0
+    @staticmethod
+    def _parse_date(text: str) -> date:
+        # Faster than datetime.strptime for the fixed "%d.%m.%Y" format.
+        day, month, year = text.strip().split(".")
+        return date(int(year), int(month), int(day))
+
+    def _parse_prices(self, response: _ResponseWrapper) -> Dict[str, Optional[str]]:
+        prices = self._parser.parse_balance(response.content)
+        if all(price is None for price in prices.values()):
+            raise PluxeeAPIError("Could not find the balance in the response")
+        return prices
 
-        conso_tag = soup.select_one(self.CONSO_PASS_SELECTOR)
-        conso = self._price_to_float(conso_tag.text) if conso_tag is not None else 0
+    def _parse_pass_types_from_response(self, response: _ResponseWrapper) -> List[PassType]:
+        """Get the pass types of the account, those with a balance on the page."""
+        prices = self._parse_prices(response)
+        return [pass_type for pass_type in PassType if prices[pass_type] is not None]
 
-        if (lunch_tag, eco_tag, gift_tag, conso_tag) == (None, None, None, None):
-            raise PluxeeAPIError("Could not find the balance in the response")
+    def _parse_balance_from_response(self, response: _ResponseWrapper) -> PluxeeBalance:
+        prices = self._parse_prices(response)
 
+        lunch, eco, gift, conso = (
+            self._price_to_float(price) if price is not None else 0
+            for price in (prices[PassType.LUNCH], prices[PassType.ECO], prices[PassType.GIFT], prices[PassType.CONSO])
+        )
         return PluxeeBalance(lunch, eco, gift, conso)
 
     def _parse_transactions_from_response(
@@ -148,38 +272,43 @@ class _PluxeeClient:
         since: Optional[date] = None,
         until: Optional[date] = None,
     ) -> bool:
-        dom = BeautifulSoup(response.content, features="html.parser")
+        page, complete = self._parse_transactions_page(response, since, until, bool(transactions))
+        transactions.extend(page)
+        return complete
 
-        table = dom.select_one(self.TRANSACTION_TABLE_SELECTOR)
-        if not table:
-            if not transactions:
+    def _parse_transactions_page(
+        self,
+        response: _ResponseWrapper,
+        since: Optional[date] = None,
+        until: Optional[date] = None,
+        has_previous: bool = False,
+    ) -> Tuple[List[PluxeeTransaction], bool]:
+        """Parse one page of transactions, newest first, and tell whether it is the last page needed."""
+        rows = self._parser.iter_transaction_rows(response.content)
+        if rows is None:
+            if not has_previous:
                 # If there is no table, it means something unexpected happened.
                 raise PluxeeAPIError("No transaction table found and no prior transactions collected")
             else:
-                # In the case where we already have some transactions in the list, it means we have reached an empty page.
-                return True
-
-        entries = dom.select(self.TRANSACTION_SELECTOR)
-        complete = len(entries) < 10
-        for entry in entries:
-            date_dom = entry.select_one("td.views-field-date")
-            merchant_dom = entry.select_one("td.views-field-description")
-            description_dom = entry.select_one("td.views-field-detail")
-            amount_dom = entry.select_one("td.views-field-amount > span")
-
-            if date_dom is None or merchant_dom is None or description_dom is None or amount_dom is None:
+                # In the case where we already have some transactions, it means we have reached an empty page.
+                return [], True
+
+        transactions: List[PluxeeTransaction] = []
+        row_count = 0
+        for row_count, (date_text, merchant, description, amount_text) in enumerate(rows, 1):
+            if date_text is None or merchant is None or description is None or amount_text is None:
                 raise PluxeeAPIError("Could not find the transactions in the response")
 
-            date = datetime.strptime(date_dom.text.strip(), "%d.%m.%Y").date()
-            merchant = merchant_dom.text.strip()
-            description = description_dom.text.strip()
-            amount = self._price_to_float(amount_dom.text)
+            date = self._parse_date(date_text)
             if since and date < since:
-                complete = True
-                break
+                # The rows are sorted from the newest, the remaining rows are not parsed.
+                return transactions, True
             if not until or date < until:
-                transactions.append(PluxeeTransaction(date, amount, description, merchant))
-        return complete
+                transactions.append(
+                    PluxeeTransaction(date, self._price_to_float(amount_text), description.strip(), merchant.strip())
+                )
+        # A full page holds 10 transactions, a shorter page is the last one.
+        return transactions, row_count < 10
 
     def gen_login_post_args(self):
         return {
@@ -0,0 +1,344 @@
+"""
+The parser backends extracting the information from the Pluxee webpages.
+
+The default one streams the page through the standard ``html.parser`` without building a tree.
+``lxml`` can be used when it is installed, and BeautifulSoup is kept as the reference implementation.
+"""
+
+from abc import ABC, abstractmethod
+from collections import deque
+from html.parser import HTMLParser
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+from bs4 import BeautifulSoup
+
+try:
+    import lxml.html
+
+    LXML_AVAILABLE = True
+except ImportError:
+    LXML_AVAILABLE = False
+
+
+# The values of PassType, which can not be imported here without a circular import.
+PASS_TYPES = ("LUNCH", "ECO", "GIFT", "CONSO")
+
+LUNCH_PASS_SELECTOR = (
+    'body > div > header > div.header-fixed > div.balance-block > div > ul > li > a[href*="LUNCH"] > span.balance--price'
+)
+ECO_PASS_SELECTOR = (
+    'body > div > header > div.header-fixed > div.balance-block > div > ul > li > a[href*="ECO"] > span.balance--price'
+)
+GIFT_PASS_SELECTOR = (
+    'body > div > header > div.header-fixed > div.balance-block > div > ul > li > a[href*="GIFT"] > span.balance--price'
+)
+CONSO_PASS_SELECTOR = (
+    'body > div > header > div.header-fixed > div.balance-block > div > ul > li > a[href*="CONSO"] > span.balance--price'
+)
+TRANSACTION_SELECTOR = "body > div.dialog-off-canvas-main-canvas > div > div > div.transaction--section > div.transaction-list--section > div.transactions-list--table > div > table > tbody > tr"
+TRANSACTION_TABLE_SELECTOR = "body > div.dialog-off-canvas-main-canvas > div > div > div.transaction--section > div.transaction-list--section > div.transactions-list--table > div > table"
+
+# The texts of the date, merchant, detail and amount cells of a transaction row, None for a missing cell.
+TransactionRow = Tuple[Optional[str], Optional[str], Optional[str], Optional[str]]
+
+# The class of the cells of a transaction row, in the order of TransactionRow.
+_TRANSACTION_CELL_CLASSES = ("views-field-date", "views-field-description", "views-field-detail", "views-field-amount")
+_AMOUNT_CELL = 3
+
+
+class ParserBackend(ABC):
+    """Extract the raw texts from a Pluxee webpage. The conversion of the texts is left to the client."""
+
+    name = ""
+
+    @abstractmethod
+    def parse_balance(self, content: str) -> Dict[str, Optional[str]]:
+        """Get the price text of each pass type, or None for the pass types absent from the page."""
+
+    @abstractmethod
+    def iter_transaction_rows(self, content: str) -> Optional[Iterator[TransactionRow]]:
+        """Iterate over the rows of the transaction table, or get None when the page has no transaction table.
+
+        The rows are extracted lazily when the backend allows it, so stopping the iteration stops the parsing.
+        """
+
+
+class BeautifulSoupParser(ParserBackend):
+    """Build the whole BeautifulSoup tree and query it with CSS selectors."""
+
+    name = "bs4"
+
+    BALANCE_SELECTORS = {
+        "LUNCH": LUNCH_PASS_SELECTOR,
+        "ECO": ECO_PASS_SELECTOR,
+        "GIFT": GIFT_PASS_SELECTOR,
+        "CONSO": CONSO_PASS_SELECTOR,
+    }
+
+    def parse_balance(self, content: str) -> Dict[str, Optional[str]]:
+        soup = BeautifulSoup(content, features="html.parser")
+        balances: Dict[str, Optional[str]] = {}
+        for pass_type, selector in self.BALANCE_SELECTORS.items():
+            tag = soup.select_one(selector)
+            balances[pass_type] = tag.text if tag is not None else None
+        return balances
+
+    def iter_transaction_rows(self, content: str) -> Optional[Iterator[TransactionRow]]:
+        dom = BeautifulSoup(content, features="html.parser")
+        if not dom.select_one(TRANSACTION_TABLE_SELECTOR):
+            return None
+        return self._iter_rows(dom.select(TRANSACTION_SELECTOR))
+
+    @staticmethod
+    def _iter_rows(entries) -> Iterator[TransactionRow]:
+        for entry in entries:
+            cells = (
+                entry.select_one("td.views-field-date"),
+                entry.select_one("td.views-field-description"),
+                entry.select_one("td.views-field-detail"),
+                entry.select_one("td.views-field-amount > span"),
+            )
+            date, merchant, detail, amount = (cell.text if cell is not None else None for cell in cells)
+            yield date, merchant, detail, amount
+
+
+class _StopParsing(Exception):
+    pass
+
+
+_END_OF_CONTENT = object()
+
+
+def _has_class(attrs: List[Tuple[str, Optional[str]]], class_name: str) -> bool:
+    for name, value in attrs:
+        if name == "class" and value and class_name in value.split():
+            return True
+    return False
+
+
+class _BalanceHTMLParser(HTMLParser):
+    # Collect the span.balance--price of the links in the div.balance-block, and stop at the end of that div.
+
+    def __init__(self):
+        super().__init__()
+        self.balances: Dict[str, str] = {}
+        self._div_depth = 0
+        self._link_pass_types: Optional[List[str]] = None
+        self._price: Optional[List[str]] = None
+
+    def handle_starttag(self, tag, attrs):
+        if not self._div_depth:
+            if tag == "div" and _has_class(attrs, "balance-block"):
+                self._div_depth = 1
+        elif tag == "div":
+            self._div_depth += 1
+        elif tag == "a":
+            href = dict(attrs).get("href") or ""
+            self._link_pass_types = [pass_type for pass_type in PASS_TYPES if pass_type in href]
+        elif tag == "span" and self._link_pass_types and _has_class(attrs, "balance--price"):
+            self._price = []
+
+    def handle_endtag(self, tag):
+        if not self._div_depth:
+            return
+        if tag == "span" and self._price is not None:
+            for pass_type in self._link_pass_types or ():
+                self.balances.setdefault(pass_type, "".join(self._price))
+            self._price = None
+        elif tag == "a":
+            self._link_pass_types = None
+        elif tag == "div":
+            self._div_depth -= 1
+            if not self._div_depth:
+                raise _StopParsing
+
+    def handle_data(self, data):
+        if self._price is not None:
+            self._price.append(data)
+
+
+class _TransactionsHTMLParser(HTMLParser):
+    # Collect the rows of the table in the div.transactions-list--table, and stop at the end of its tbody.
+
+    def __init__(self):
+        super().__init__()
+        self.table_found = False
+        self.rows: Deque[TransactionRow] = deque()
+        self._div_depth = 0
+        self._in_tbody = False
+        self._row: Optional[List[Optional[str]]] = None
+        self._cell: Optional[int] = None
+        self._amount_span_depth = 0
+        self._text: Optional[List[str]] = None
+
+    def handle_starttag(self, tag, attrs):
+        if not self._div_depth:
+            if tag == "div" and _has_class(attrs, "transactions-list--table"):
+                self._div_depth = 1
+        elif tag == "div":
+            self._div_depth += 1
+        elif tag == "table":
+            self.table_found = True
+        elif tag == "tbody" and self.table_found:
+            self._in_tbody = True
+        elif not self._in_tbody:
+            return
+        elif tag == "tr":
+            self._row = [None, None, None, None]
+        elif tag == "td" and self._row is not None:
+            classes = dict(attrs).get("class", "") or ""
+            self._cell = next((i for i, name in enumerate(_TRANSACTION_CELL_CLASSES) if name in classes.split()), None)
+            if self._cell is not None and self._cell != _AMOUNT_CELL:
+                self._text = []
+        elif tag == "span" and self._cell == _AMOUNT_CELL:
+            # Only the text of the span in the amount cell is kept.
+            self._amount_span_depth += 1
+            if self._amount_span_depth == 1 and self._row and self._row[_AMOUNT_CELL] is None:
+                self._text = []
+
+    def handle_endtag(self, tag):
+        if not self._in_tbody:
+            return
+        if tag == "span" and self._amount_span_depth:
+            self._amount_span_depth -= 1
+            if not self._amount_span_depth:
+                self._store_text()
+        elif tag == "td":
+            if self._cell != _AMOUNT_CELL:
+                self._store_text()
+            self._cell = None
+            self._amount_span_depth = 0
+            self._text = None
+        elif tag == "tr" and self._row is not None:
+            date, merchant, detail, amount = self._row
+            self.rows.append((date, merchant, detail, amount))
+            self._row = None
+        elif tag == "tbody":
+            raise _StopParsing
+
+    def handle_data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+    def _store_text(self):
+        if self._text is not None and self._row is not None and self._cell is not None:
+            self._row[self._cell] = "".join(self._text)
+        self._text = None
+
+
+class HTMLParserBackend(ParserBackend):
+    """Stream the page through ``html.parser`` without building a tree, from the balance block to its end."""
+
+    name = "html.parser"
+
+    def parse_balance(self, content: str) -> Dict[str, Optional[str]]:
+        parser = _BalanceHTMLParser()
+        # Skip everything before the tag holding the balance block.
+        start = content.find("balance-block")
+        if start != -1:
+            try:
+                start = content.rfind("<", 0, start)
+                parser.feed(content[start:])
+                parser.close()
+            except _StopParsing:
+                pass
+        return {pass_type: parser.balances.get(pass_type) for pass_type in PASS_TYPES}
+
+    # The page is fed by chunks, so that the rows can be yielded before the whole page is parsed.
+    CHUNK_SIZE = 4096
+
+    def iter_transaction_rows(self, content: str) -> Optional[Iterator[TransactionRow]]:
+        start = content.find("transactions-list--table")
+        if start == -1:
+            return None
+        parser = _TransactionsHTMLParser()
+        chunks = self._feed(parser, content, content.rfind("<", 0, start))
+        for _ in chunks:
+            if parser.table_found:
+                return self._iter_rows(parser, chunks)
+        return None
+
+    def _feed(self, parser: HTMLParser, content: str, start: int) -> Iterator[None]:
+        try:
+            for position in range(start, len(content), self.CHUNK_SIZE):
+                end = position + self.CHUNK_SIZE
+                parser.feed(content[position:end])
+                yield
+            parser.close()
+        except _StopParsing:
+            pass
+        yield
+
+    @staticmethod
+    def _iter_rows(parser: _TransactionsHTMLParser, chunks: Iterator[None]) -> Iterator[TransactionRow]:
+        while True:
+            while parser.rows:
+                yield parser.rows.popleft()
+            if next(chunks, _END_OF_CONTENT) is _END_OF_CONTENT:
+                return
+
+
+_BALANCE_XPATH = (
+    '//div[contains(concat(" ", normalize-space(@class), " "), " balance-block ")]'
+    '//a/span[contains(concat(" ", normalize-space(@class), " "), " balance--price ")]'
+)
+
+
+class LxmlParser(ParserBackend):
+    """Parse the page with ``lxml`` and find all the balances with a single XPath query."""
+
+    name = "lxml"
+
+    def parse_balance(self, content: str) -> Dict[str, Optional[str]]:
+        balances: Dict[str, Optional[str]] = dict.fromkeys(PASS_TYPES)
+        if not content.strip():
+            return balances
+        for span in lxml.html.document_fromstring(content).xpath(_BALANCE_XPATH):
+            href = span.getparent().get("href") or ""
+            for pass_type in PASS_TYPES:
+                if pass_type in href and balances[pass_type] is None:
+                    balances[pass_type] = span.text_content()
+        return balances
+
+    def iter_transaction_rows(self, content: str) -> Optional[Iterator[TransactionRow]]:
+        if not content.strip():
+            return None
+        tables = lxml.html.document_fromstring(content).xpath(_TRANSACTION_TABLE_XPATH)
+        if not tables:
+            return None
+        return self._iter_rows(tables[0])
+
+    @staticmethod
+    def _iter_rows(table) -> Iterator[TransactionRow]:
+        for tbody in table.iterchildren("tbody"):
+            for entry in tbody.iterchildren("tr"):
+                row: List[Optional[str]] = [None, None, None, None]
+                for cell in entry.iterchildren("td"):
+                    classes = (cell.get("class") or "").split()
+                    for i, name in enumerate(_TRANSACTION_CELL_CLASSES):
+                        if name in classes and row[i] is None:
+                            text_element = cell.find("span") if i == _AMOUNT_CELL else cell
+                            row[i] = text_element.text_content() if text_element is not None else None
+                date, merchant, detail, amount = row
+                yield date, merchant, detail, amount
+
+
+_TRANSACTION_TABLE_XPATH = '//div[contains(concat(" ", normalize-space(@class), " "), " transactions-list--table ")]//table'
+
+
+_PARSERS = {parser.name: parser for parser in (BeautifulSoupParser, HTMLParserBackend, LxmlParser)}
+
+
+def get_parser(name: Optional[str] = None) -> ParserBackend:
+    """Get the parser backend called name, or the streaming ``html.parser`` one when name is None.
+
+    Raises:
+        ValueError: If the parser does not exist or if its library is not installed.
+    """
+    if name is None:
+        name = HTMLParserBackend.name
+    if name not in _PARSERS:
+        raise ValueError(f"Invalid parser '{name}'. Must be one of: {list(_PARSERS.keys())}")
+    if name == LxmlParser.name and not LXML_AVAILABLE:
+        raise ValueError("The 'lxml' parser requires lxml to be installed")
+    return _PARSERS[name]()
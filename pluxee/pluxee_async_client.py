@@ -1,14 +1,21 @@
 import asyncio
+import logging
+from collections import deque
 from datetime import date
 from functools import partial
 from ssl import SSLContext
-from typing import Dict, List, Optional, Union
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Tuple, Union
 
 import aiohttp
 
 from .aia_chaser import AIASession
 from .base_pluxee_client import PassType, PluxeeBalance, PluxeeTransaction, _PluxeeClient, _ResponseWrapper
 from .exceptions import PluxeeAPIError, PluxeeLoginError
+from .response_cache import ResponseCache
+from .transaction_store import TransactionStore
+from .transaction_sync import TransactionSyncState
+
+logger = logging.getLogger(__name__)
 
 
 class PluxeeAsyncClient(_PluxeeClient):
@@ -19,7 +26,19 @@ class PluxeeAsyncClient(_PluxeeClient):
         username: The pluxee username.
         password: The pluxee password.
         language: The pluxee website language (either 'fr' or 'nl', defaults to 'fr').
+        session: An aiohttp session to use. When omitted, the client creates and owns one, which is kept
+            (with its cookie jar and pooled connections) until :meth:`close` is called.
         timeout: Request timeout in seconds (defaults to 30).
+        limit: Maximum number of simultaneous connections of the owned connector (defaults to 100).
+        limit_per_host: Maximum number of simultaneous connections to the same host, 0 for no limit (defaults to 0).
+        ttl_dns_cache: Seconds a DNS resolution is cached by the owned connector (defaults to 10).
+        keepalive_timeout: Seconds an idle connection is kept alive by the owned connector (defaults to 15).
+        parser: The HTML parser backend, either 'html.parser', 'lxml' or 'bs4' (defaults to 'html.parser').
+        aia_session: The AIASession resolving the certificate chain of the website, which can be shared between clients
+            (defaults to a new one, closed with the client).
+        transaction_store: A store keeping the transactions already retrieved. When given, ``get_transactions`` only
+            requests the date ranges missing from the store.
+        response_cache: A cache of the downloaded pages, which can be shared between clients (defaults to None, no cache).
 
     Attrs:
         username: The pluxee username.
@@ -34,11 +53,127 @@ class PluxeeAsyncClient(_PluxeeClient):
         language: str = 'fr',
         session: Optional[aiohttp.ClientSession] = None,
         timeout: int = 30,
+        limit: int = 100,
+        limit_per_host: int = 0,
+        ttl_dns_cache: int = 10,
+        keepalive_timeout: float = 15,
+        parser: Optional[str] = None,
+        aia_session: Optional[AIASession] = None,
+        transaction_store: Optional[TransactionStore] = None,
+        response_cache: Optional[ResponseCache] = None,
     ):
-        super().__init__(username, password, language, session, timeout)
-        self._aia_session = AIASession()
+        super().__init__(username, password, language, session, timeout, parser, response_cache)
+        self._transaction_store = transaction_store
+        self._owns_session = session is None
+        self._connector_args = {
+            "limit": limit,
+            "limit_per_host": limit_per_host,
+            "ttl_dns_cache": ttl_dns_cache,
+            "keepalive_timeout": keepalive_timeout,
+        }
+        self._owns_aia_session = aia_session is None
+        self._aia_session = aia_session or AIASession()
+        self._keep_alive_task: Optional[asyncio.Task] = None
+        # The tasks of the calls in flight, shared by the identical concurrent calls.
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+        self._login_task: Optional[asyncio.Future] = None
+        # Incremented by each login.
+        self._login_generation = 0
+
+    async def __aenter__(self) -> 'PluxeeAsyncClient':
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        # The session is created once and reused, so the cookie jar, the DNS cache and the keep-alive
+        # connections survive between calls.
+        if self._session is None:
+            ssl_context = await self.get_ssl_context(self._base_url_localized)
+            if self._session is None:
+                self._session = aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(ssl=ssl_context, **self._connector_args),
+                    timeout=aiohttp.ClientTimeout(total=self._timeout),
+                )
+        return self._session
 
-    async def _login(self, session: aiohttp.ClientSession):
+    async def close(self):
+        """Stop the keep-alive and close the sessions owned by the client. The sessions given to the constructor are left open."""
+        await self.stop_keep_alive()
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._owns_aia_session:
+            self._aia_session.close()
+
+    @classmethod
+    async def fetch_balances(
+        cls, credentials: Iterable[Tuple[str, str]], concurrency: int = 8, language: str = 'fr', timeout: int = 30
+    ) -> AsyncIterator[Tuple[str, Union[PluxeeBalance, Exception]]]:
+        """Retrieve the balance of many accounts concurrently, bounded by a semaphore.
+
+        All the accounts share one AIASession, one SSL context and one connector, but each account keeps its own
+        cookie jar.
+
+        Args:
+            credentials: The (username, password) of each account.
+            concurrency: The maximum number of accounts refreshed at the same time (defaults to 8).
+            language: The pluxee website language (either 'fr' or 'nl', defaults to 'fr').
+            timeout: Request timeout in seconds (defaults to 30).
+
+        Returns:
+            AsyncIterator[Tuple[str, Union[PluxeeBalance, Exception]]]: The username with its balance, or with the
+            exception raised while retrieving it, in the order the accounts complete.
+        """
+        aia_session = AIASession()
+        connector: Optional[aiohttp.TCPConnector] = None
+        tasks: List[asyncio.Future] = []
+        # Everything set up after the AIA session is inside the try, a failing setup still closes it.
+        try:
+            ssl_context = await aia_session.async_ssl_context_from_url(f"https://{cls.DOMAIN}/{language}")
+            connector = aiohttp.TCPConnector(ssl=ssl_context, limit=concurrency)
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def fetch(username: str, password: str) -> Tuple[str, Union[PluxeeBalance, Exception]]:
+                async with semaphore:
+                    async with aiohttp.ClientSession(
+                        connector=connector, connector_owner=False, timeout=aiohttp.ClientTimeout(total=timeout)
+                    ) as session:
+                        client = cls(username, password, language, session=session, timeout=timeout, aia_session=aia_session)
+                        try:
+                            return username, await client.get_balance()
+                        except Exception as e:
+                            return username, e
+
+            tasks = [asyncio.ensure_future(fetch(username, password)) for username, password in credentials]
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+            # The cancelled accounts release their connections before the connector is closed.
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if connector is not None:
+                await connector.close()
+            aia_session.close()
+
+    async def _login(self, session: aiohttp.ClientSession, generation: Optional[int] = None):
+        # A request that saw an expired cookie before another coroutine logged in only has to retry.
+        if generation is not None and generation != self._login_generation:
+            return
+        # Concurrent logins share the one in flight.
+        if self._login_task is None:
+            self._login_task = asyncio.ensure_future(self._post_login(session))
+            self._login_task.add_done_callback(self._login_done)
+        await asyncio.shield(self._login_task)
+
+    def _login_done(self, task: asyncio.Future):
+        self._login_task = None
+        if not task.cancelled() and task.exception() is None:
+            self._login_generation += 1
+
+    async def _post_login(self, session: aiohttp.ClientSession):
         # call login
         async with session.post(**self.gen_login_post_args()) as response:
             # Check if we are logged in
@@ -46,30 +181,91 @@ class PluxeeAsyncClient(_PluxeeClient):
 
             # Setting the cookie
             try:
-                key, value = response.headers["set-cookie"].split(";")[0].split("=")
+                set_cookie = response.headers["set-cookie"]
+                key, value = set_cookie.split(";")[0].split("=")
                 session.cookie_jar.update_cookies({key: value})
             except (KeyError, ValueError, AttributeError) as e:
                 raise PluxeeLoginError("Could not find the cookie in the login response") from e
+            self._record_login(set_cookie)
+
+    def start_keep_alive(self, refresh_interval: float = 900, margin: float = 60):
+        """Log in from a background task, and again before the login cookie expires.
+
+        The requests then never have to log in again and repeat themselves. Must be called from the event loop of the
+        client, the task stops with :meth:`close`.
+
+        Args:
+            refresh_interval: The number of seconds between logins when the cookie has no expiry (defaults to 900).
+            margin: The number of seconds before the cookie expiry when the login is refreshed (defaults to 60).
+        """
+        if refresh_interval <= 0:
+            raise ValueError(f"Invalid refresh_interval '{refresh_interval}'. Must be positive")
+        # The margin is also the wait before retrying a failed login, zero would hammer the login page.
+        if margin <= 0:
+            raise ValueError(f"Invalid margin '{margin}'. Must be positive")
+        if self._keep_alive_task is not None and not self._keep_alive_task.done():
+            return
+        self._keep_alive_task = asyncio.get_running_loop().create_task(self._keep_alive(refresh_interval, margin))
+
+    async def stop_keep_alive(self):
+        """Stop the task started by :meth:`start_keep_alive`."""
+        task, self._keep_alive_task = self._keep_alive_task, None
+        if task is None:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def _keep_alive(self, refresh_interval: float, margin: float):
+        while True:
+            # Computed again after each wake up, as a request may have logged in meanwhile.
+            delay = self._next_login_delay(refresh_interval, margin)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            try:
+                await self._login(await self._get_session())
+            except asyncio.CancelledError:
+                # A subclass of Exception before Python 3.8, the cancel of stop_keep_alive must not be swallowed.
+                raise
+            except Exception:
+                logger.warning("Could not refresh the Pluxee login", exc_info=True)
+                await asyncio.sleep(margin)
 
     async def _make_request(self, url: str, params: Dict[str, Union[str, int]], session) -> _ResponseWrapper:
-        async with session.get(url, params=params) as response:
+        generation = self._login_generation
+        key, cached = self._get_cached_response(url, params)
+        request_args = {"params": params}
+        if cached is not None:
+            if self._response_cache.is_fresh(cached):
+                return _ResponseWrapper(cached.content, cached.status_code)
+            headers = cached.conditional_headers()
+            if headers:
+                request_args["headers"] = headers
+        async with session.get(url, **request_args) as response:
+            if cached is not None and response.status == 304:
+                cached = self._response_cache.revalidated(key, cached)
+                return _ResponseWrapper(cached.content, cached.status_code)
             content = await response.text()
-            if 'logout' in content.lower():
-                return _ResponseWrapper(content, response.status)
+            if self._is_logged_in(response.status, str(response.url), content):
+                return self._cache_response(key, _ResponseWrapper(content, response.status), response.headers)
 
         # We got disconnected, the cookies expired
-        await self._login(session)
+        await self._login(session, generation)
 
         async with session.get(url, params=params) as response:
             if response.status != 200:
                 raise PluxeeAPIError(f"Pluxee webpage did not respond with the expected status. {response.status}")
-            return _ResponseWrapper(await response.text(), response.status)
+            return self._cache_response(key, _ResponseWrapper(await response.text(), response.status), response.headers)
 
     async def get_ssl_context(self, url: str, executor=None) -> SSLContext:
-        return await asyncio.get_running_loop().run_in_executor(
-            executor,
-            partial(self._aia_session.ssl_context_from_url, url),
-        )
+        # The certificate chain is downloaded on the event loop, the executor argument is kept for compatibility.
+        ssl_context = self._aia_session.cached_ssl_context_from_url(url)
+        if ssl_context is not None:
+            return ssl_context
+        return await self._aia_session.async_ssl_context_from_url(url)
 
     async def get_balance(self) -> PluxeeBalance:
         """Retrieve the balance of each pass type.
@@ -81,24 +277,110 @@ class PluxeeAsyncClient(_PluxeeClient):
         Returns:
             PluxeeBalance: The balance.
         """
-        session = self._session
-        if not session:
-            ssl_context = await self.get_ssl_context(self._base_url_localized)
-            session = aiohttp.ClientSession(
-                connector=aiohttp.TCPConnector(ssl=ssl_context),
-                timeout=aiohttp.ClientTimeout(total=self._timeout),
-            )
-        session: aiohttp.ClientSession
+        return await self._single_flight(("balance",), self._get_balance)
+
+    async def _get_balance(self) -> PluxeeBalance:
+        session = await self._get_session()
+        response = await self._make_request(self._base_url_balance, {"check_logged_in": "1"}, session)
+        return self._parse_balance_from_response(response)
+
+    async def _single_flight(self, key: Tuple, factory: Callable[[], Awaitable]):
+        # Concurrent identical calls share the task in flight. It is shielded, a cancelled caller does not cancel it for
+        # the others.
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(partial(self._single_flight_done, key))
+        return await asyncio.shield(task)
+
+    def _single_flight_done(self, key: Tuple, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Retrieved, in case every caller was cancelled.
+            task.exception()
+
+    async def _iter_transaction_responses(
+        self, pass_type: PassType, session: aiohttp.ClientSession, page_window: int
+    ) -> AsyncIterator[_ResponseWrapper]:
+        def fetch(page_number: int):
+            return self._make_request(self._base_url_transactions, {"type": pass_type.value, "page": page_number}, session)
+
+        # The first page is fetched alone, so that expired cookies only trigger a single login.
+        yield await fetch(0)
+
+        # Prefetch the next pages in tasks, while still yielding them in order.
+        # Closing the generator cancels the pages that are not needed anymore.
+        pending: Deque[asyncio.Future] = deque()
+        try:
+            next_page_number = 1
+            while True:
+                while len(pending) < page_window:
+                    pending.append(asyncio.ensure_future(fetch(next_page_number)))
+                    next_page_number += 1
+                yield await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+                if task.done() and not task.cancelled():
+                    # Mark the exception of a discarded page as retrieved.
+                    task.exception()
+
+    def aiter_transactions(
+        self, pass_type: PassType, since: Optional[date] = None, until: Optional[date] = None, page_window: int = 1
+    ) -> AsyncIterator[PluxeeTransaction]:
+        """Iterate over the transactions of the requested pass type in the given interval, page by page.
+
+        Pages are only requested as the iteration goes on, so stopping the iteration early stops the pagination.
+
+        Args:
+            pass_type: The type of the pass for which to retrieve the transactions.
+            since: The start of the interval (inclusive). Only transactions on or after this date are returned.
+            until: The end of the interval (exclusive). Only transactions before this date are returned.
+            page_window: The maximum number of pages requested concurrently (defaults to 1, one page after the other).
+                Pages past the last one needed are cancelled.
+
+        Raises:
+            PluxeeAPIError: If Pluxee webpage did not respond with the expected status or do not contain the expected information.
+            PluxeeLoginError: If an error occurred with the login process.
+
+        Returns:
+            AsyncIterator[PluxeeTransaction]: The transactions with the newest elements first.
+        """
+        if page_window < 1:
+            raise ValueError(f"Invalid page_window '{page_window}'. Must be at least 1")
+        return self._aiter_transactions(pass_type, since, until, page_window)
+
+    async def _aiter_transactions(
+        self, pass_type: PassType, since: Optional[date], until: Optional[date], page_window: int
+    ) -> AsyncIterator[PluxeeTransaction]:
+        pages = self._iter_transaction_pages(pass_type, since, until, page_window)
+        try:
+            async for page in pages:
+                for transaction in page:
+                    yield transaction
+        finally:
+            await pages.aclose()
 
+    async def _iter_transaction_pages(
+        self, pass_type: PassType, since: Optional[date], until: Optional[date], page_window: int
+    ) -> AsyncIterator[List[PluxeeTransaction]]:
+        session = await self._get_session()
+        responses = self._iter_transaction_responses(pass_type, session, page_window)
+        has_previous = False
         try:
-            response = await self._make_request(self._base_url_balance, {"check_logged_in": "1"}, session)
-            return self._parse_balance_from_response(response)
+            async for response in responses:
+                page, complete = self._parse_transactions_page(response, since, until, has_previous)
+                has_previous = has_previous or bool(page)
+                yield page
+                if complete:
+                    break
         finally:
-            if not self._session:
-                await session.close()
+            await responses.aclose()
 
     async def get_transactions(
-        self, pass_type: PassType, since: Optional[date] = None, until: Optional[date] = None
+        self, pass_type: PassType, since: Optional[date] = None, until: Optional[date] = None, page_window: int = 1
     ) -> List[PluxeeTransaction]:
         """Retrieve the transactions of the requested pass type in the given interval.
 
@@ -106,6 +388,8 @@ class PluxeeAsyncClient(_PluxeeClient):
             pass_type: The type of the pass for which to retrieve the transactions.
             since: The start of the interval (inclusive). Only transactions on or after this date are returned.
             until: The end of the interval (exclusive). Only transactions before this date are returned.
+            page_window: The maximum number of pages requested concurrently (defaults to 1, one page after the other).
+                Pages past the last one needed are cancelled.
 
         Raises:
             PluxeeAPIError: If Pluxee webpage did not respond with the expected status or do not contain the expected information.
@@ -114,27 +398,100 @@ class PluxeeAsyncClient(_PluxeeClient):
         Returns:
             List[PluxeeTransaction]: The transactions with the oldest elements first.
         """
-        session = self._session
-        if not session:
-            ssl_context = await self.get_ssl_context(self._base_url_localized)
-            session = aiohttp.ClientSession(
-                connector=aiohttp.TCPConnector(ssl=ssl_context),
-                timeout=aiohttp.ClientTimeout(total=self._timeout),
-            )
-        session: aiohttp.ClientSession
+        transactions = await self._single_flight(
+            ("transactions", PassType(pass_type).value, since, until),
+            partial(self._get_transactions, pass_type, since, until, page_window),
+        )
+        # Each caller gets its own list.
+        return list(transactions)
 
-        try:
-            transactions: List[PluxeeTransaction] = []
-            page_number = 0
-            complete = False
-            while not complete:
-                response = await self._make_request(
-                    self._base_url_transactions, {"type": pass_type.value, "page": page_number}, session
-                )
-                complete = self._parse_transactions_from_response(response, transactions, since, until)
-                page_number += 1
+    async def _get_transactions(
+        self, pass_type: PassType, since: Optional[date], until: Optional[date], page_window: int
+    ) -> List[PluxeeTransaction]:
+        if self._transaction_store is not None:
+            if page_window < 1:
+                raise ValueError(f"Invalid page_window '{page_window}'. Must be at least 1")
+            await self._fill_transaction_store(pass_type, since, until, page_window)
+            await self._check_credentials()
+            # Not before the transaction filling the store from another coroutine ends.
+            async with self._transaction_store.async_lock():
+                return self._transaction_store.query(self._username, pass_type, since, until)
+        transactions = [transaction async for transaction in self.aiter_transactions(pass_type, since, until, page_window)]
+        transactions.reverse()
+        return transactions
 
-            return transactions[::-1]
-        finally:
-            if not self._session:
-                await session.close()
+    async def get_all_transactions(
+        self, since: Optional[date] = None, until: Optional[date] = None, page_window: int = 1
+    ) -> Dict[PassType, List[PluxeeTransaction]]:
+        """Retrieve the transactions of every pass type of the account in the given interval.
+
+        The balance page is requested first, to log in once and to skip the pass types the account does not have. The
+        pass types are then paginated concurrently on the same session.
+
+        Args:
+            since: The start of the interval (inclusive). Only transactions on or after this date are returned.
+            until: The end of the interval (exclusive). Only transactions before this date are returned.
+            page_window: The maximum number of pages of each pass type requested concurrently (defaults to 1).
+
+        Raises:
+            PluxeeAPIError: If Pluxee webpage did not respond with the expected status or do not contain the expected information.
+            PluxeeLoginError: If an error occurred with the login process.
+
+        Returns:
+            Dict[PassType, List[PluxeeTransaction]]: The transactions of each pass type, with the oldest elements first.
+        """
+        session = await self._get_session()
+        response = await self._make_request(self._base_url_balance, {"check_logged_in": "1"}, session)
+        pass_types = self._parse_pass_types_from_response(response)
+        results = await asyncio.gather(*(self.get_transactions(pass_type, since, until, page_window) for pass_type in pass_types))
+        return dict(zip(pass_types, results))
+
+    async def _fill_transaction_store(self, pass_type: PassType, since: Optional[date], until: Optional[date], page_window: int):
+        store = self._transaction_store
+        # The concurrent calls wait for the transaction, then only request the ranges that are still missing.
+        async with store.async_lock():
+            with store.transaction():
+                ranges = store.missing_ranges(self._username, pass_type, since, until)
+                if not ranges:
+                    return
+                store.clear_ranges(self._username, pass_type, ranges)
+                # A single pagination covers all the missing ranges, the pages always start from the newest transactions.
+                pages = self._iter_transaction_pages(pass_type, ranges[0][0], ranges[-1][1], page_window)
+                try:
+                    async for page in pages:
+                        store.add_page(self._username, pass_type, page, ranges)
+                finally:
+                    await pages.aclose()
+                store.add_coverage(self._username, pass_type, ranges)
+        # The pages were served to a logged in session.
+        self._credentials_checked = True
+
+    async def _check_credentials(self):
+        # The store is keyed by username, its transactions are only served once the website accepted the password.
+        if not self._credentials_checked:
+            await self._make_request(self._base_url_balance, {"check_logged_in": "1"}, await self._get_session())
+            self._credentials_checked = True
+
+    async def sync_transactions(
+        self, pass_type: PassType, state: TransactionSyncState, since: Optional[date] = None, page_window: int = 1
+    ) -> List[PluxeeTransaction]:
+        """Retrieve the transactions of the requested pass type that were not retrieved by the previous syncs.
+
+        Only the pages down to the high-water mark of the state are requested, and the state is updated.
+
+        Args:
+            pass_type: The type of the pass for which to retrieve the transactions.
+            state: The state of the previous syncs, updated in place.
+            since: The start of the interval of the first sync (inclusive). Ignored once the state has a high-water mark.
+            page_window: The maximum number of pages requested concurrently (defaults to 1, one page after the other).
+
+        Raises:
+            PluxeeAPIError: If Pluxee webpage did not respond with the expected status or do not contain the expected information.
+            PluxeeLoginError: If an error occurred with the login process.
+
+        Returns:
+            List[PluxeeTransaction]: The new transactions with the oldest elements first.
+        """
+        since = state.high_water_mark(self._username, pass_type) or since
+        transactions = [transaction async for transaction in self.aiter_transactions(pass_type, since, page_window=page_window)]
+        return state.update(self._username, pass_type, transactions)
@@ -1,13 +1,24 @@
+import logging
 import os
 import tempfile
+import threading
+import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date
-from typing import Dict, List, Optional, Union
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from .aia_chaser import AIASession
 from .base_pluxee_client import PassType, PluxeeBalance, PluxeeTransaction, _PluxeeClient, _ResponseWrapper
 from .exceptions import PluxeeAPIError, PluxeeLoginError
+from .response_cache import ResponseCache
+from .transaction_store import TransactionStore
+from .transaction_sync import TransactionSyncState
+
+logger = logging.getLogger(__name__)
 
 
 class PluxeeClient(_PluxeeClient):
@@ -18,7 +29,16 @@ class PluxeeClient(_PluxeeClient):
         username: The pluxee username.
         password: The pluxee password.
         language: The pluxee website language (either 'fr' or 'nl', defaults to 'fr').
+        session: A requests session to use. When omitted, the client creates and owns one, which is kept
+            (with its login cookie and pooled connections) until :meth:`close` is called.
         timeout: Request timeout in seconds (defaults to 30).
+        pool_maxsize: Maximum number of connections kept alive in the owned session pool (defaults to 10).
+        parser: The HTML parser backend, either 'html.parser', 'lxml' or 'bs4' (defaults to 'html.parser').
+        aia_session: The AIASession resolving the certificate chain of the website, which can be shared between clients
+            (defaults to a new one, closed with the client).
+        transaction_store: A store keeping the transactions already retrieved. When given, ``get_transactions`` only
+            requests the date ranges missing from the store.
+        response_cache: A cache of the downloaded pages, which can be shared between clients (defaults to None, no cache).
 
     Attrs:
         username: The pluxee username.
@@ -27,41 +47,65 @@ class PluxeeClient(_PluxeeClient):
     """
 
     def __init__(
-        self, username: str, password: str, language: str = 'fr', session: Optional[requests.Session] = None, timeout: int = 30
+        self,
+        username: str,
+        password: str,
+        language: str = 'fr',
+        session: Optional[requests.Session] = None,
+        timeout: int = 30,
+        pool_maxsize: int = 10,
+        parser: Optional[str] = None,
+        aia_session: Optional[AIASession] = None,
+        transaction_store: Optional[TransactionStore] = None,
+        response_cache: Optional[ResponseCache] = None,
     ):
-        super().__init__(username, password, language, session, timeout)
-        self._aia_session = AIASession()
+        super().__init__(username, password, language, session, timeout, parser, response_cache)
+        self._transaction_store = transaction_store
+        self._owns_session = session is None
+        self._pool_maxsize = pool_maxsize
+        self._owns_aia_session = aia_session is None
+        self._aia_session = aia_session or AIASession()
+        # Held while creating the session and while logging in, by the requests and by the keep-alive thread.
+        self._login_lock = threading.RLock()
+        self._keep_alive_stop = threading.Event()
+        self._keep_alive_thread: Optional[threading.Thread] = None
 
-    def _login(self, session):
-        # call login
-        response = session.post(**self.gen_login_post_args(), timeout=self._timeout)
-        # Check if we are logged in
-        self.handle_login_status(response.status_code)
+    def __enter__(self) -> 'PluxeeClient':
+        return self
 
-        # Setting the cookie
-        try:
-            key, value = response.headers["set-cookie"].split(";")[0].split("=")
-            session.cookies.set(key, value)
-        except (KeyError, ValueError, AttributeError) as e:
-            raise PluxeeLoginError("Could not find the cookie in the login response") from e
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
-    def _make_request(self, url: str, params: Dict[str, Union[str, int]], session) -> _ResponseWrapper:
-        response = session.get(url, params=params, timeout=self._timeout)
-        if 'logout' in response.content.decode().lower():
-            return _ResponseWrapper(response.content.decode(), response.status_code)
+    def _get_session(self) -> requests.Session:
+        # The session is created once and reused, so the login cookie and the pooled connections survive between calls.
+        with self._login_lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._pool_maxsize)
+                session.mount("https://", adapter)
+                self._session = session
+            # The CA bundle file is written once and only replaced when the host certificate chain changes.
+            self._session.verify = self._aia_session.cafile_from_url(self._base_url_localized)
+            return self._session
 
-        # We got disconnected, the cookies expired
-        self._login(session)
-
-        response = session.get(url, params=params, timeout=self._timeout)
-        if response.status_code != 200:
-            raise PluxeeAPIError(f"Pluxee webpage did not respond with the expected status. {response.status_code}")
-
-        return _ResponseWrapper(response.content.decode(), response.status_code)
+    def close(self):
+        """Stop the keep-alive and close the sessions owned by the client. The sessions given to the constructor are left open."""
+        self.stop_keep_alive()
+        if self._owns_session and self._session is not None:
+            self._session.close()
+            self._session = None
+        if self._owns_aia_session:
+            self._aia_session.close()
 
     class TemporaryPEMFile:
+        # Deprecated: the client now points its session at the file of AIASession.cafile_from_url.
         # Using a temporary file implies we need to delete it after use. Therefore I use a context manager.
-        def __init__(self, aia_session: 'AIASession', url: str):
+        def __init__(self, aia_session: AIASession, url: str):
+            warnings.warn(
+                "PluxeeClient.TemporaryPEMFile is deprecated, use AIASession.cafile_from_url instead",
+                DeprecationWarning,
+                stacklevel=2,
+            )
             ca_data = aia_session.cadata_from_url(url)
             fd, self._path = tempfile.mkstemp(suffix='.pem')
             try:
@@ -75,6 +119,150 @@ class PluxeeClient(_PluxeeClient):
         def __exit__(self, exc_type, exc_val, exc_tb):
             os.unlink(self._path)
 
+    @classmethod
+    def fetch_balances(
+        cls, credentials: Iterable[Tuple[str, str]], concurrency: int = 8, language: str = 'fr', timeout: int = 30
+    ) -> Iterator[Tuple[str, Union[PluxeeBalance, Exception]]]:
+        """Retrieve the balance of many accounts concurrently, in a thread pool.
+
+        All the accounts share one AIASession, one CA bundle file and one connection pool, but each account keeps its
+        own cookies.
+
+        Args:
+            credentials: The (username, password) of each account.
+            concurrency: The maximum number of accounts refreshed at the same time (defaults to 8).
+            language: The pluxee website language (either 'fr' or 'nl', defaults to 'fr').
+            timeout: Request timeout in seconds (defaults to 30).
+
+        Returns:
+            Iterator[Tuple[str, Union[PluxeeBalance, Exception]]]: The username with its balance, or with the exception
+            raised while retrieving it, in the order the accounts complete.
+        """
+        aia_session = AIASession()
+        adapter: Optional[HTTPAdapter] = None
+        executor: Optional[ThreadPoolExecutor] = None
+        futures = {}
+        # Everything set up after the AIA session is inside the try, a failing setup still closes it.
+        try:
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+
+            def fetch(username: str, password: str) -> PluxeeBalance:
+                session = requests.Session()
+                try:
+                    session.mount("https://", adapter)
+                    client = cls(username, password, language, session=session, timeout=timeout, aia_session=aia_session)
+                    return client.get_balance()
+                finally:
+                    # Session.close closes the mounted adapters, the shared one is closed by fetch_balances.
+                    session.adapters.pop("https://", None)
+                    session.close()
+
+            executor = ThreadPoolExecutor(max_workers=concurrency)
+            # Resolve the certificate chain once, before the threads need it.
+            aia_session.cafile_from_url(f"https://{cls.DOMAIN}/{language}")
+            futures = {executor.submit(fetch, username, password): username for username, password in credentials}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result()
+                except Exception as e:
+                    yield futures[future], e
+        finally:
+            for future in futures:
+                future.cancel()
+            if executor is not None:
+                # The running accounts still send through the adapter, they finish before it is closed.
+                executor.shutdown(wait=True)
+            if adapter is not None:
+                adapter.close()
+            aia_session.close()
+
+    def _login(self, session):
+        # The keep-alive thread and the requests can both log in, one at a time.
+        with self._login_lock:
+            # call login
+            response = session.post(**self.gen_login_post_args(), timeout=self._timeout)
+            # Check if we are logged in
+            self.handle_login_status(response.status_code)
+
+            # Setting the cookie
+            try:
+                set_cookie = response.headers["set-cookie"]
+                key, value = set_cookie.split(";")[0].split("=")
+                session.cookies.set(key, value)
+            except (KeyError, ValueError, AttributeError) as e:
+                raise PluxeeLoginError("Could not find the cookie in the login response") from e
+            self._record_login(set_cookie)
+
+    def start_keep_alive(self, refresh_interval: float = 900, margin: float = 60):
+        """Log in from a background thread, and again before the login cookie expires.
+
+        The requests then never have to log in again and repeat themselves. The thread stops with :meth:`close`.
+
+        Args:
+            refresh_interval: The number of seconds between logins when the cookie has no expiry (defaults to 900).
+            margin: The number of seconds before the cookie expiry when the login is refreshed (defaults to 60).
+        """
+        if refresh_interval <= 0:
+            raise ValueError(f"Invalid refresh_interval '{refresh_interval}'. Must be positive")
+        # The margin is also the wait before retrying a failed login, zero would hammer the login page.
+        if margin <= 0:
+            raise ValueError(f"Invalid margin '{margin}'. Must be positive")
+        if self._keep_alive_thread is not None:
+            return
+        self._keep_alive_stop.clear()
+        self._keep_alive_thread = threading.Thread(
+            target=self._keep_alive, args=(refresh_interval, margin), name="pluxee-keep-alive", daemon=True
+        )
+        self._keep_alive_thread.start()
+
+    def stop_keep_alive(self):
+        """Stop the thread started by :meth:`start_keep_alive`."""
+        if self._keep_alive_thread is None:
+            return
+        self._keep_alive_stop.set()
+        self._keep_alive_thread.join()
+        self._keep_alive_thread = None
+
+    def _keep_alive(self, refresh_interval: float, margin: float):
+        while not self._keep_alive_stop.is_set():
+            # Computed again after each wake up, as a request may have logged in meanwhile.
+            delay = self._next_login_delay(refresh_interval, margin)
+            if delay > 0:
+                self._keep_alive_stop.wait(delay)
+                continue
+            try:
+                # Taken around both calls, a request can not replace the session in between.
+                with self._login_lock:
+                    self._login(self._get_session())
+            except Exception:
+                logger.warning("Could not refresh the Pluxee login", exc_info=True)
+                self._keep_alive_stop.wait(margin)
+
+    def _make_request(self, url: str, params: Dict[str, Union[str, int]], session) -> _ResponseWrapper:
+        key, cached = self._get_cached_response(url, params)
+        request_args = {"params": params, "timeout": self._timeout}
+        if cached is not None:
+            if self._response_cache.is_fresh(cached):
+                return _ResponseWrapper(cached.content, cached.status_code)
+            headers = cached.conditional_headers()
+            if headers:
+                request_args["headers"] = headers
+        response = session.get(url, **request_args)
+        if cached is not None and response.status_code == 304:
+            cached = self._response_cache.revalidated(key, cached)
+            return _ResponseWrapper(cached.content, cached.status_code)
+        if self._is_logged_in(response.status_code, response.url, response.content):
+            return self._cache_response(key, _ResponseWrapper(response.content.decode(), response.status_code), response.headers)
+
+        # We got disconnected, the cookies expired
+        self._login(session)
+
+        response = session.get(url, params=params, timeout=self._timeout)
+        if response.status_code != 200:
+            raise PluxeeAPIError(f"Pluxee webpage did not respond with the expected status. {response.status_code}")
+
+        return self._cache_response(key, _ResponseWrapper(response.content.decode(), response.status_code), response.headers)
+
     def get_balance(self) -> PluxeeBalance:
         """Retrieve the balance of each pass type.
 
@@ -85,14 +273,91 @@ class PluxeeClient(_PluxeeClient):
         Returns:
             PluxeeBalance: The balance.
         """
-        with self.TemporaryPEMFile(self._aia_session, self._base_url_localized) as ssl_context:
-            session: requests.Session = self._session or requests.Session()
-            session.verify = ssl_context
-            response = self._make_request(self._base_url_balance, {"check_logged_in": "1"}, session)
-            return self._parse_balance_from_response(response)
+        session = self._get_session()
+        response = self._make_request(self._base_url_balance, {"check_logged_in": "1"}, session)
+        return self._parse_balance_from_response(response)
+
+    def _iter_transaction_responses(self, pass_type: PassType, session, page_window: int) -> Iterator[_ResponseWrapper]:
+        def fetch(page_number: int) -> _ResponseWrapper:
+            return self._make_request(self._base_url_transactions, {"type": pass_type.value, "page": page_number}, session)
+
+        # The first page is fetched alone, so that expired cookies only trigger a single login.
+        yield fetch(0)
+        if page_window == 1:
+            page_number = 1
+            while True:
+                yield fetch(page_number)
+                page_number += 1
+
+        # Prefetch the next pages in a thread pool, while still yielding them in order.
+        # Closing the generator cancels the pages that are not needed anymore.
+        executor = ThreadPoolExecutor(max_workers=page_window)
+        pending: Deque = deque()
+        try:
+            next_page_number = 1
+            while True:
+                while len(pending) < page_window:
+                    pending.append(executor.submit(fetch, next_page_number))
+                    next_page_number += 1
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def iter_transactions(
+        self, pass_type: PassType, since: Optional[date] = None, until: Optional[date] = None, page_window: int = 1
+    ) -> Iterator[PluxeeTransaction]:
+        """Iterate over the transactions of the requested pass type in the given interval, page by page.
+
+        Pages are only requested as the iteration goes on, so stopping the iteration early stops the pagination.
+
+        Args:
+            pass_type: The type of the pass for which to retrieve the transactions.
+            since: The start of the interval (inclusive). Only transactions on or after this date are returned.
+            until: The end of the interval (exclusive). Only transactions before this date are returned.
+            page_window: The maximum number of pages requested concurrently (defaults to 1, one page after the other).
+                Pages past the last one needed are discarded.
+
+        Raises:
+            PluxeeAPIError: If Pluxee webpage did not respond with the expected status or do not contain the expected information.
+            PluxeeLoginError: If an error occurred with the login process.
+
+        Returns:
+            Iterator[PluxeeTransaction]: The transactions with the newest elements first.
+        """
+        if page_window < 1:
+            raise ValueError(f"Invalid page_window '{page_window}'. Must be at least 1")
+        return self._iter_transactions(pass_type, since, until, page_window)
+
+    def _iter_transaction_pages(
+        self, pass_type: PassType, since: Optional[date], until: Optional[date], page_window: int
+    ) -> Iterator[List[PluxeeTransaction]]:
+        session = self._get_session()
+        responses = self._iter_transaction_responses(pass_type, session, page_window)
+        has_previous = False
+        try:
+            for response in responses:
+                page, complete = self._parse_transactions_page(response, since, until, has_previous)
+                has_previous = has_previous or bool(page)
+                yield page
+                if complete:
+                    break
+        finally:
+            responses.close()
+
+    def _iter_transactions(
+        self, pass_type: PassType, since: Optional[date], until: Optional[date], page_window: int
+    ) -> Iterator[PluxeeTransaction]:
+        pages = self._iter_transaction_pages(pass_type, since, until, page_window)
+        try:
+            for page in pages:
+                yield from page
+        finally:
+            pages.close()
 
     def get_transactions(
-        self, pass_type: PassType, since: Optional[date] = None, until: Optional[date] = None
+        self, pass_type: PassType, since: Optional[date] = None, until: Optional[date] = None, page_window: int = 1
     ) -> List[PluxeeTransaction]:
         """Retrieve the transactions of the requested pass type in the given interval.
 
@@ -100,6 +365,8 @@ class PluxeeClient(_PluxeeClient):
             pass_type: The type of the pass for which to retrieve the transactions.
             since: The start of the interval (inclusive). Only transactions on or after this date are returned.
             until: The end of the interval (exclusive). Only transactions before this date are returned.
+            page_window: The maximum number of pages requested concurrently (defaults to 1, one page after the other).
+                Pages past the last one needed are discarded.
 
         Raises:
             PluxeeAPIError: If Pluxee webpage did not respond with the expected status or do not contain the expected information.
@@ -108,20 +375,91 @@ class PluxeeClient(_PluxeeClient):
         Returns:
             List[PluxeeTransaction]: The transactions with the oldest elements first.
         """
-        with self.TemporaryPEMFile(self._aia_session, self._base_url_localized) as ssl_context:
-            session: requests.Session = self._session or requests.Session()
-            session.verify = ssl_context
-            transactions: List[PluxeeTransaction] = []
-            page_number = 0
-            complete = False
-            while not complete:
-                response = self._make_request(
-                    self._base_url_transactions,
-                    {"type": pass_type.value, "page": page_number},
-                    session,
-                )
-
-                complete = self._parse_transactions_from_response(response, transactions, since, until)
-                page_number += 1
+        if self._transaction_store is not None:
+            if page_window < 1:
+                raise ValueError(f"Invalid page_window '{page_window}'. Must be at least 1")
+            self._fill_transaction_store(pass_type, since, until, page_window)
+            self._check_credentials()
+            return self._transaction_store.query(self._username, pass_type, since, until)
+        transactions = list(self.iter_transactions(pass_type, since, until, page_window))
+        transactions.reverse()
+        return transactions
+
+    def get_all_transactions(
+        self, since: Optional[date] = None, until: Optional[date] = None, page_window: int = 1
+    ) -> Dict[PassType, List[PluxeeTransaction]]:
+        """Retrieve the transactions of every pass type of the account in the given interval.
+
+        The balance page is requested first, to log in once and to skip the pass types the account does not have. The
+        pass types are then paginated concurrently, in a thread pool sharing the session.
+
+        Args:
+            since: The start of the interval (inclusive). Only transactions on or after this date are returned.
+            until: The end of the interval (exclusive). Only transactions before this date are returned.
+            page_window: The maximum number of pages of each pass type requested concurrently (defaults to 1).
+
+        Raises:
+            PluxeeAPIError: If Pluxee webpage did not respond with the expected status or do not contain the expected information.
+            PluxeeLoginError: If an error occurred with the login process.
+
+        Returns:
+            Dict[PassType, List[PluxeeTransaction]]: The transactions of each pass type, with the oldest elements first.
+        """
+        session = self._get_session()
+        response = self._make_request(self._base_url_balance, {"check_logged_in": "1"}, session)
+        pass_types = self._parse_pass_types_from_response(response)
+        with ThreadPoolExecutor(max_workers=len(pass_types)) as executor:
+            futures = {
+                pass_type: executor.submit(self.get_transactions, pass_type, since, until, page_window)
+                for pass_type in pass_types
+            }
+            return {pass_type: future.result() for pass_type, future in futures.items()}
+
+    def _fill_transaction_store(self, pass_type: PassType, since: Optional[date], until: Optional[date], page_window: int):
+        store = self._transaction_store
+        # The concurrent calls wait for the transaction, then only request the ranges that are still missing.
+        with store.transaction():
+            ranges = store.missing_ranges(self._username, pass_type, since, until)
+            if not ranges:
+                return
+            store.clear_ranges(self._username, pass_type, ranges)
+            # A single pagination covers all the missing ranges, the pages always start from the newest transactions.
+            pages = self._iter_transaction_pages(pass_type, ranges[0][0], ranges[-1][1], page_window)
+            try:
+                for page in pages:
+                    store.add_page(self._username, pass_type, page, ranges)
+            finally:
+                pages.close()
+            store.add_coverage(self._username, pass_type, ranges)
+        # The pages were served to a logged in session.
+        self._credentials_checked = True
+
+    def _check_credentials(self):
+        # The store is keyed by username, its transactions are only served once the website accepted the password.
+        if not self._credentials_checked:
+            self._make_request(self._base_url_balance, {"check_logged_in": "1"}, self._get_session())
+            self._credentials_checked = True
 
-            return transactions[::-1]
+    def sync_transactions(
+        self, pass_type: PassType, state: TransactionSyncState, since: Optional[date] = None, page_window: int = 1
+    ) -> List[PluxeeTransaction]:
+        """Retrieve the transactions of the requested pass type that were not retrieved by the previous syncs.
+
+        Only the pages down to the high-water mark of the state are requested, and the state is updated.
+
+        Args:
+            pass_type: The type of the pass for which to retrieve the transactions.
+            state: The state of the previous syncs, updated in place.
+            since: The start of the interval of the first sync (inclusive). Ignored once the state has a high-water mark.
+            page_window: The maximum number of pages requested concurrently (defaults to 1, one page after the other).
+
+        Raises:
+            PluxeeAPIError: If Pluxee webpage did not respond with the expected status or do not contain the expected information.
+            PluxeeLoginError: If an error occurred with the login process.
+
+        Returns:
+            List[PluxeeTransaction]: The new transactions with the oldest elements first.
+        """
+        since = state.high_water_mark(self._username, pass_type) or since
+        transactions = list(self.iter_transactions(pass_type, since, page_window=page_window))
+        return state.update(self._username, pass_type, transactions)
@@ -0,0 +1,175 @@
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional
+
+
+class CachedResponse:
+    """
+    A page stored by the ``ResponseCache``.
+
+    Attrs:
+        content: The decoded body of the page.
+        status_code: The HTTP status of the page.
+        etag: The ``ETag`` header of the page, if any.
+        last_modified: The ``Last-Modified`` header of the page, if any.
+        stored_at: The timestamp when the page was last downloaded or revalidated.
+    """
+
+    __slots__ = ("content", "status_code", "etag", "last_modified", "stored_at")
+
+    def __init__(
+        self,
+        content: str,
+        status_code: int,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        stored_at: Optional[float] = None,
+    ):
+        self.content = content
+        self.status_code = status_code
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = time.time() if stored_at is None else stored_at
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """Get the headers revalidating the page, empty when the server gave no validator."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class ResponseCache:
+    """
+    A cache of the pages downloaded by the clients, keyed by credentials, URL and query parameters.
+
+    Pages younger than ``ttl`` are served without any request. Older pages are revalidated with ``If-None-Match`` and
+    ``If-Modified-Since`` when the server gave an ``ETag`` or a ``Last-Modified`` header, and downloaded again otherwise.
+    The most recently used pages are kept in memory. With a ``cache_dir``, every page is also written to disk, so the
+    cache survives between runs. The pages hold personal information, the directory is only readable by its owner.
+    The keys are an HMAC of the credentials with a random secret, kept in memory or in the ``secret.key`` file of the
+    directory, so a file name can not be used to guess a password.
+
+    Args:
+        ttl: The number of seconds a page is served without contacting the website (defaults to 60).
+        maxsize: The maximum number of pages kept in memory (defaults to 128).
+        cache_dir: The directory where the pages are written (defaults to None, in memory only).
+    """
+
+    def __init__(self, ttl: float = 60, maxsize: int = 128, cache_dir: Optional[str] = None):
+        if maxsize < 1:
+            raise ValueError(f"Invalid maxsize '{maxsize}'. Must be at least 1")
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self._entries: 'OrderedDict[str, CachedResponse]' = OrderedDict()
+        self._secret: Optional[bytes] = None
+        # The sync client fetches pages from a thread pool.
+        self._lock = threading.Lock()
+
+    def key(self, username: str, password: str, url: str, params: Mapping[str, Any]) -> str:
+        """Get the cache key of a page requested with the credentials of a client."""
+        data = json.dumps([username, password, url, sorted((str(name), str(value)) for name, value in params.items())])
+        return hmac.new(self._get_secret(), data.encode(), hashlib.sha256).hexdigest()
+
+    def _get_secret(self) -> bytes:
+        with self._lock:
+            if self._secret is None:
+                self._secret = self._load_secret() if self.cache_dir else os.urandom(32)
+            return self._secret
+
+    def _load_secret(self) -> bytes:
+        path = os.path.join(self.cache_dir, "secret.key")
+        os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+        # Written to a temporary file then linked, the caches of other processes read a whole secret or none.
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(os.urandom(32))
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+        with open(path, "rb") as f:
+            return f.read()
+
+    def is_fresh(self, entry: CachedResponse) -> bool:
+        """Tell whether the page can be served without contacting the website."""
+        return time.time() - entry.stored_at < self.ttl
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """Get a page from memory or from disk, whatever its age."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        entry = self._read(key)
+        if entry is not None:
+            self._remember(key, entry)
+        return entry
+
+    def put(self, key: str, content: str, status_code: int, headers: Optional[Mapping[str, str]] = None) -> CachedResponse:
+        """Store a downloaded page, with its ``ETag`` and ``Last-Modified`` headers."""
+        headers = headers or {}
+        entry = CachedResponse(content, status_code, headers.get("ETag"), headers.get("Last-Modified"))
+        self._remember(key, entry)
+        self._write(key, entry)
+        return entry
+
+    def revalidated(self, key: str, entry: CachedResponse) -> CachedResponse:
+        """Store that the website answered ``304 Not Modified`` for the page, which is fresh again."""
+        entry = CachedResponse(entry.content, entry.status_code, entry.etag, entry.last_modified)
+        self._remember(key, entry)
+        self._write(key, entry)
+        return entry
+
+    def clear(self):
+        """Remove every page, from memory and from disk."""
+        with self._lock:
+            self._entries.clear()
+        if self.cache_dir and os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".json"):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+    def _remember(self, key: str, entry: CachedResponse):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _read(self, key: str) -> Optional[CachedResponse]:
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return CachedResponse(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def _write(self, key: str, entry: CachedResponse):
+        if not self.cache_dir:
+            return
+        os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+        # Written to a temporary file then renamed, a reader never sees a partial page.
+        fd, path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entry.to_dict(), f)
+        os.replace(path, self._path(key))
@@ -0,0 +1,129 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .aia_chaser import AIASession
+from .pluxee_client import PluxeeClient
+
+
+class _CookieJarPool:
+    """
+    The logged in cookie jars of the most recently used accounts, keyed by credentials.
+
+    Attrs:
+        maxsize: The maximum number of cookie jars kept.
+        hits: The number of clients given a cookie jar holding a login cookie.
+        misses: The number of clients given an empty cookie jar, that will log in.
+    """
+
+    def __init__(self, maxsize: int, new_jar: Callable[[], Any]):
+        if maxsize < 1:
+            raise ValueError(f"Invalid maxsize '{maxsize}'. Must be at least 1")
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._new_jar = new_jar
+        self._jars: 'OrderedDict[Tuple[str, str], Any]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._jars)
+
+    def _checkout(self, username: str, password: str) -> Any:
+        # The password is part of the key, a login cookie is never given to other credentials.
+        key = (username, password)
+        with self._lock:
+            jar = self._jars.get(key)
+            if jar is None:
+                jar = self._new_jar()
+                self._jars[key] = jar
+                while len(self._jars) > self.maxsize:
+                    self._jars.popitem(last=False)
+            else:
+                self._jars.move_to_end(key)
+            if len(jar):
+                self.hits += 1
+            else:
+                self.misses += 1
+            return jar
+
+
+class PluxeeSessionPool(_CookieJarPool):
+    """
+    Keeps the login of many accounts, sharing a single connection pool.
+
+    Only the cookie jar of each account is kept, at most ``maxsize`` of them, the least recently used being evicted.
+    A client of an account still in the pool does not log in again.
+
+    Args:
+        maxsize: The maximum number of accounts kept logged in (defaults to 1024).
+        language: The pluxee website language (either 'fr' or 'nl', defaults to 'fr').
+        timeout: Request timeout in seconds (defaults to 30).
+        pool_maxsize: Maximum number of connections kept alive in the shared pool (defaults to 10).
+        parser: The HTML parser backend, either 'html.parser', 'lxml' or 'bs4' (defaults to 'html.parser').
+        aia_session: The AIASession resolving the certificate chain of the website (defaults to a new one, closed with the pool).
+
+    Attrs:
+        hits: The number of clients given a cookie jar holding a login cookie.
+        misses: The number of clients given an empty cookie jar, that will log in.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        language: str = 'fr',
+        timeout: int = 30,
+        pool_maxsize: int = 10,
+        parser: Optional[str] = None,
+        aia_session: Optional[AIASession] = None,
+    ):
+        super().__init__(maxsize, requests.cookies.RequestsCookieJar)
+        self._language = language
+        self._timeout = timeout
+        self._parser = parser
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self._owns_aia_session = aia_session is None
+        self._aia_session = aia_session or AIASession()
+
+    def __enter__(self) -> 'PluxeeSessionPool':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @contextmanager
+    def client(self, username: str, password: str) -> Iterator[PluxeeClient]:
+        """Get a client of the account, using the cookie jar of the pool and the shared connection pool.
+
+        Args:
+            username: The pluxee username.
+            password: The pluxee password.
+        """
+        session = requests.Session()
+        session.mount("https://", self._adapter)
+        session.cookies = self._checkout(username, password)
+        client = PluxeeClient(
+            username,
+            password,
+            self._language,
+            session=session,
+            timeout=self._timeout,
+            parser=self._parser,
+            aia_session=self._aia_session,
+        )
+        try:
+            yield client
+        finally:
+            client.close()
+
+    def close(self):
+        """Forget every login and close the shared connection pool."""
+        with self._lock:
+            self._jars.clear()
+        self._adapter.close()
+        if self._owns_aia_session:
+            self._aia_session.close()
@@ -0,0 +1,139 @@
+from array import array
+from bisect import bisect_left
+from datetime import date
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .base_pluxee_client import PluxeeTransaction
+
+try:
+    import numpy
+
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+
+class PluxeeTransactionColumns:
+    """
+    Transactions stored by column, with the oldest elements first.
+
+    The amounts are kept in an ``array('d')`` and the dates as ordinal days in an ``array('q')``. The merchants and the
+    details are interned in string tables and each transaction only keeps their index.
+
+    Attrs:
+        amounts: The amount of each transaction.
+        ordinals: The date of each transaction, as returned by ``date.toordinal``.
+        merchant_ids: The index in merchants of the merchant of each transaction.
+        detail_ids: The index in details of the detail of each transaction.
+        merchants: The unique merchants.
+        details: The unique details.
+    """
+
+    def __init__(self):
+        self.amounts = array("d")
+        self.ordinals = array("q")
+        self.merchant_ids = array("i")
+        self.detail_ids = array("i")
+        self.merchants: List[str] = []
+        self.details: List[str] = []
+
+    @classmethod
+    def from_transactions(cls, transactions: Iterable[PluxeeTransaction]) -> 'PluxeeTransactionColumns':
+        """Build the columns from transactions in any order, e.g. the output of ``get_transactions`` or ``iter_transactions``."""
+        columns = cls()
+        merchant_index: Dict[str, int] = {}
+        detail_index: Dict[str, int] = {}
+        for transaction in transactions:
+            columns.amounts.append(transaction.amount)
+            columns.ordinals.append(transaction.date.toordinal())
+            columns.merchant_ids.append(merchant_index.setdefault(transaction.merchant, len(merchant_index)))
+            columns.detail_ids.append(detail_index.setdefault(transaction.detail, len(detail_index)))
+        columns.merchants = list(merchant_index)
+        columns.details = list(detail_index)
+        columns._sort()
+        return columns
+
+    def _sort(self):
+        ordinals = self.ordinals
+        if all(ordinals[i] <= ordinals[i + 1] for i in range(len(ordinals) - 1)):
+            return
+        if all(ordinals[i] >= ordinals[i + 1] for i in range(len(ordinals) - 1)):
+            # Newest first, as yielded by iter_transactions.
+            order: Iterable[int] = range(len(ordinals) - 1, -1, -1)
+        else:
+            order = sorted(range(len(ordinals)), key=ordinals.__getitem__)
+        order = list(order)
+        for name in ("amounts", "ordinals", "merchant_ids", "detail_ids"):
+            column = getattr(self, name)
+            setattr(self, name, array(column.typecode, [column[i] for i in order]))
+
+    def __len__(self) -> int:
+        return len(self.amounts)
+
+    def __getitem__(self, index: int) -> PluxeeTransaction:
+        return PluxeeTransaction(
+            date.fromordinal(self.ordinals[index]),
+            self.amounts[index],
+            self.details[self.detail_ids[index]],
+            self.merchants[self.merchant_ids[index]],
+        )
+
+    def __iter__(self) -> Iterator[PluxeeTransaction]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def between(self, since: Optional[date] = None, until: Optional[date] = None) -> 'PluxeeTransactionColumns':
+        """Get the transactions in the given interval, found by bisection on the dates.
+
+        Args:
+            since: The start of the interval (inclusive).
+            until: The end of the interval (exclusive).
+        """
+        start = bisect_left(self.ordinals, since.toordinal()) if since else 0
+        end = bisect_left(self.ordinals, until.toordinal()) if until else len(self)
+        columns = PluxeeTransactionColumns()
+        columns.amounts = self.amounts[start:end]
+        columns.ordinals = self.ordinals[start:end]
+        columns.merchant_ids = self.merchant_ids[start:end]
+        columns.detail_ids = self.detail_ids[start:end]
+        # The string tables are shared, the indices stay valid.
+        columns.merchants = self.merchants
+        columns.details = self.details
+        return columns
+
+    def sum_by_merchant(self) -> Dict[str, float]:
+        """Get the sum of the amounts of each merchant."""
+        sums = [0.0] * len(self.merchants)
+        for merchant_id, amount in zip(self.merchant_ids, self.amounts):
+            sums[merchant_id] += amount
+        present = set(self.merchant_ids)
+        return {merchant: sums[merchant_id] for merchant_id, merchant in enumerate(self.merchants) if merchant_id in present}
+
+    def sum_by_month(self) -> Dict[Tuple[int, int], float]:
+        """Get the sum of the amounts of each (year, month)."""
+        sums: Dict[Tuple[int, int], float] = {}
+        last_ordinal = None
+        month = (0, 0)
+        for ordinal, amount in zip(self.ordinals, self.amounts):
+            # The dates are sorted, the month only has to be computed when the day changes.
+            if ordinal != last_ordinal:
+                day = date.fromordinal(ordinal)
+                month = (day.year, day.month)
+                last_ordinal = ordinal
+            sums[month] = sums.get(month, 0.0) + amount
+        return sums
+
+    def to_numpy(self) -> Dict[str, Any]:
+        """Get the columns as NumPy arrays sharing the memory of the columns, without any copy.
+
+        Raises:
+            ImportError: If NumPy is not installed.
+        """
+        if not NUMPY_AVAILABLE:
+            raise ImportError("to_numpy requires numpy to be installed")
+        return {
+            "amounts": numpy.frombuffer(self.amounts, dtype=numpy.float64),
+            "ordinals": numpy.frombuffer(self.ordinals, dtype=numpy.int64),
+            "merchant_ids": numpy.frombuffer(self.merchant_ids, dtype=numpy.int32),
+            "detail_ids": numpy.frombuffer(self.detail_ids, dtype=numpy.int32),
+        }
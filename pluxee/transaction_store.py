@@ -0,0 +1,244 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+from datetime import date
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from .base_pluxee_client import PassType, PluxeeTransaction
+
+# A date range (since inclusive, until exclusive), date.min and date.max standing for unbounded ranges.
+DateRange = Tuple[date, date]
+
+
+class TransactionStore:
+    """
+    Transactions stored in a SQLite database, by account and pass type.
+
+    The store also records the date ranges it fully holds. The clients given a store only request the ranges that are
+    missing, and serve the rest with a local query. The ranges are only complete up to yesterday, as new transactions
+    can still happen today. The clients store the transactions under their username, and only serve them once the
+    website accepted their password. The history of an account therefore survives a change of password.
+
+    Args:
+        path: The path of the SQLite database (defaults to ':memory:', a database living as long as the store).
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        self._con: Optional[sqlite3.Connection] = None
+        # The connection is shared by the threads of the sync client.
+        self._lock = threading.RLock()
+        self._in_transaction = False
+        self._async_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]" = weakref.WeakKeyDictionary()
+
+    def _get_connection(self) -> sqlite3.Connection:
+        if self._con is not None:
+            return self._con
+        if self.path != ":memory:" and os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        con = sqlite3.connect(self.path, check_same_thread=False)
+        with con:
+            con.executescript(
+                "\n".join(
+                    [
+                        "CREATE TABLE IF NOT EXISTS transactions (",
+                        "  id INTEGER PRIMARY KEY,",
+                        "  account TEXT NOT NULL,",
+                        "  pass_type TEXT NOT NULL,",
+                        "  date TEXT NOT NULL,",
+                        "  amount REAL NOT NULL,",
+                        "  detail TEXT NOT NULL,",
+                        "  merchant TEXT NOT NULL",
+                        ");",
+                        "CREATE INDEX IF NOT EXISTS transactions_date ON transactions (account, pass_type, date);",
+                        "CREATE INDEX IF NOT EXISTS transactions_merchant ON transactions (account, pass_type, merchant);",
+                        "CREATE TABLE IF NOT EXISTS coverage (",
+                        "  account TEXT NOT NULL,",
+                        "  pass_type TEXT NOT NULL,",
+                        "  since TEXT NOT NULL,",
+                        "  until TEXT NOT NULL",
+                        ");",
+                        "CREATE INDEX IF NOT EXISTS coverage_account ON coverage (account, pass_type);",
+                    ]
+                )
+            )
+        self._con = con
+        return con
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            if self._con is not None:
+                self._con.close()
+                self._con = None
+
+    def _get_coverage(self, account: str, pass_type: PassType) -> List[DateRange]:
+        with self._lock:
+            cur = self._get_connection().execute(
+                "SELECT since, until FROM coverage WHERE account = ? AND pass_type = ? ORDER BY since",
+                (account, PassType(pass_type).value),
+            )
+            return [(date.fromisoformat(since), date.fromisoformat(until)) for since, until in cur]
+
+    @staticmethod
+    def _missing_from_coverage(coverage: List[DateRange], since: Optional[date], until: Optional[date]) -> List[DateRange]:
+        start = since or date.min
+        end = until or date.max
+        missing = []
+        for covered_since, covered_until in coverage:
+            if covered_until <= start:
+                continue
+            if covered_since >= end:
+                break
+            if covered_since > start:
+                missing.append((start, covered_since))
+            start = max(start, covered_until)
+        if start < end:
+            missing.append((start, end))
+        return missing
+
+    def missing_ranges(
+        self, account: str, pass_type: PassType, since: Optional[date] = None, until: Optional[date] = None
+    ) -> List[DateRange]:
+        """Get the date ranges of the interval that are not held by the store, with the oldest range first.
+
+        Args:
+            account: The account of the transactions.
+            pass_type: The type of the pass of the transactions.
+            since: The start of the interval (inclusive).
+            until: The end of the interval (exclusive).
+        """
+        return self._missing_from_coverage(self._get_coverage(account, pass_type), since, until)
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """Run the reads and writes of the block in one database transaction, rolled back if the block raises.
+
+        The transaction locks the database against the writers of other threads and processes, the ranges found
+        missing in the block therefore stay missing until the block stores them. The writes of the store join the
+        transaction instead of committing on their own.
+        """
+        with self._lock:
+            con = self._get_connection()
+            if self._in_transaction:
+                yield
+                return
+            con.execute("BEGIN IMMEDIATE")
+            self._in_transaction = True
+            try:
+                yield
+            except BaseException:
+                con.rollback()
+                raise
+            else:
+                con.commit()
+            finally:
+                self._in_transaction = False
+
+    def async_lock(self) -> asyncio.Lock:
+        """Get the lock serializing the transactions of the coroutines of the running event loop.
+
+        The coroutines of a loop share its thread, the lock of the store does not exclude them from each other's
+        transactions.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            lock = self._async_locks.get(loop)
+            if lock is None:
+                lock = self._async_locks[loop] = asyncio.Lock()
+            return lock
+
+    def clear_ranges(self, account: str, pass_type: PassType, ranges: Iterable[DateRange]):
+        """Delete the transactions of the date ranges, before they are stored again."""
+        with self.transaction():
+            self._clear_ranges(self._get_connection(), account, pass_type, ranges)
+
+    def add_page(self, account: str, pass_type: PassType, transactions: List[PluxeeTransaction], ranges: List[DateRange]):
+        """Store the transactions of a page, newest first, that fall in one of the date ranges."""
+        with self.transaction():
+            self._insert(self._get_connection(), account, pass_type, transactions, ranges)
+
+    def add_coverage(self, account: str, pass_type: PassType, ranges: Iterable[DateRange]):
+        """Record that the date ranges are fully stored. The ranges are truncated before today."""
+        with self.transaction():
+            self._add_coverage(self._get_connection(), account, pass_type, ranges)
+
+    @staticmethod
+    def _clear_ranges(con: sqlite3.Connection, account: str, pass_type: PassType, ranges: Iterable[DateRange]):
+        con.executemany(
+            "DELETE FROM transactions WHERE account = ? AND pass_type = ? AND date >= ? AND date < ?",
+            [(account, PassType(pass_type).value, since.isoformat(), until.isoformat()) for since, until in ranges],
+        )
+
+    @staticmethod
+    def _insert(
+        con: sqlite3.Connection, account: str, pass_type: PassType, transactions: List[PluxeeTransaction], ranges: List[DateRange]
+    ):
+        rows = [
+            (account, PassType(pass_type).value, t.date.isoformat(), t.amount, t.detail, t.merchant)
+            for t in transactions
+            if any(since <= t.date < until for since, until in ranges)
+        ]
+        con.executemany(
+            "INSERT INTO transactions (account, pass_type, date, amount, detail, merchant) VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+    def _add_coverage(self, con: sqlite3.Connection, account: str, pass_type: PassType, ranges: Iterable[DateRange]):
+        today = date.today()
+        value = PassType(pass_type).value
+        coverage = self._get_coverage(account, pass_type)
+        coverage.extend((since, min(until, today)) for since, until in ranges if since < min(until, today))
+        coverage.sort()
+        merged: List[DateRange] = []
+        for since, until in coverage:
+            if merged and since <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], until))
+            else:
+                merged.append((since, until))
+
+        con.execute("DELETE FROM coverage WHERE account = ? AND pass_type = ?", (account, value))
+        con.executemany(
+            "INSERT INTO coverage (account, pass_type, since, until) VALUES (?, ?, ?, ?)",
+            [(account, value, since.isoformat(), until.isoformat()) for since, until in merged],
+        )
+
+    def query(
+        self,
+        account: str,
+        pass_type: PassType,
+        since: Optional[date] = None,
+        until: Optional[date] = None,
+        merchant: Optional[str] = None,
+    ) -> List[PluxeeTransaction]:
+        """Get the stored transactions in the given interval, without any request to the website.
+
+        Args:
+            account: The account of the transactions.
+            pass_type: The type of the pass of the transactions.
+            since: The start of the interval (inclusive).
+            until: The end of the interval (exclusive).
+            merchant: Only get the transactions of this merchant.
+
+        Returns:
+            List[PluxeeTransaction]: The transactions with the oldest elements first.
+        """
+        query = "SELECT date, amount, detail, merchant FROM transactions WHERE account = ? AND pass_type = ?"
+        args: list = [account, PassType(pass_type).value]
+        if since:
+            query += " AND date >= ?"
+            args.append(since.isoformat())
+        if until:
+            query += " AND date < ?"
+            args.append(until.isoformat())
+        if merchant is not None:
+            query += " AND merchant = ?"
+            args.append(merchant)
+        # Pages are stored newest first, the rows of a day are returned in the reverse order of insertion.
+        query += " ORDER BY date, id DESC"
+        with self._lock:
+            rows = self._get_connection().execute(query, args).fetchall()
+        return [PluxeeTransaction(date.fromisoformat(day), amount, detail, merchant) for day, amount, detail, merchant in rows]
@@ -0,0 +1,81 @@
+from collections import Counter
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+from .base_pluxee_client import PassType, PluxeeTransaction
+
+
+class TransactionSyncState:
+    """
+    The high-water mark of the transactions already synchronized, for each account and pass type.
+
+    The mark is the date of the newest transaction seen, with the transactions seen on that date. They are counted,
+    because identical transactions can happen on the same day. Transactions on the boundary date are therefore neither
+    returned twice nor missed.
+    """
+
+    def __init__(self):
+        self._marks: Dict[Tuple[str, str], Tuple[date, Counter]] = {}
+
+    def high_water_mark(self, username: str, pass_type: PassType) -> Optional[date]:
+        """Get the date of the newest transaction seen, or None if the account and pass type were never synchronized."""
+        mark = self._marks.get((username, PassType(pass_type).value))
+        return mark[0] if mark else None
+
+    def update(self, username: str, pass_type: PassType, transactions: List[PluxeeTransaction]) -> List[PluxeeTransaction]:
+        """Record the transactions fetched since the high-water mark (inclusive), and get the new ones.
+
+        Args:
+            username: The pluxee username.
+            pass_type: The type of the pass of the transactions.
+            transactions: All the transactions on or after the high-water mark, newest first.
+
+        Returns:
+            List[PluxeeTransaction]: The transactions that were not seen before, with the oldest elements first.
+        """
+        key = (username, PassType(pass_type).value)
+        mark = self._marks.get(key)
+        known = Counter(mark[1]) if mark else Counter()
+        new_transactions: List[PluxeeTransaction] = []
+        for transaction in transactions:
+            if mark and transaction.date < mark[0]:
+                continue
+            if known[transaction]:
+                known[transaction] -= 1
+                continue
+            new_transactions.append(transaction)
+
+        if transactions:
+            newest = max(transaction.date for transaction in transactions)
+            if not mark or newest >= mark[0]:
+                boundary = Counter(transaction for transaction in transactions if transaction.date == newest)
+                self._marks[key] = (newest, boundary)
+
+        new_transactions.reverse()
+        return new_transactions
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Get the state as a JSON serializable dictionary, to store it between runs."""
+        return {
+            "marks": [
+                {
+                    "username": username,
+                    "pass_type": pass_type,
+                    "date": mark_date.isoformat(),
+                    "boundary": [[*transaction.as_tuple()[1:], count] for transaction, count in boundary.items()],
+                }
+                for (username, pass_type), (mark_date, boundary) in self._marks.items()
+            ]
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'TransactionSyncState':
+        """Load a state stored with ``to_dict``."""
+        state = cls()
+        for mark in data["marks"]:
+            mark_date = date.fromisoformat(mark["date"])
+            boundary: Counter = Counter()
+            for amount, detail, merchant, count in mark["boundary"]:
+                boundary[PluxeeTransaction(mark_date, amount, detail, merchant)] = count
+            state._marks[(mark["username"], mark["pass_type"])] = (mark_date, boundary)
+        return state
@@ -1,19 +1,29 @@
+import datetime
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import AuthorityInformationAccessOID, NameOID
+
+
 class MockAPIResponse:
     """To mock requests response"""
 
-    def __init__(self, status_code: int, content: str, headers: dict = None):
+    def __init__(self, status_code: int, content: str, headers: dict = None, url: str = ""):
         self.status_code = status_code
         self.content = content
         self.headers = headers
+        self.url = url
 
 
 class AsyncMockAPIResponse:
     """To mock aiohttp async response"""
 
-    def __init__(self, status_code: int, content: str, headers: dict = None):
+    def __init__(self, status_code: int, content: str, headers: dict = None, url: str = ""):
         self.status = status_code
         self.content = content
         self.headers = headers
+        self.url = url
 
     async def __aenter__(self):
         return self
@@ -27,3 +37,63 @@ class AsyncMockAPIResponse:
 
 async def async_mock(*arg, **kwargs):
     pass
+
+
+def make_certificate(common_name, issuer=None, not_after=None, ca=True, ca_issuers=(), dns_names=()):
+    """Build a certificate signed by issuer, a (certificate, key) tuple, or self-signed when issuer is None."""
+    key = ec.generate_private_key(ec.SECP256R1())
+    subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    issuer_cert, issuer_key = issuer if issuer else (None, key)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    builder = (
+        x509.CertificateBuilder()
+        .subject_name(subject)
+        .issuer_name(issuer_cert.subject if issuer_cert else subject)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(not_after or now + datetime.timedelta(days=365))
+        .add_extension(x509.BasicConstraints(ca=ca, path_length=None), critical=True)
+    )
+    if ca_issuers:
+        builder = builder.add_extension(
+            x509.AuthorityInformationAccess(
+                [
+                    x509.AccessDescription(AuthorityInformationAccessOID.CA_ISSUERS, x509.UniformResourceIdentifier(url))
+                    for url in ca_issuers
+                ]
+            ),
+            critical=False,
+        )
+    if dns_names:
+        builder = builder.add_extension(x509.SubjectAlternativeName([x509.DNSName(name) for name in dns_names]), critical=False)
+    return builder.sign(issuer_key, hashes.SHA256()), key
+
+
+def to_pem(*certs):
+    return "".join(cert.public_bytes(serialization.Encoding.PEM).decode("ascii") for cert in certs)
+
+
+def make_transactions_page(rows):
+    """Build a logged in transactions page holding rows, a list of (date, merchant, detail, amount) strings."""
+    cells = "".join(
+        "<tr>"
+        f'<td class="views-field views-field-date">{day}</td>'
+        f'<td class="views-field views-field-description">{merchant}</td>'
+        f'<td class="views-field views-field-detail">{detail}</td>'
+        f'<td class="views-field views-field-amount"><span class="amount-transaction">{amount}</span></td>'
+        "</tr>"
+        for day, merchant, detail, amount in rows
+    )
+    return (
+        '<html><body><div class="dialog-off-canvas-main-canvas"><header><a href="/fr/user/logout">Logout</a></header>'
+        '<div><div><div class="transaction--section"><div class="transaction-list--section">'
+        '<div class="transactions-list--table"><div class="view-content"><table><thead><tr><th>Date</th></tr></thead>'
+        f"<tbody>{cells}</tbody></table></div></div></div></div></div></div></div></body></html>"
+    )
+
+
+def make_transactions_history(days):
+    """Split one transaction per day in days (newest first) into pages of 10 rows, like the Pluxee website."""
+    rows = [(day.strftime("%d.%m.%Y"), f"MERCHANT {day}", "Paiement", "- 1.00 EUR") for day in days]
+    return [make_transactions_page(rows[i : i + 10]) for i in range(0, len(rows) + 1, 10)]
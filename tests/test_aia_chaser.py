@@ -0,0 +1,395 @@
+import asyncio
+import datetime
+import os
+import ssl
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import OpenSSL
+import pytest
+from pytest_mock import MockerFixture
+
+from pluxee import AIASession
+from pluxee.aia_chaser import AIADownloadError, AIASchemeError
+
+from .conftest import make_certificate, to_pem
+
+
+@pytest.fixture(scope="function")
+def aia_session():
+    return AIASession()
+
+
+@pytest.fixture(scope="module")
+def root():
+    return make_certificate("Test Root")
+
+
+class TestAIASession:
+    def test_ssl_context_cached(self, mocker, aia_session: AIASession, root):
+        mock_cadata: MockerFixture = mocker.patch("pluxee.AIASession.cadata_from_host", return_value=to_pem(root[0]))
+
+        context = aia_session.ssl_context_from_url("https://users.pluxee.be/fr")
+        assert isinstance(context, ssl.SSLContext)
+        assert aia_session.ssl_context_from_host("USERS.pluxee.be") is context
+        assert aia_session.cached_ssl_context_from_url("https://users.pluxee.be/nl") is context
+        mock_cadata.assert_called_once()
+
+    def test_ssl_context_not_cached(self, aia_session: AIASession):
+        assert aia_session.cached_ssl_context_from_url("https://users.pluxee.be/fr") is None
+
+    def test_ssl_context_expires_with_chain(self, mocker, aia_session: AIASession, root):
+        not_after = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+        leaf = make_certificate("users.pluxee.be", issuer=root, not_after=not_after, ca=False)
+        mock_cadata: MockerFixture = mocker.patch("pluxee.AIASession.cadata_from_host", return_value=to_pem(leaf[0], root[0]))
+
+        context = aia_session.ssl_context_from_host("users.pluxee.be")
+        mocker.patch("time.time", return_value=not_after.timestamp() + 1)
+        assert aia_session.cached_ssl_context_from_host("users.pluxee.be") is None
+        assert aia_session.ssl_context_from_host("users.pluxee.be") is not context
+        assert mock_cadata.call_count == 2
+
+    def test_chain_chased_again_after_expiry(self, mocker, aia_session: AIASession, root):
+        intermediate = make_certificate("Test Intermediate", issuer=root)
+        not_after = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+        old_leaf = make_certificate(
+            "users.pluxee.be", issuer=intermediate, not_after=not_after, ca=False, ca_issuers=("http://ca.example.com/ca.der",)
+        )
+        new_leaf = make_certificate(
+            "users.pluxee.be", issuer=intermediate, ca=False, ca_issuers=("http://ca.example.com/ca.der",)
+        )
+        aia_session.add_trusted_root_cert(root[0])
+        mock_download = mocker.patch.object(
+            aia_session,
+            "_download_host_cert_chain",
+            side_effect=[[OpenSSL.crypto.X509.from_cryptography(leaf[0])] for leaf in (old_leaf, new_leaf)],
+        )
+        mocker.patch.object(
+            aia_session, "_get_ca_issuer_cert", return_value=OpenSSL.crypto.X509.from_cryptography(intermediate[0])
+        )
+        spy_chase = mocker.spy(aia_session, "aia_chase")
+
+        context = aia_session.ssl_context_from_host("users.pluxee.be")
+        assert aia_session.ssl_context_from_host("users.pluxee.be") is context
+        assert spy_chase.call_count == 1
+
+        # the cadata and the host cert chain expire with the context, so the server is asked again
+        mocker.patch("time.time", return_value=not_after.timestamp() + 1)
+        assert aia_session.ssl_context_from_host("users.pluxee.be") is not context
+        assert spy_chase.call_count == 2
+        assert mock_download.call_count == 2
+        assert to_pem(new_leaf[0]) in aia_session.cadata_from_host("users.pluxee.be")
+
+    def test_aia_chase_walks_missing_chain(self, mocker, aia_session: AIASession, root):
+        intermediate = make_certificate("Test Intermediate", issuer=root, ca_issuers=("http://ca.example.com/root.der",))
+        sub_intermediate = make_certificate(
+            "Test Sub Intermediate", issuer=intermediate, ca_issuers=("http://ca.example.com/intermediate.der",)
+        )
+        leaf = make_certificate(
+            "users.pluxee.be",
+            issuer=sub_intermediate,
+            ca=False,
+            ca_issuers=("http://down.example.com/sub.der", "http://ca.example.com/sub.der"),
+        )
+        aia_session.add_trusted_root_cert(root[0])
+        aia_session._cache_host_cert_chain("users.pluxee.be", [OpenSSL.crypto.X509.from_cryptography(leaf[0])])
+        certs_from_url = {
+            "http://ca.example.com/sub.der": sub_intermediate[0],
+            "http://ca.example.com/intermediate.der": intermediate[0],
+            "http://ca.example.com/root.der": root[0],
+        }
+
+        def get_ca_issuer_cert(url, timeout=5):
+            if url not in certs_from_url:
+                raise AIADownloadError("HTTP 404 (CA Issuer Cert.)")
+            return OpenSSL.crypto.X509.from_cryptography(certs_from_url[url])
+
+        mock_get = mocker.patch.object(aia_session, "_get_ca_issuer_cert", side_effect=get_ca_issuer_cert)
+        spy_verify = mocker.spy(aia_session, "_verify_chain_step")
+        mock_context = mocker.patch("OpenSSL.crypto.X509StoreContext", wraps=OpenSSL.crypto.X509StoreContext)
+
+        cert_chain, missing_certs = aia_session.aia_chase("users.pluxee.be")
+        assert [cert.get_subject().CN for cert in cert_chain] == [
+            "users.pluxee.be",
+            "Test Sub Intermediate",
+            "Test Intermediate",
+            "Test Root",
+        ]
+        assert [cert.get_subject().CN for cert in missing_certs] == ["Test Sub Intermediate", "Test Intermediate"]
+        # the walk stops at the trusted root, and the chain is verified once the walk is done
+        assert "http://ca.example.com/root.der" not in [call.args[0] for call in mock_get.call_args_list]
+        assert spy_verify.call_count == 2
+        # the walk only compares names, no verification happens between the fetches
+        assert mock_context.call_count == 2
+
+        # the download threads are kept for the next chases, until the session is closed
+        executor = aia_session._fetch_executor
+        aia_session.aia_chase("users.pluxee.be")
+        assert aia_session._fetch_executor is executor
+        aia_session.close()
+        assert aia_session._fetch_executor is None
+
+    @pytest.mark.asyncio
+    async def test_async_aia_chase(self, mocker, aia_session: AIASession, root):
+        intermediate = make_certificate("Test Intermediate", issuer=root)
+        leaf = make_certificate(
+            "users.pluxee.be",
+            issuer=intermediate,
+            ca=False,
+            ca_issuers=("http://down.example.com/ca.der", "http://up.example.com/ca.der"),
+        )
+        aia_session.add_trusted_root_cert(root[0])
+        aia_session._cache_host_cert_chain("users.pluxee.be", [OpenSSL.crypto.X509.from_cryptography(leaf[0])])
+
+        async def download(session, url):
+            if url.startswith("http://down."):
+                raise AIADownloadError("HTTP 404 (CA Issuer Cert.)")
+            return OpenSSL.crypto.X509.from_cryptography(intermediate[0])
+
+        mock_download = mocker.patch.object(aia_session, "_async_download_ca_issuer_cert", side_effect=download)
+
+        cert_chain, missing_certs = await aia_session.async_aia_chase("users.pluxee.be")
+        assert [cert.get_subject().CN for cert in cert_chain] == ["users.pluxee.be", "Test Intermediate", "Test Root"]
+        assert [cert.get_subject().CN for cert in missing_certs] == ["Test Intermediate"]
+        # both CA issuer URIs are requested at once
+        assert mock_download.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_async_ca_issuer_cert_scheme(self, aia_session: AIASession):
+        with pytest.raises(AIASchemeError):
+            await aia_session._async_get_ca_issuer_cert(None, ["ldap://example.com/ca.der"])
+
+    @pytest.mark.asyncio
+    async def test_host_cert_chain_shared_cache(self, mocker, aia_session: AIASession, root):
+        host_cert_chain = [OpenSSL.crypto.X509.from_cryptography(root[0])]
+        aia_session._cache_host_cert_chain("users.pluxee.be", host_cert_chain)
+        mock_connection = mocker.patch("asyncio.open_connection")
+
+        assert aia_session.get_host_cert_chain("users.pluxee.be") is host_cert_chain
+        assert await aia_session.async_get_host_cert_chain("users.pluxee.be") is host_cert_chain
+        mock_connection.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_async_ssl_context_cached(self, mocker, aia_session: AIASession, root):
+        async def cadata_from_host(host, **kwargs):
+            return to_pem(root[0])
+
+        mock_cadata = mocker.patch.object(aia_session, "async_cadata_from_host", side_effect=cadata_from_host)
+
+        context = await aia_session.async_ssl_context_from_url("https://users.pluxee.be/fr")
+        assert isinstance(context, ssl.SSLContext)
+        assert aia_session.ssl_context_from_host("users.pluxee.be") is context
+        mock_cadata.assert_called_once()
+
+    def test_chain_cache_db_shared_between_sessions(self, mocker, tmp_path, root):
+        not_after = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+        leaf = make_certificate("users.pluxee.be", issuer=root, not_after=not_after, ca=False)
+        cert_chain = [OpenSSL.crypto.X509.from_cryptography(cert) for cert in (leaf[0], root[0])]
+        mocker.patch("pluxee.AIASession._download_host_cert_chain", return_value=cert_chain[:1])
+        mock_chase = mocker.patch("pluxee.AIASession.aia_chase", return_value=(cert_chain, []))
+        chain_cache_db = str(tmp_path / "chains.db")
+
+        first_session = AIASession(chain_cache_db=chain_cache_db)
+        cadata = first_session.cadata_from_host("users.pluxee.be")
+        first_session.close()
+        assert mock_chase.call_count == 1
+
+        # a new process skips the chase
+        second_session = AIASession(chain_cache_db=chain_cache_db)
+        assert second_session.cadata_from_host("users.pluxee.be") == cadata
+        second_session.close()
+        assert mock_chase.call_count == 1
+
+        mocker.patch("time.time", return_value=not_after.timestamp() + 1)
+        third_session = AIASession(chain_cache_db=chain_cache_db)
+        third_session.cadata_from_host("users.pluxee.be")
+        third_session.close()
+        assert mock_chase.call_count == 2
+
+    def test_chain_cache_db_leaf_changed(self, mocker, tmp_path, root):
+        old_leaf, new_leaf = (make_certificate("users.pluxee.be", issuer=root, ca=False) for _ in range(2))
+        chains = [[OpenSSL.crypto.X509.from_cryptography(cert) for cert in (leaf[0], root[0])] for leaf in (old_leaf, new_leaf)]
+        mocker.patch("pluxee.AIASession._download_host_cert_chain", side_effect=[chain[:1] for chain in chains])
+        mock_chase = mocker.patch("pluxee.AIASession.aia_chase", side_effect=[(chain, []) for chain in chains])
+        chain_cache_db = str(tmp_path / "chains.db")
+
+        first_session = AIASession(chain_cache_db=chain_cache_db)
+        first_session.cadata_from_host("users.pluxee.be")
+        first_session.close()
+
+        # the server presents a new leaf cert: the stored chain is not used
+        second_session = AIASession(chain_cache_db=chain_cache_db)
+        cadata = second_session.cadata_from_host("users.pluxee.be")
+        second_session.close()
+        assert mock_chase.call_count == 2
+        assert to_pem(new_leaf[0]) in cadata
+
+    @pytest.mark.asyncio
+    async def test_chain_resolved_once_by_many_coroutines(self, mocker, tmp_path, root):
+        leaf = make_certificate("users.pluxee.be", issuer=root, ca=False)
+        cert_chain = [OpenSSL.crypto.X509.from_cryptography(cert) for cert in (leaf[0], root[0])]
+        aia_session = AIASession(chain_cache_db=str(tmp_path / "chains.db"))
+
+        async def download_host_cert_chain(host, timeout):
+            await asyncio.sleep(0.01)
+            return cert_chain[:1]
+
+        async def aia_chase(host, timeout=5):
+            await asyncio.sleep(0.01)
+            return cert_chain, []
+
+        mocker.patch.object(aia_session, "_async_download_host_cert_chain", side_effect=download_host_cert_chain)
+        mock_chase = mocker.patch.object(aia_session, "async_aia_chase", side_effect=aia_chase)
+
+        cadatas = await asyncio.gather(*(aia_session.async_cadata_from_host("users.pluxee.be") for _ in range(8)))
+        assert len(set(cadatas)) == 1
+        mock_chase.assert_called_once()
+        assert aia_session._async_chases == {}
+        # the chain was written to chain_cache_db by a download thread
+        aia_session.close()
+        second_session = AIASession(chain_cache_db=str(tmp_path / "chains.db"))
+        mocker.patch.object(second_session, "_async_download_host_cert_chain", side_effect=download_host_cert_chain)
+        assert await second_session.async_cadata_from_host("users.pluxee.be") == cadatas[0]
+        mock_chase.assert_called_once()
+        second_session.close()
+
+    def test_chain_resolved_once_by_many_threads(self, mocker, aia_session: AIASession, root):
+        leaf = make_certificate("users.pluxee.be", issuer=root, ca=False)
+        cert_chain = [OpenSSL.crypto.X509.from_cryptography(cert) for cert in (leaf[0], root[0])]
+
+        def aia_chase(host, timeout=5):
+            time.sleep(0.05)
+            return cert_chain, []
+
+        mock_chase = mocker.patch.object(aia_session, "aia_chase", side_effect=aia_chase)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            cadatas = list(executor.map(lambda _: aia_session.cadata_from_host("users.pluxee.be"), range(8)))
+        assert len(set(cadatas)) == 1
+        mock_chase.assert_called_once()
+        # the host locks are forgotten once no thread uses them
+        assert aia_session._host_locks == {}
+
+    def test_cache_db_used_by_many_threads(self, tmp_path, root):
+        aia_session = AIASession(cache_db=str(tmp_path / "certs.db"))
+        cert = OpenSSL.crypto.X509.from_cryptography(root[0])
+        url_parsed = urlsplit("http://ca.example.com/root.der")
+
+        def write_and_read(_):
+            aia_session._write_cert_cache(url_parsed, cert)
+            return aia_session._read_cert_cache(url_parsed).digest("sha256")
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            digests = list(executor.map(write_and_read, range(8)))
+        assert set(digests) == {cert.digest("sha256")}
+        aia_session.close()
+        assert aia_session.cache_db_con is None
+
+    def test_cadata_cache_wildcard(self, mocker, aia_session: AIASession, root):
+        leaf = make_certificate("*.pluxee.be", issuer=root, ca=False)
+        cert_chain = [OpenSSL.crypto.X509.from_cryptography(cert) for cert in (leaf[0], root[0])]
+        mock_chase = mocker.patch.object(aia_session, "aia_chase", return_value=(cert_chain, []))
+
+        cadata, host_regex = aia_session.cadata_and_host_regex_from_host("users.pluxee.be")
+        assert host_regex.fullmatch("users.pluxee.be:443")
+        assert not host_regex.fullmatch("pluxee.be")
+        assert not host_regex.fullmatch("a.users.pluxee.be")
+        assert aia_session.cadata_and_host_regex_from_host("API.pluxee.be:443") == (cadata, host_regex)
+        assert mock_chase.call_count == 1
+        aia_session.cadata_from_host("a.users.pluxee.be")
+        assert mock_chase.call_count == 2
+        assert (aia_session.cadata_cache_hits, aia_session.cadata_cache_misses) == (1, 2)
+
+    def test_cadata_cache_subject_alternative_names(self, mocker, aia_session: AIASession, root):
+        leaf = make_certificate("Pluxee", issuer=root, ca=False, dns_names=("users.pluxee.be", "*.pluxee.com"))
+        cert_chain = [OpenSSL.crypto.X509.from_cryptography(cert) for cert in (leaf[0], root[0])]
+        mock_chase = mocker.patch.object(aia_session, "aia_chase", return_value=(cert_chain, []))
+
+        cadata, host_regex = aia_session.cadata_and_host_regex_from_host("users.pluxee.be")
+        assert host_regex.fullmatch("users.pluxee.be:443")
+        assert host_regex.fullmatch("api.pluxee.com")
+        assert not host_regex.fullmatch("pluxee")
+        # every name of the leaf cert finds the chain
+        assert aia_session.cadata_from_host("USERS.pluxee.be") == cadata
+        assert aia_session.cadata_from_host("api.pluxee.com") == cadata
+        assert mock_chase.call_count == 1
+        assert (aia_session.cadata_cache_hits, aia_session.cadata_cache_misses) == (2, 1)
+
+    def test_cadata_cache_lru(self, mocker, root):
+        aia_session = AIASession(cadata_cache_size=2)
+        chains = {
+            host: [OpenSSL.crypto.X509.from_cryptography(make_certificate(host, issuer=root, ca=False)[0])]
+            for host in ("a.example.com", "b.example.com", "c.example.com")
+        }
+        mock_chase = mocker.patch.object(aia_session, "aia_chase", side_effect=lambda host, timeout=5: (chains[host], []))
+
+        for host in ("a.example.com", "b.example.com", "a.example.com", "c.example.com", "a.example.com", "b.example.com"):
+            aia_session.cadata_from_host(host)
+        # b.example.com was the least recently used host when c.example.com was added
+        assert [call.args[0] for call in mock_chase.call_args_list] == [
+            "a.example.com",
+            "b.example.com",
+            "c.example.com",
+            "b.example.com",
+        ]
+
+    def test_ssl_context_cache_lru(self, mocker, root):
+        aia_session = AIASession(cadata_cache_size=2)
+        mock_cadata = mocker.patch.object(aia_session, "cadata_from_host", return_value=to_pem(root[0]))
+
+        for host in ("a.example.com", "b.example.com", "a.example.com", "c.example.com", "a.example.com", "b.example.com"):
+            aia_session.ssl_context_from_host(host)
+        # b.example.com was the least recently used host when c.example.com was added
+        assert [call.args[0] for call in mock_cadata.call_args_list] == [
+            "a.example.com",
+            "b.example.com",
+            "c.example.com",
+            "b.example.com",
+        ]
+        assert len(aia_session._ssl_context_from_host) == 2
+
+    def test_invalid_cadata_cache_size(self):
+        with pytest.raises(ValueError):
+            AIASession(cadata_cache_size=0)
+
+    def test_trusted_root_cert_store(self, mocker, aia_session: AIASession, root):
+        leaf = make_certificate("users.pluxee.be", issuer=root, ca=False)
+        host_cert_chain = [OpenSSL.crypto.X509.from_cryptography(cert) for cert in (leaf[0], root[0])]
+        mocker.patch.object(aia_session, "_download_host_cert_chain", return_value=host_cert_chain)
+
+        assert aia_session.add_trusted_root_cert(root[0])
+        assert not aia_session.add_trusted_root_cert(root[0])
+        cert_chain, missing_certs = aia_session.aia_chase("users.pluxee.be")
+        assert len(cert_chain) == 2 and missing_certs == []
+        cert_store = aia_session._get_chase_cert_store()
+        aia_session.aia_chase("users.pluxee.be")
+        assert aia_session._get_chase_cert_store() is cert_store
+
+        # a removed root is not trusted anymore
+        assert aia_session.remove_trusted_root_cert(root[0])
+        assert not aia_session.remove_trusted_root_cert(root[0])
+        with pytest.raises(OpenSSL.crypto.X509StoreContextError):
+            aia_session.aia_chase("users.pluxee.be")
+
+    def test_removed_root_cert_forgets_chains(self, mocker, tmp_path):
+        root = make_certificate("Test Removed Root")
+        leaf = make_certificate("users.pluxee.be", issuer=root, ca=False)
+        host_cert_chain = [OpenSSL.crypto.X509.from_cryptography(cert) for cert in (leaf[0], root[0])]
+        aia_session = AIASession(chain_cache_db=str(tmp_path / "chains.db"))
+        mocker.patch.object(aia_session, "_download_host_cert_chain", return_value=host_cert_chain)
+        aia_session.add_trusted_root_cert(root[0])
+
+        assert isinstance(aia_session.ssl_context_from_host("users.pluxee.be"), ssl.SSLContext)
+        cafile = aia_session.cafile_from_url("https://users.pluxee.be/fr")
+
+        assert aia_session.remove_trusted_root_cert(root[0])
+        assert aia_session.cached_ssl_context_from_host("users.pluxee.be") is None
+        # the file is not served anymore, and is removed on close, as a request can still be reading it
+        assert aia_session._cafile_from_host == {}
+        assert aia_session.chain_cache_db_con.execute("select count(*) from chains").fetchone() == (0,)
+        # the chain is chased again, and the root is not trusted anymore
+        with pytest.raises(OpenSSL.crypto.X509StoreContextError):
+            aia_session.ssl_context_from_host("users.pluxee.be")
+        aia_session.close()
+        assert not os.path.exists(cafile)
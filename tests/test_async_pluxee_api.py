@@ -1,14 +1,25 @@
+import asyncio
 import pathlib
 import ssl
-from datetime import date
+from datetime import date, timedelta
 
 import aiohttp
 import pytest
 from pytest_mock import MockerFixture
 
-from pluxee import PassType, PluxeeAPIError, PluxeeAsyncClient, PluxeeBalance, PluxeeLoginError, PluxeeTransaction
+from pluxee import (
+    PassType,
+    PluxeeAPIError,
+    PluxeeAsyncClient,
+    PluxeeBalance,
+    PluxeeLoginError,
+    PluxeeTransaction,
+    ResponseCache,
+    TransactionStore,
+    TransactionSyncState,
+)
 
-from .conftest import AsyncMockAPIResponse, async_mock
+from .conftest import AsyncMockAPIResponse, async_mock, make_transactions_history, make_transactions_page
 
 test_data_dir = pathlib.Path(__file__).parent / "test_data"
 
@@ -289,11 +300,383 @@ class TestPluxeeAsyncClient:
     @pytest.mark.asyncio
     async def test_get_ssl_context(self, mocker, client: PluxeeAsyncClient):
         mock_ssl_ctx = ssl.create_default_context()
+
+        async def async_ssl_context_from_url(url):
+            return mock_ssl_ctx
+
         mock_aia = mocker.patch.object(
             client._aia_session,
-            'ssl_context_from_url',
-            return_value=mock_ssl_ctx,
+            'async_ssl_context_from_url',
+            side_effect=async_ssl_context_from_url,
         )
         result = await client.get_ssl_context(client._base_url_localized)
         mock_aia.assert_called_once_with(client._base_url_localized)
         assert result is mock_ssl_ctx
+
+    @pytest.mark.asyncio
+    async def test_get_ssl_context_cached(self, mocker, client: PluxeeAsyncClient):
+        mock_ssl_ctx = ssl.create_default_context()
+        mocker.patch.object(client._aia_session, 'cached_ssl_context_from_url', return_value=mock_ssl_ctx)
+        mock_aia = mocker.patch.object(client._aia_session, 'async_ssl_context_from_url')
+
+        result = await client.get_ssl_context(client._base_url_localized)
+        mock_aia.assert_not_called()
+        assert result is mock_ssl_ctx
+
+    @pytest.mark.asyncio
+    async def test_session_reused_between_calls(self, mocker):
+        mock_get = mocker.patch("aiohttp.ClientSession.get", return_value=AsyncMockAPIResponse(200, content=CONTENT_BALANCE))
+        mock_aia: MockerFixture = mocker.patch("pluxee.PluxeeAsyncClient.get_ssl_context", side_effect=async_mock)
+        mock_login = mocker.patch("pluxee.PluxeeAsyncClient._login", side_effect=async_mock)
+
+        async with PluxeeAsyncClient("Foo", "Bar", limit=5, ttl_dns_cache=60) as client:
+            await client.get_balance()
+            session = client._session
+            await client.get_balance()
+            assert client._session is session
+            assert session.connector.limit == 5
+            assert session.connector.use_dns_cache
+        assert session.closed
+        assert client._session is None
+        assert mock_get.call_count == 2
+        mock_aia.assert_called_once()
+        mock_login.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_close_keeps_given_session(self):
+        async with aiohttp.ClientSession() as session:
+            client = PluxeeAsyncClient("Foo", "Bar", session=session)
+            await client.close()
+            assert not session.closed
+            assert client._session is session
+
+    @pytest.mark.asyncio
+    async def test_get_transactions_page_window(self, mocker, client: PluxeeAsyncClient):
+        days = [date(2024, 3, 1) - timedelta(days=i) for i in range(35)]
+        pages = make_transactions_history(days)
+        mock_get = mocker.patch(
+            "aiohttp.ClientSession.get",
+            side_effect=lambda url, params: AsyncMockAPIResponse(200, content=pages[min(params["page"], 3)]),
+        )
+        mocker.patch("pluxee.PluxeeAsyncClient.get_ssl_context", side_effect=async_mock)
+
+        transactions = await client.get_transactions(PassType.LUNCH, since=date(2024, 2, 10), page_window=3)
+        assert [transaction.date for transaction in transactions] == sorted(day for day in days if day >= date(2024, 2, 10))
+        fetched_pages = [kwargs["params"]["page"] for _, kwargs in mock_get.call_args_list]
+        assert fetched_pages[:4] == [0, 1, 2, 3]
+        await client.close()
+
+    @pytest.mark.asyncio
+    async def test_get_transactions_invalid_page_window(self, client: PluxeeAsyncClient):
+        with pytest.raises(ValueError):
+            await client.get_transactions(PassType.LUNCH, page_window=0)
+        # Raised at the call, before the iteration starts.
+        with pytest.raises(ValueError):
+            client.aiter_transactions(PassType.LUNCH, page_window=0)
+
+    @pytest.mark.asyncio
+    async def test_aiter_transactions_stops_early(self, mocker, client: PluxeeAsyncClient):
+        days = [date(2024, 3, 1) - timedelta(days=i) for i in range(35)]
+        pages = make_transactions_history(days)
+        mock_get = mocker.patch(
+            "aiohttp.ClientSession.get",
+            side_effect=lambda url, params: AsyncMockAPIResponse(200, content=pages[params["page"]]),
+        )
+        mocker.patch("pluxee.PluxeeAsyncClient.get_ssl_context", side_effect=async_mock)
+
+        dates = []
+        async for transaction in client.aiter_transactions(PassType.LUNCH):
+            dates.append(transaction.date)
+            if len(dates) == 12:
+                break
+        assert dates == days[:12]
+        assert mock_get.call_count == 2
+        await client.close()
+
+    @pytest.mark.asyncio
+    async def test_sync_transactions(self, mocker, client: PluxeeAsyncClient):
+        days = [date(2024, 3, 1) - timedelta(days=i) for i in range(35)]
+        pages = make_transactions_history(days)
+        mock_get = mocker.patch(
+            "aiohttp.ClientSession.get",
+            side_effect=lambda url, params: AsyncMockAPIResponse(200, content=pages[params["page"]]),
+        )
+        mocker.patch("pluxee.PluxeeAsyncClient.get_ssl_context", side_effect=async_mock)
+        state = TransactionSyncState()
+
+        transactions = await client.sync_transactions(PassType.LUNCH, state, since=date(2024, 2, 10))
+        assert [transaction.date for transaction in transactions] == sorted(day for day in days if day >= date(2024, 2, 10))
+
+        days.insert(0, date(2024, 3, 2))
+        pages = make_transactions_history(days)
+        mock_get.reset_mock()
+        transactions = await client.sync_transactions(PassType.LUNCH, state)
+        assert [transaction.date for transaction in transactions] == [date(2024, 3, 2)]
+        assert mock_get.call_count == 1
+        await client.close()
+
+    @pytest.mark.asyncio
+    async def test_get_transactions_with_store(self, mocker):
+        days = [date(2024, 3, 1) - timedelta(days=i) for i in range(35)]
+        pages = make_transactions_history(days)
+        mock_get = mocker.patch(
+            "aiohttp.ClientSession.get",
+            side_effect=lambda url, params: AsyncMockAPIResponse(200, content=pages[params["page"]]),
+        )
+        mocker.patch("pluxee.PluxeeAsyncClient.get_ssl_context", side_effect=async_mock)
+        store = TransactionStore()
+        spy_add_page = mocker.spy(store, "add_page")
+        client = PluxeeAsyncClient("Foo", "Bar", transaction_store=store)
+
+        transactions = await client.get_transactions(PassType.LUNCH, since=date(2024, 2, 10), until=date(2024, 2, 20))
+        assert [transaction.date for transaction in transactions] == sorted(
+            day for day in days if date(2024, 2, 10) <= day < date(2024, 2, 20)
+        )
+        assert mock_get.call_count == 3
+        # The pages are stored one by one, as they are retrieved.
+        assert spy_add_page.call_count == 3
+
+        # The range is served by the store.
+        mock_get.reset_mock()
+        assert await client.get_transactions(PassType.LUNCH, since=date(2024, 2, 12), until=date(2024, 2, 15)) == [
+            transaction for transaction in transactions if date(2024, 2, 12) <= transaction.date < date(2024, 2, 15)
+        ]
+        mock_get.assert_not_called()
+
+        # Only the missing ranges are stored, with a single pagination.
+        transactions = await client.get_transactions(PassType.LUNCH, since=date(2024, 2, 1), until=date(2024, 2, 25))
+        assert [transaction.date for transaction in transactions] == sorted(
+            day for day in days if date(2024, 2, 1) <= day < date(2024, 2, 25)
+        )
+        assert mock_get.call_count == 4
+        assert store.missing_ranges("Foo", PassType.LUNCH, date(2024, 2, 1), date(2024, 2, 25)) == []
+        await client.close()
+        store.close()
+
+    @pytest.mark.asyncio
+    async def test_get_transactions_with_store_concurrent(self, mocker):
+        days = [date(2024, 3, 1) - timedelta(days=i) for i in range(35)]
+        pages = make_transactions_history(days)
+
+        class SlowResponse(AsyncMockAPIResponse):
+            async def text(self):
+                # Lets the other call run between the pages.
+                await asyncio.sleep(0)
+                return self.content
+
+        mocker.patch(
+            "aiohttp.ClientSession.get",
+            side_effect=lambda url, params: SlowResponse(200, content=pages[params["page"]]),
+        )
+        mocker.patch("pluxee.PluxeeAsyncClient.get_ssl_context", side_effect=async_mock)
+        store = TransactionStore()
+        client = PluxeeAsyncClient("Foo", "Bar", transaction_store=store)
+
+        short, long = await asyncio.gather(
+            client.get_transactions(PassType.LUNCH, since=date(2024, 2, 10), until=date(2024, 2, 20)),
+            client.get_transactions(PassType.LUNCH, since=date(2024, 2, 10), until=date(2024, 2, 21)),
+        )
+        assert (len(short), len(long)) == (10, 11)
+        assert len(await client.get_transactions(PassType.LUNCH, since=date(2024, 2, 10), until=date(2024, 2, 20))) == 10
+        await client.close()
+        store.close()
+
+    @pytest.mark.asyncio
+    async def test_response_cache(self, mocker):
+        mock_time = mocker.patch("time.time", return_value=1000.0)
+        mock_get = mocker.patch(
+            "aiohttp.ClientSession.get",
+            return_value=AsyncMockAPIResponse(200, content=CONTENT_BALANCE, headers={"Last-Modified": "yesterday"}),
+        )
+        mocker.patch("pluxee.PluxeeAsyncClient.get_ssl_context", side_effect=async_mock)
+        client = PluxeeAsyncClient("Foo", "Bar", response_cache=ResponseCache(ttl=10))
+
+        balance = await client.get_balance()
+        assert await client.get_balance() == balance
+        assert mock_get.call_count == 1
+
+        mock_time.return_value = 1010.0
+        mock_get.return_value = AsyncMockAPIResponse(304, content="", headers={})
+        assert await client.get_balance() == balance
+        assert mock_get.call_count == 2
+        _, kwargs = mock_get.call_args
+        assert kwargs["headers"] == {"If-Modified-Since": "yesterday"}
+        await client.close()
+
+    @pytest.mark.asyncio
+    async def test_response_cache_wrong_password(self, mocker):
+        mock_get = mocker.patch("aiohttp.ClientSession.get", return_value=AsyncMockAPIResponse(200, content=CONTENT_BALANCE))
+        mocker.patch("pluxee.PluxeeAsyncClient.get_ssl_context", side_effect=async_mock)
+        response_cache = ResponseCache(ttl=10)
+        client = PluxeeAsyncClient("Foo", "Bar", response_cache=response_cache)
+        await client.get_balance()
+        await client.close()
+
+        mock_get.return_value = AsyncMockAPIResponse(200, content="login", url="https://users.pluxee.be/fr/user/login")
+        mock_post = mocker.patch("aiohttp.ClientSession.post", return_value=AsyncMockAPIResponse(302, content="coucou"))
+        client = PluxeeAsyncClient("Foo", "WRONG", response_cache=response_cache)
+        with pytest.raises(PluxeeLoginError):
+            await client.get_balance()
+        mock_post.assert_called_once()
+        await client.close()
+
+    @pytest.mark.asyncio
+    async def test_keep_alive(self, mocker, client: PluxeeAsyncClient):
+        mocker.patch("pluxee.PluxeeAsyncClient.get_ssl_context", side_effect=async_mock)
+        logged_in = asyncio.Event()
+
+        def post(**kwargs):
+            logged_in.set()
+            return AsyncMockAPIResponse(303, content="coucou", headers={"set-cookie": "key=value; Max-Age=3600"})
+
+        mock_post = mocker.patch("aiohttp.ClientSession.post", side_effect=post)
+
+        with pytest.raises(ValueError):
+            client.start_keep_alive(refresh_interval=0)
+        with pytest.raises(ValueError):
+            client.start_keep_alive(margin=-1)
+        client.start_keep_alive()
+        await asyncio.wait_for(logged_in.wait(), 5)
+        task = client._keep_alive_task
+        await client.close()
+        assert task.cancelled()
+        assert client._keep_alive_task is None
+        assert mock_post.call_count == 1
+        assert client._cookie_expires_at - client._logged_in_at == 3600
+
+    @pytest.mark.asyncio
+    async def test_keep_alive_cancelled_during_login(self, mocker, client: PluxeeAsyncClient):
+        mocker.patch("pluxee.PluxeeAsyncClient.get_ssl_context", side_effect=async_mock)
+        logging_in = asyncio.Event()
+
+        class HangingResponse(AsyncMockAPIResponse):
+            async def __aenter__(self):
+                logging_in.set()
+                await asyncio.Event().wait()
+
+        mocker.patch("aiohttp.ClientSession.post", return_value=HangingResponse(303, content="coucou"))
+
+        client.start_keep_alive()
+        await asyncio.wait_for(logging_in.wait(), 5)
+        task = client._keep_alive_task
+        # The cancel reaches the task in the middle of the login, and stops it.
+        await asyncio.wait_for(client.close(), 5)
+        assert task.cancelled()
+
+    @pytest.mark.asyncio
+    async def test_single_flight(self, mocker, client: PluxeeAsyncClient):
+        def get(url, params):
+            return AsyncMockAPIResponse(200, content=CONTENT_TRANSACTIONS if "page" in params else CONTENT_BALANCE)
+
+        mock_get = mocker.patch("aiohttp.ClientSession.get", side_effect=get)
+        mocker.patch("pluxee.PluxeeAsyncClient.get_ssl_context", side_effect=async_mock)
+
+        balances = await asyncio.gather(*(client.get_balance() for _ in range(5)))
+        assert mock_get.call_count == 1
+        assert all(balance == balances[0] for balance in balances)
+
+        mock_get.reset_mock()
+        results = await asyncio.gather(*(client.get_transactions(PassType.LUNCH) for _ in range(3)))
+        assert mock_get.call_count == 1
+        assert results[0] == results[1] == results[2]
+        assert results[0] is not results[1]
+        assert client._inflight == {}
+
+        # Once the calls completed, a new call is not coalesced.
+        await client.get_balance()
+        assert mock_get.call_count == 2
+        await client.close()
+
+    @pytest.mark.asyncio
+    async def test_single_flight_login(self, mocker, client: PluxeeAsyncClient):
+        logged_in = False
+
+        def post(**kwargs):
+            nonlocal logged_in
+            logged_in = True
+            return AsyncMockAPIResponse(303, content="coucou", headers={"set-cookie": "key=value"})
+
+        def get(url, params):
+            if not logged_in:
+                return AsyncMockAPIResponse(200, content=CONTENT_EXPIRED_COOKIES)
+            return AsyncMockAPIResponse(200, content=CONTENT_TRANSACTIONS if "page" in params else CONTENT_BALANCE)
+
+        mock_post = mocker.patch("aiohttp.ClientSession.post", side_effect=post)
+        mocker.patch("aiohttp.ClientSession.get", side_effect=get)
+        mocker.patch("pluxee.PluxeeAsyncClient.get_ssl_context", side_effect=async_mock)
+
+        balance, transactions = await asyncio.gather(client.get_balance(), client.get_transactions(PassType.LUNCH))
+        assert mock_post.call_count == 1
+        assert balance.lunch_pass == 1
+        assert transactions
+        assert client._login_generation == 1
+        await client.close()
+
+    @pytest.mark.asyncio
+    async def test_single_flight_error(self, mocker, client: PluxeeAsyncClient):
+        mocker.patch("aiohttp.ClientSession.get", return_value=AsyncMockAPIResponse(200, content=CONTENT_EXPIRED_COOKIES))
+        mock_post = mocker.patch(
+            "aiohttp.ClientSession.post",
+            return_value=AsyncMockAPIResponse(302, content="coucou", headers={"set-cookie": "key=value"}),
+        )
+        mocker.patch("pluxee.PluxeeAsyncClient.get_ssl_context", side_effect=async_mock)
+
+        results = await asyncio.gather(client.get_balance(), client.get_balance(), return_exceptions=True)
+        assert all(isinstance(result, PluxeeLoginError) for result in results)
+        assert mock_post.call_count == 1
+        assert client._login_task is None
+        await client.close()
+
+    @pytest.mark.asyncio
+    async def test_get_all_transactions(self, mocker, client: PluxeeAsyncClient):
+        # The account has no gift pass.
+        content_balance = CONTENT_BALANCE.replace("?type=GIFT", "?type=NONE")
+
+        def get(url, params):
+            if "type" not in params:
+                return AsyncMockAPIResponse(200, content=content_balance)
+            return AsyncMockAPIResponse(
+                200, content=make_transactions_page([("01.03.2024", params["type"], "Paiement", "- 1.00 EUR")])
+            )
+
+        mock_get = mocker.patch("aiohttp.ClientSession.get", side_effect=get)
+        mocker.patch("pluxee.PluxeeAsyncClient.get_ssl_context", side_effect=async_mock)
+
+        transactions = await client.get_all_transactions(since=date(2024, 1, 1))
+        assert list(transactions) == [PassType.LUNCH, PassType.ECO, PassType.CONSO]
+        for pass_type, pass_transactions in transactions.items():
+            assert [transaction.merchant for transaction in pass_transactions] == [pass_type.value]
+        assert mock_get.call_count == 4
+        await client.close()
+
+    @pytest.mark.asyncio
+    async def test_fetch_balances(self, mocker):
+        mocker.patch("pluxee.AIASession.async_ssl_context_from_url", side_effect=async_mock)
+        clients = []
+
+        async def get_balance(client):
+            clients.append(client)
+            if client._username == "Bad":
+                raise PluxeeLoginError("Bad username/password")
+            return PluxeeBalance(len(client._username), 0, 0, 0)
+
+        mocker.patch.object(PluxeeAsyncClient, "get_balance", autospec=True, side_effect=get_balance)
+
+        credentials = [("Foo", "Bar"), ("Bad", "Bar"), ("Foobar", "Bar")]
+        results = {username: result async for username, result in PluxeeAsyncClient.fetch_balances(credentials, concurrency=2)}
+        assert results["Foo"].lunch_pass == 3
+        assert results["Foobar"].lunch_pass == 6
+        assert isinstance(results["Bad"], PluxeeLoginError)
+        assert len({id(client._aia_session) for client in clients}) == 1
+        assert len({id(client._session.connector) for client in clients}) == 1
+        assert len({id(client._session.cookie_jar) for client in clients}) == 3
+
+    @pytest.mark.asyncio
+    async def test_fetch_balances_setup_error(self, mocker):
+        mocker.patch("pluxee.AIASession.async_ssl_context_from_url", side_effect=ssl.SSLError("no chain"))
+        mock_close = mocker.patch("pluxee.AIASession.close")
+
+        with pytest.raises(ssl.SSLError):
+            async for _ in PluxeeAsyncClient.fetch_balances([("Foo", "Bar")]):
+                pass
+        mock_close.assert_called_once()
@@ -0,0 +1,110 @@
+import pathlib
+from datetime import date
+
+import pytest
+from pytest_mock import MockerFixture
+
+from pluxee import PluxeeAPIError, PluxeeClient
+from pluxee.base_pluxee_client import _ResponseWrapper
+from pluxee.parsers import LXML_AVAILABLE, HTMLParserBackend, ParserBackend, _TransactionsHTMLParser, get_parser
+
+from .conftest import make_transactions_page
+
+test_data_dir = pathlib.Path(__file__).parent / "test_data"
+
+CONTENT_BALANCE = open(test_data_dir / "content_balance.html", "r", encoding="utf-8").read()
+CONTENT_EXPIRED_COOKIES = open(test_data_dir / "content_empty_balance.html", "r", encoding="utf-8").read()
+CONTENT_TRANSACTIONS = open(test_data_dir / "content_transactions.html", "r", encoding="utf-8").read()
+CONTENT_MALFORMED_TRANSACTIONS = open(test_data_dir / "content_malformed_transactions.html", "r", encoding="utf-8").read()
+
+PARSERS = [
+    "bs4",
+    "html.parser",
+    pytest.param("lxml", marks=pytest.mark.skipif(not LXML_AVAILABLE, reason="lxml is not installed")),
+]
+
+
+@pytest.mark.parametrize("parser", PARSERS)
+class TestParsers:
+    def test_parse_balance(self, parser):
+        prices = get_parser(parser).parse_balance(CONTENT_BALANCE)
+        assert prices == {"LUNCH": "1 €", "ECO": "2 €", "GIFT": "3 €", "CONSO": "4 €"}
+
+    def test_parse_balance_missing_pass(self, parser):
+        content = CONTENT_BALANCE.replace('<span class="balance--price">3 €</span>', "")
+        prices = get_parser(parser).parse_balance(content)
+        assert prices == {"LUNCH": "1 €", "ECO": "2 €", "GIFT": None, "CONSO": "4 €"}
+
+    def test_parse_balance_not_found(self, parser):
+        assert set(get_parser(parser).parse_balance(CONTENT_EXPIRED_COOKIES).values()) == {None}
+        assert set(get_parser(parser).parse_balance("").values()) == {None}
+
+    def test_client_parse_balance(self, parser):
+        client = PluxeeClient("Foo", "Bar", parser=parser)
+        balance = client._parse_balance_from_response(_ResponseWrapper(CONTENT_BALANCE, 200))
+        assert (balance.lunch_pass, balance.eco_pass, balance.gift_pass, balance.conso_pass) == (1, 2, 3, 4)
+        with pytest.raises(PluxeeAPIError):
+            client._parse_balance_from_response(_ResponseWrapper(CONTENT_EXPIRED_COOKIES, 200))
+
+    def test_iter_transaction_rows(self, parser):
+        rows = [tuple(text.strip() for text in row) for row in get_parser(parser).iter_transaction_rows(CONTENT_TRANSACTIONS)]
+        assert rows == [
+            ("06.02.2024", "THE MERCHANT", "Paiement detail", "- 6.10 EUR"),
+            ("28.01.2024", "YOUR EMPLOYER", "18 cheques de 8 € = 144 €. Expiry date: \n28.01.2025", "+ 144.00 EUR"),
+            ("24.01.2024", "ANOTHER MERCHANT", "Paiement detail", "- 6.60 EUR"),
+        ]
+
+    def test_iter_transaction_rows_missing_cell(self, parser):
+        rows = list(get_parser(parser).iter_transaction_rows(CONTENT_MALFORMED_TRANSACTIONS))
+        assert [row[0] is None for row in rows] == [False, True, False]
+
+    def test_iter_transaction_rows_no_table(self, parser):
+        assert get_parser(parser).iter_transaction_rows(CONTENT_BALANCE) is None
+        assert get_parser(parser).iter_transaction_rows("") is None
+
+    def test_iter_transaction_rows_empty_table(self, parser):
+        assert list(get_parser(parser).iter_transaction_rows(make_transactions_page([]))) == []
+
+    def test_client_parse_transactions(self, parser):
+        client = PluxeeClient("Foo", "Bar", parser=parser)
+        transactions, complete = client._parse_transactions_page(
+            _ResponseWrapper(CONTENT_TRANSACTIONS, 200), since=date(2024, 1, 25)
+        )
+        assert complete
+        assert [(transaction.date, transaction.amount, transaction.merchant) for transaction in transactions] == [
+            (date(2024, 2, 6), -6.1, "THE MERCHANT"),
+            (date(2024, 1, 28), 144, "YOUR EMPLOYER"),
+        ]
+
+
+def test_html_parser_stops_at_since(mocker):
+    # The streaming parser feeds the page by chunks and stops feeding once the iteration stops.
+    rows = [(f"{day:02}.01.2024", "MERCHANT", "Paiement", "- 1.00 EUR") for day in range(31, 0, -1)]
+    content = make_transactions_page(rows * 20)
+    mock_feed: MockerFixture = mocker.spy(_TransactionsHTMLParser, "feed")
+
+    client = PluxeeClient("Foo", "Bar", parser="html.parser")
+    transactions, complete = client._parse_transactions_page(_ResponseWrapper(content, 200), since=date(2024, 1, 30))
+    assert complete
+    assert len(transactions) == 2
+    assert mock_feed.call_count < len(content) // HTMLParserBackend.CHUNK_SIZE
+
+
+def test_default_parser():
+    assert get_parser().name == "html.parser"
+
+
+def test_invalid_parser():
+    with pytest.raises(ValueError):
+        get_parser("html5lib")
+
+
+def test_lxml_not_installed(mocker):
+    mocker.patch("pluxee.parsers.LXML_AVAILABLE", False)
+    with pytest.raises(ValueError):
+        get_parser("lxml")
+
+
+def test_parser_backend_is_abstract():
+    with pytest.raises(TypeError):
+        ParserBackend()
@@ -1,14 +1,30 @@
+import os
 import pathlib
 import ssl
-from datetime import date
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
 
 import pytest
 import requests
 from pytest_mock import MockerFixture
-
-from pluxee import PassType, PluxeeAPIError, PluxeeBalance, PluxeeClient, PluxeeLoginError, PluxeeTransaction
-
-from .conftest import MockAPIResponse
+from requests.adapters import HTTPAdapter
+
+from pluxee import (
+    AIASession,
+    PassType,
+    PluxeeAPIError,
+    PluxeeBalance,
+    PluxeeClient,
+    PluxeeLoginError,
+    PluxeeTransaction,
+    ResponseCache,
+    TransactionStore,
+    TransactionSyncState,
+)
+
+from .conftest import MockAPIResponse, make_transactions_history, make_transactions_page
 
 test_data_dir = pathlib.Path(__file__).parent / "test_data"
 
@@ -281,3 +297,423 @@ class TestPluxeeClient:
         client.get_balance()
         _, kwargs = mock_get.call_args
         assert kwargs.get("timeout") == client._timeout
+
+    def test_session_reused_between_calls(self, mocker, client: PluxeeClient):
+        mock_get: MockerFixture = mocker.patch(
+            "requests.Session.get",
+            return_value=MockAPIResponse(200, content=CONTENT_BALANCE),
+        )
+        mocker.patch("pluxee.AIASession.cadata_from_url", return_value="my_certificate")
+        mock_login: MockerFixture = mocker.patch("pluxee.PluxeeClient._login")
+
+        client.get_balance()
+        session = client._session
+        client.get_balance()
+        assert client._session is session
+        assert mock_get.call_count == 2
+        mock_login.assert_not_called()
+
+    def test_close_owned_session(self, mocker):
+        mocker.patch("requests.Session.get", return_value=MockAPIResponse(200, content=CONTENT_BALANCE))
+        mocker.patch("pluxee.AIASession.cadata_from_url", return_value="my_certificate")
+        mock_close: MockerFixture = mocker.patch("requests.Session.close")
+
+        with PluxeeClient("Foo", "Bar") as client:
+            client.get_balance()
+        mock_close.assert_called_once()
+        assert client._session is None
+
+    def test_close_keeps_given_session(self, mocker):
+        session = requests.Session()
+        mock_close: MockerFixture = mocker.patch("requests.Session.close")
+
+        client = PluxeeClient("Foo", "Bar", session=session)
+        client.close()
+        mock_close.assert_not_called()
+        assert client._session is session
+
+    def test_ca_bundle_reused_between_calls(self, mocker, client: PluxeeClient):
+        mocker.patch("requests.Session.get", return_value=MockAPIResponse(200, content=CONTENT_BALANCE))
+        mocker.patch("pluxee.AIASession.cadata_from_url", return_value="my_certificate")
+        mock_mkstemp: MockerFixture = mocker.spy(tempfile, "mkstemp")
+
+        client.get_balance()
+        cafile = client._session.verify
+        client.get_balance()
+        assert client._session.verify == cafile
+        mock_mkstemp.assert_called_once()
+        with open(cafile) as f:
+            assert f.read() == "my_certificate"
+
+        client.close()
+        assert not os.path.exists(cafile)
+
+    def test_ca_bundle_rewritten_on_chain_change(self, mocker, client: PluxeeClient):
+        mocker.patch("requests.Session.get", return_value=MockAPIResponse(200, content=CONTENT_BALANCE))
+        mocker.patch("pluxee.AIASession.cadata_from_url", side_effect=["old_certificate", "new_certificate"])
+
+        client.get_balance()
+        old_cafile = client._session.verify
+        client.get_balance()
+        new_cafile = client._session.verify
+        # Kept until close, a request of another thread can still be reading it.
+        assert os.path.exists(old_cafile)
+        with open(new_cafile) as f:
+            assert f.read() == "new_certificate"
+        client.close()
+        assert not os.path.exists(old_cafile)
+        assert not os.path.exists(new_cafile)
+
+    def test_ca_bundle_removed_after_reuse(self, mocker):
+        mocker.patch("pluxee.AIASession.cadata_from_url", return_value="my_certificate")
+        aia_session = AIASession()
+        aia_session.close()
+
+        # A session used again after close still removes its files.
+        cafile = aia_session.cafile_from_url("https://users.pluxee.be/fr")
+        assert os.path.exists(cafile)
+        aia_session.close()
+        assert not os.path.exists(cafile)
+
+    def test_temporary_pem_file_deprecated(self, mocker):
+        mocker.patch("pluxee.AIASession.cadata_from_url", return_value="my_certificate")
+        with pytest.deprecated_call():
+            pem_file = PluxeeClient.TemporaryPEMFile(AIASession(), "https://users.pluxee.be/fr")
+        with pem_file as path:
+            with open(path) as f:
+                assert f.read() == "my_certificate"
+        assert not os.path.exists(path)
+
+    def test_get_transactions_page_window(self, mocker, client: PluxeeClient):
+        days = [date(2024, 3, 1) - timedelta(days=i) for i in range(35)]
+        pages = make_transactions_history(days)
+        mock_get: MockerFixture = mocker.patch(
+            "requests.Session.get",
+            side_effect=lambda url, params, timeout: MockAPIResponse(200, content=pages[min(params["page"], 3)].encode()),
+        )
+        mocker.patch("pluxee.AIASession.cadata_from_url", return_value="my_certificate")
+
+        transactions = client.get_transactions(PassType.LUNCH, since=date(2024, 2, 10), page_window=3)
+        assert [transaction.date for transaction in transactions] == sorted(day for day in days if day >= date(2024, 2, 10))
+        fetched_pages = [kwargs["params"]["page"] for _, kwargs in mock_get.call_args_list]
+        assert fetched_pages[0] == 0
+        assert {0, 1, 2} <= set(fetched_pages)
+
+    def test_get_transactions_invalid_page_window(self, client: PluxeeClient):
+        with pytest.raises(ValueError):
+            client.get_transactions(PassType.LUNCH, page_window=0)
+
+    def test_iter_transactions_stops_early(self, mocker, client: PluxeeClient):
+        days = [date(2024, 3, 1) - timedelta(days=i) for i in range(35)]
+        pages = make_transactions_history(days)
+        mock_get: MockerFixture = mocker.patch(
+            "requests.Session.get",
+            side_effect=lambda url, params, timeout: MockAPIResponse(200, content=pages[params["page"]].encode()),
+        )
+        mocker.patch("pluxee.AIASession.cadata_from_url", return_value="my_certificate")
+
+        transactions = client.iter_transactions(PassType.LUNCH)
+        assert next(transactions).date == date(2024, 3, 1)
+        assert mock_get.call_count == 1
+        first_dates = [next(transactions).date for _ in range(11)]
+        assert first_dates == days[1:12]
+        assert mock_get.call_count == 2
+        transactions.close()
+        assert mock_get.call_count == 2
+
+    def test_sync_transactions(self, mocker, client: PluxeeClient):
+        days = [date(2024, 3, 1) - timedelta(days=i) for i in range(35)]
+        pages = make_transactions_history(days)
+        mock_get: MockerFixture = mocker.patch(
+            "requests.Session.get",
+            side_effect=lambda url, params, timeout: MockAPIResponse(200, content=pages[params["page"]].encode()),
+        )
+        mocker.patch("pluxee.AIASession.cadata_from_url", return_value="my_certificate")
+        state = TransactionSyncState()
+
+        transactions = client.sync_transactions(PassType.LUNCH, state, since=date(2024, 2, 10))
+        assert [transaction.date for transaction in transactions] == sorted(day for day in days if day >= date(2024, 2, 10))
+
+        days.insert(0, date(2024, 3, 2))
+        pages = make_transactions_history(days)
+        mock_get.reset_mock()
+        transactions = client.sync_transactions(PassType.LUNCH, state)
+        assert [transaction.date for transaction in transactions] == [date(2024, 3, 2)]
+        assert mock_get.call_count == 1
+        assert client.sync_transactions(PassType.LUNCH, state) == []
+
+    def test_get_transactions_with_store(self, mocker):
+        days = [date(2024, 3, 1) - timedelta(days=i) for i in range(35)]
+        pages = make_transactions_history(days)
+        mock_get = mocker.patch(
+            "requests.Session.get",
+            side_effect=lambda url, params, timeout: MockAPIResponse(200, content=pages[params["page"]].encode()),
+        )
+        mocker.patch("pluxee.AIASession.cadata_from_url", return_value="my_certificate")
+        store = TransactionStore()
+        spy_add_page = mocker.spy(store, "add_page")
+        client = PluxeeClient("Foo", "Bar", transaction_store=store)
+
+        transactions = client.get_transactions(PassType.LUNCH, since=date(2024, 2, 10), until=date(2024, 2, 20))
+        assert [transaction.date for transaction in transactions] == sorted(
+            day for day in days if date(2024, 2, 10) <= day < date(2024, 2, 20)
+        )
+        assert mock_get.call_count == 3
+        # The pages are stored one by one, as they are retrieved.
+        assert spy_add_page.call_count == 3
+
+        # The range is served by the store.
+        mock_get.reset_mock()
+        assert client.get_transactions(PassType.LUNCH, since=date(2024, 2, 12), until=date(2024, 2, 15)) == [
+            transaction for transaction in transactions if date(2024, 2, 12) <= transaction.date < date(2024, 2, 15)
+        ]
+        mock_get.assert_not_called()
+
+        # Only the missing ranges are stored, with a single pagination.
+        transactions = client.get_transactions(PassType.LUNCH, since=date(2024, 2, 1), until=date(2024, 2, 25))
+        assert [transaction.date for transaction in transactions] == sorted(
+            day for day in days if date(2024, 2, 1) <= day < date(2024, 2, 25)
+        )
+        assert mock_get.call_count == 4
+        assert store.missing_ranges("Foo", PassType.LUNCH, date(2024, 2, 1), date(2024, 2, 25)) == []
+        client.close()
+        store.close()
+
+    def test_transaction_store_error(self, mocker):
+        pages = make_transactions_history([date(2024, 3, 1) - timedelta(days=i) for i in range(35)])
+        mock_get = mocker.patch(
+            "requests.Session.get",
+            side_effect=lambda url, params, timeout: MockAPIResponse(
+                200 if params["page"] < 2 else 500, content=pages[params["page"]].encode()
+            ),
+        )
+        mocker.patch(
+            "requests.Session.post", return_value=MockAPIResponse(303, content="coucou", headers={"set-cookie": "key=value;..."})
+        )
+        mocker.patch("pluxee.AIASession.cadata_from_url", return_value="my_certificate")
+        store = TransactionStore()
+        spy_add_page = mocker.spy(store, "add_page")
+        client = PluxeeClient("Foo", "Bar", transaction_store=store)
+        with pytest.raises(PluxeeAPIError):
+            client.get_transactions(PassType.LUNCH, since=date(2024, 2, 10), until=date(2024, 2, 20))
+        assert {call.kwargs["params"]["page"] for call in mock_get.call_args_list} == {0, 1, 2}
+        assert spy_add_page.call_count == 2
+
+        # The pages stored before the error are rolled back.
+        assert store.query("Foo", PassType.LUNCH) == []
+        assert store.missing_ranges("Foo", PassType.LUNCH) == [(date.min, date.max)]
+        client.close()
+        store.close()
+
+    def test_transaction_store_wrong_password(self, mocker):
+        pages = make_transactions_history([date(2024, 3, 1) - timedelta(days=i) for i in range(5)])
+        mock_get: MockerFixture = mocker.patch(
+            "requests.Session.get",
+            side_effect=lambda url, params, timeout: MockAPIResponse(200, content=pages[params["page"]].encode()),
+        )
+        mocker.patch("pluxee.AIASession.cadata_from_url", return_value="my_certificate")
+        store = TransactionStore()
+        client = PluxeeClient("Foo", "Bar", transaction_store=store)
+        assert len(client.get_transactions(PassType.LUNCH, since=date(2024, 2, 1), until=date(2024, 3, 1))) == 4
+        client.close()
+
+        # The stored transactions are never served to other credentials.
+        mock_get.side_effect = None
+        mock_get.return_value = MockAPIResponse(200, content=b"login", url="https://users.pluxee.be/fr/user/login")
+        mocker.patch("requests.Session.post", return_value=MockAPIResponse(302, content="coucou", headers={}))
+        client = PluxeeClient("Foo", "WRONG", transaction_store=store)
+        with pytest.raises(PluxeeLoginError):
+            client.get_transactions(PassType.LUNCH, since=date(2024, 2, 1), until=date(2024, 3, 1))
+        client.close()
+
+        # The history survives a change of password, once the website accepted the new one.
+        mocker.patch(
+            "requests.Session.post", return_value=MockAPIResponse(303, content="coucou", headers={"set-cookie": "key=value;..."})
+        )
+        mock_get.reset_mock()
+        client = PluxeeClient("Foo", "NEW", transaction_store=store)
+        assert len(client.get_transactions(PassType.LUNCH, since=date(2024, 2, 1), until=date(2024, 3, 1))) == 4
+        assert {call.args[0] for call in mock_get.call_args_list} == {"https://users.pluxee.be/fr"}
+        client.close()
+        store.close()
+
+    def test_response_cache(self, mocker):
+        mock_time = mocker.patch("time.time", return_value=1000.0)
+        content = open(test_data_dir / "content_balance.html", "rb").read()
+        mock_get: MockerFixture = mocker.patch(
+            "requests.Session.get", return_value=MockAPIResponse(200, content=content, headers={"ETag": '"v1"'})
+        )
+        mocker.patch("pluxee.AIASession.cadata_from_url", return_value="my_certificate")
+        client = PluxeeClient("Foo", "Bar", response_cache=ResponseCache(ttl=10))
+
+        balance = client.get_balance()
+        assert client.get_balance() == balance
+        assert mock_get.call_count == 1
+
+        # Once the TTL expired, the page is revalidated.
+        mock_time.return_value = 1010.0
+        mock_get.return_value = MockAPIResponse(304, content=b"", headers={})
+        assert client.get_balance() == balance
+        assert mock_get.call_count == 2
+        _, kwargs = mock_get.call_args
+        assert kwargs["headers"] == {"If-None-Match": '"v1"'}
+        assert client.get_balance() == balance
+        assert mock_get.call_count == 2
+        client.close()
+
+    def test_response_cache_wrong_password(self, mocker):
+        content = open(test_data_dir / "content_balance.html", "rb").read()
+        mock_get: MockerFixture = mocker.patch("requests.Session.get", return_value=MockAPIResponse(200, content=content))
+        mocker.patch("pluxee.AIASession.cadata_from_url", return_value="my_certificate")
+        response_cache = ResponseCache(ttl=10)
+        client = PluxeeClient("Foo", "Bar", response_cache=response_cache)
+        client.get_balance()
+        client.close()
+
+        # The cache is warm, but the pages of the account are never served to other credentials.
+        mock_get.return_value = MockAPIResponse(200, content=b"login", url="https://users.pluxee.be/fr/user/login")
+        mock_post: MockerFixture = mocker.patch(
+            "requests.Session.post", return_value=MockAPIResponse(302, content="coucou", headers={})
+        )
+        client = PluxeeClient("Foo", "WRONG", response_cache=response_cache)
+        with pytest.raises(PluxeeLoginError):
+            client.get_balance()
+        mock_post.assert_called_once()
+        client.close()
+
+    def test_is_logged_in(self, client: PluxeeClient):
+        content = open(test_data_dir / "content_balance.html", "rb").read()
+        assert client._is_logged_in(200, "https://users.pluxee.be/fr", content)
+        assert client._is_logged_in(200, "https://users.pluxee.be/fr", content.decode())
+        assert not client._is_logged_in(200, "https://users.pluxee.be/fr/user/login", content)
+        assert not client._is_logged_in(403, "https://users.pluxee.be/fr", content)
+        assert not client._is_logged_in(
+            200, "https://users.pluxee.be/fr", open(test_data_dir / "content_empty_balance.html", "rb").read()
+        )
+        # Only the top of the page is scanned.
+        assert not client._is_logged_in(200, "https://users.pluxee.be/fr", b" " * client.LOGGED_IN_SCAN_LIMIT + b"logout")
+
+    def test_parse_cookie_expiry(self, mocker, client: PluxeeClient):
+        mocker.patch("time.time", return_value=1000.0)
+        assert client._parse_cookie_expiry("key=value; path=/; Max-Age=3600; HttpOnly") == 4600.0
+        assert client._parse_cookie_expiry("key=value; expires=Thu, 01 Jan 1970 01:00:00 GMT; Max-Age=60") == 1060.0
+        assert client._parse_cookie_expiry("key=value; expires=Thu, 01 Jan 1970 01:00:00 GMT") == 3600.0
+        assert client._parse_cookie_expiry("key=value; expires=tomorrow; Max-Age=soon") is None
+        assert client._parse_cookie_expiry("key=value; path=/") is None
+
+    def test_next_login_delay(self, mocker, client: PluxeeClient):
+        mock_time = mocker.patch("time.time", return_value=1000.0)
+        assert client._next_login_delay(900, 60) == 0
+        client._record_login("key=value; path=/")
+        assert client._next_login_delay(900, 60) == 900
+        client._record_login("key=value; Max-Age=3600")
+        assert client._next_login_delay(900, 60) == 3540
+        # A short lived cookie is refreshed after half its life.
+        client._record_login("key=value; Max-Age=60")
+        assert client._next_login_delay(900, 60) == 30
+        mock_time.return_value = 2000.0
+        assert client._next_login_delay(900, 60) == 0
+
+    def test_keep_alive(self, mocker, client: PluxeeClient):
+        mocker.patch("pluxee.AIASession.cadata_from_url", return_value="my_certificate")
+        logged_in = threading.Event()
+        mock_post: MockerFixture = mocker.patch(
+            "requests.Session.post",
+            side_effect=lambda **kwargs: logged_in.set()
+            or MockAPIResponse(303, content="coucou", headers={"set-cookie": "key=value; Max-Age=3600"}),
+        )
+
+        with pytest.raises(ValueError):
+            client.start_keep_alive(refresh_interval=0)
+        with pytest.raises(ValueError):
+            client.start_keep_alive(margin=0)
+        client.start_keep_alive()
+        assert logged_in.wait(5)
+        thread = client._keep_alive_thread
+        client.close()
+        assert not thread.is_alive()
+        assert client._keep_alive_thread is None
+        assert mock_post.call_count == 1
+        assert client._session is None
+
+    def test_get_all_transactions(self, mocker, client: PluxeeClient):
+        # The account has no gift pass.
+        content_balance = (
+            open(test_data_dir / "content_balance.html", encoding="utf-8").read().replace("?type=GIFT", "?type=NONE")
+        )
+
+        def get(url, params, timeout):
+            if "type" not in params:
+                return MockAPIResponse(200, content=content_balance.encode())
+            rows = [("01.03.2024", params["type"], "Paiement", "- 1.00 EUR")]
+            return MockAPIResponse(200, content=make_transactions_page(rows).encode())
+
+        mock_get: MockerFixture = mocker.patch("requests.Session.get", side_effect=get)
+        mocker.patch("pluxee.AIASession.cadata_from_url", return_value="my_certificate")
+
+        transactions = client.get_all_transactions(since=date(2024, 1, 1))
+        assert list(transactions) == [PassType.LUNCH, PassType.ECO, PassType.CONSO]
+        for pass_type, pass_transactions in transactions.items():
+            assert [transaction.merchant for transaction in pass_transactions] == [pass_type.value]
+        assert mock_get.call_count == 4
+        client.close()
+
+        # The store is shared by the threads of the pass types.
+        store = TransactionStore()
+        with PluxeeClient("Foo", "Bar", transaction_store=store) as client:
+            assert client.get_all_transactions(since=date(2024, 1, 1), until=date(2024, 3, 2)) == transactions
+        assert store.query("Foo", PassType.ECO) == transactions[PassType.ECO]
+        store.close()
+
+    def test_fetch_balances_closed_early(self, mocker):
+        mocker.patch("pluxee.AIASession.cadata_from_url", return_value="my_certificate")
+        done = []
+
+        def get_balance(client):
+            time.sleep(0.05)
+            done.append(client._username)
+            return PluxeeBalance(0, 0, 0, 0)
+
+        mocker.patch.object(PluxeeClient, "get_balance", autospec=True, side_effect=get_balance)
+        done_at_adapter_close = []
+
+        def close(adapter):
+            # Only the shared adapter, sized by the concurrency.
+            if adapter._pool_maxsize == 2:
+                done_at_adapter_close.append(len(done))
+
+        mocker.patch.object(HTTPAdapter, "close", autospec=True, side_effect=close)
+
+        balances = PluxeeClient.fetch_balances([("A", "x"), ("B", "x"), ("C", "x"), ("D", "x")], concurrency=2)
+        next(balances)
+        balances.close()
+        # The running accounts were done before the shared adapter was closed.
+        time.sleep(0.2)
+        assert done_at_adapter_close == [len(done)]
+
+    def test_fetch_balances(self, mocker):
+        mocker.patch("pluxee.AIASession.cadata_from_url", return_value="my_certificate")
+        clients = []
+
+        adapters = []
+
+        def get_balance(client):
+            clients.append(client)
+            adapters.append(client._session.get_adapter("https://users.pluxee.be"))
+            if client._username == "Bad":
+                raise PluxeeLoginError("Bad username/password")
+            return PluxeeBalance(len(client._username), 0, 0, 0)
+
+        mocker.patch.object(PluxeeClient, "get_balance", autospec=True, side_effect=get_balance)
+        spy_close = mocker.spy(requests.Session, "close")
+
+        credentials = [("Foo", "Bar"), ("Bad", "Bar"), ("Foobar", "Bar")]
+        results = dict(PluxeeClient.fetch_balances(credentials, concurrency=2))
+        # The session of each account is closed.
+        assert spy_close.call_count == 3
+        assert results["Foo"].lunch_pass == 3
+        assert results["Foobar"].lunch_pass == 6
+        assert isinstance(results["Bad"], PluxeeLoginError)
+        assert len({id(client._aia_session) for client in clients}) == 1
+        assert len({id(adapter) for adapter in adapters}) == 1
+        assert len({id(client._session.cookies) for client in clients}) == 3
@@ -1,3 +1,7 @@
+import pickle
+
+import pytest
+
 from pluxee import PluxeeBalance
 
 
@@ -9,3 +13,20 @@ class TestPluxeeBalance:
         assert balance.gift_pass == 1
         assert balance.conso_pass == 1.1
         assert repr(balance) == "lunch_pass: -1.1\neco_pass: -1\ngift_pass: 1\nconso_pass: 1.1"
+
+    def test_immutable(self):
+        balance = PluxeeBalance(-1.1, -1, 1, 1.1)
+        with pytest.raises(AttributeError):
+            balance.lunch_pass = 2
+        assert not hasattr(balance, "__dict__")
+
+    def test_equality(self):
+        balance = PluxeeBalance(-1.1, -1, 1, 1.1)
+        assert balance == PluxeeBalance(-1.1, -1, 1, 1.1)
+        assert hash(balance) == hash(PluxeeBalance(-1.1, -1, 1, 1.1))
+        assert balance != PluxeeBalance(-1.1, -1, 1, 0)
+        assert balance.as_tuple() == (-1.1, -1, 1, 1.1)
+
+    def test_pickle(self):
+        balance = PluxeeBalance(-1.1, -1, 1, 1.1)
+        assert pickle.loads(pickle.dumps(balance)) == balance
@@ -1,5 +1,8 @@
+import pickle
 from datetime import date
 
+import pytest
+
 from pluxee import PluxeeTransaction
 
 
@@ -11,3 +14,38 @@ class TestPluxeeTransaction:
         assert balance.detail == "1"
         assert balance.merchant == "1.1"
         assert repr(balance) == "date: 2020-01-01\namount: -1\ndetail: 1\nmerchant: 1.1"
+
+    def test_immutable(self):
+        transaction = PluxeeTransaction(date(2020, 1, 1), -1, "1", "1.1")
+        with pytest.raises(AttributeError):
+            transaction.amount = 2
+        with pytest.raises(AttributeError):
+            transaction.other = 2
+        assert not hasattr(transaction, "__dict__")
+
+    def test_equality(self):
+        transaction = PluxeeTransaction(date(2020, 1, 1), -1, "1", "1.1")
+        same = PluxeeTransaction(date(2020, 1, 1), -1, "1", "1.1")
+        assert transaction == same
+        assert len({transaction, same}) == 1
+        assert transaction != PluxeeTransaction(date(2020, 1, 1), -1, "2", "1.1")
+        assert transaction != transaction.as_tuple()
+
+    def test_ordering(self):
+        transactions = [
+            PluxeeTransaction(date(2020, 1, 2), -1, "a", "A"),
+            PluxeeTransaction(date(2020, 1, 1), 5, "a", "A"),
+            PluxeeTransaction(date(2020, 1, 1), -1, "a", "B"),
+            PluxeeTransaction(date(2020, 1, 1), -1, "b", "A"),
+        ]
+        assert sorted(transactions) == [transactions[3], transactions[2], transactions[1], transactions[0]]
+        assert transactions[1] <= transactions[0]
+
+    def test_as_tuple(self):
+        transaction = PluxeeTransaction(date(2020, 1, 1), -1, "1", "1.1")
+        assert transaction.as_tuple() == (date(2020, 1, 1), -1, "1", "1.1")
+        assert PluxeeTransaction(*transaction.as_tuple()) == transaction
+
+    def test_pickle(self):
+        transaction = PluxeeTransaction(date(2020, 1, 1), -1, "1", "1.1")
+        assert pickle.loads(pickle.dumps(transaction)) == transaction
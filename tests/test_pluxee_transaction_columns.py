@@ -0,0 +1,66 @@
+from datetime import date
+
+import pytest
+
+from pluxee import PluxeeTransaction, PluxeeTransactionColumns
+
+TRANSACTIONS = [
+    PluxeeTransaction(date(2024, 3, 2), -4.5, "Paiement", "SHOP"),
+    PluxeeTransaction(date(2024, 2, 28), -10, "Paiement", "BAKERY"),
+    PluxeeTransaction(date(2024, 2, 6), -6.1, "Paiement", "SHOP"),
+    PluxeeTransaction(date(2024, 1, 28), 144, "18 cheques", "YOUR EMPLOYER"),
+]
+
+
+@pytest.fixture(scope="function")
+def columns():
+    return PluxeeTransactionColumns.from_transactions(TRANSACTIONS)
+
+
+class TestPluxeeTransactionColumns:
+    def test_from_transactions(self, columns: PluxeeTransactionColumns):
+        assert len(columns) == 4
+        assert columns.merchants == ["SHOP", "BAKERY", "YOUR EMPLOYER"]
+        assert columns.details == ["Paiement", "18 cheques"]
+        transactions = list(columns)
+        assert [transaction.date for transaction in transactions] == [
+            date(2024, 1, 28),
+            date(2024, 2, 6),
+            date(2024, 2, 28),
+            date(2024, 3, 2),
+        ]
+        assert transactions[0].amount == 144
+        assert transactions[0].detail == "18 cheques"
+        assert transactions[0].merchant == "YOUR EMPLOYER"
+
+    def test_from_unsorted_transactions(self):
+        columns = PluxeeTransactionColumns.from_transactions([TRANSACTIONS[1], TRANSACTIONS[3], TRANSACTIONS[0], TRANSACTIONS[2]])
+        assert list(columns.ordinals) == sorted(transaction.date.toordinal() for transaction in TRANSACTIONS)
+        assert columns[0].merchant == "YOUR EMPLOYER"
+
+    def test_between(self, columns: PluxeeTransactionColumns):
+        february = columns.between(date(2024, 2, 1), date(2024, 3, 1))
+        assert [transaction.merchant for transaction in february] == ["SHOP", "BAKERY"]
+        assert len(columns.between(since=date(2024, 2, 28))) == 2
+        assert len(columns.between(until=date(2024, 2, 28))) == 2
+        assert february.sum_by_merchant() == {"SHOP": -6.1, "BAKERY": -10}
+
+    def test_sum_by_merchant(self, columns: PluxeeTransactionColumns):
+        assert columns.sum_by_merchant() == {"SHOP": -10.6, "BAKERY": -10, "YOUR EMPLOYER": 144}
+
+    def test_sum_by_month(self, columns: PluxeeTransactionColumns):
+        assert columns.sum_by_month() == {(2024, 1): 144, (2024, 2): -16.1, (2024, 3): -4.5}
+
+    def test_to_numpy(self, columns: PluxeeTransactionColumns):
+        numpy = pytest.importorskip("numpy")
+        arrays = columns.to_numpy()
+        assert arrays["amounts"].sum() == pytest.approx(123.4)
+        # The arrays share the memory of the columns.
+        columns.amounts[0] = 0
+        assert arrays["amounts"][0] == 0
+        assert arrays["ordinals"].dtype == numpy.int64
+
+    def test_to_numpy_not_installed(self, mocker, columns: PluxeeTransactionColumns):
+        mocker.patch("pluxee.transaction_columns.NUMPY_AVAILABLE", False)
+        with pytest.raises(ImportError):
+            columns.to_numpy()
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from pluxee import ResponseCache
+
+
+class TestResponseCache:
+    def test_key(self):
+        cache = ResponseCache()
+        key = cache.key("Foo", "Bar", "https://example.com", {"page": 1, "type": "LUNCH"})
+        assert key == cache.key("Foo", "Bar", "https://example.com", {"type": "LUNCH", "page": 1})
+        assert key != cache.key("Foo", "WRONG", "https://example.com", {"page": 1, "type": "LUNCH"})
+        assert key != cache.key("Foo", "Bar", "https://example.com", {"page": 2, "type": "LUNCH"})
+        # Each cache has its own secret.
+        assert key != ResponseCache().key("Foo", "Bar", "https://example.com", {"page": 1, "type": "LUNCH"})
+
+    def test_key_secret_on_disk(self, tmp_path):
+        cache_dir = str(tmp_path / "responses")
+        key = ResponseCache(cache_dir=cache_dir).key("Foo", "Bar", "https://example.com", {})
+        assert ResponseCache(cache_dir=cache_dir).key("Foo", "Bar", "https://example.com", {}) == key
+        assert os.listdir(cache_dir) == ["secret.key"]
+        if os.name == "posix":
+            assert os.stat(os.path.join(cache_dir, "secret.key")).st_mode & 0o777 == 0o600
+            assert os.stat(cache_dir).st_mode & 0o777 == 0o700
+
+    def test_ttl(self, mocker):
+        mock_time = mocker.patch("time.time", return_value=1000.0)
+        cache = ResponseCache(ttl=10)
+        entry = cache.put("key", "content", 200, {"ETag": '"v1"'})
+        assert cache.get("key") is entry
+        assert cache.is_fresh(entry)
+        mock_time.return_value = 1010.0
+        assert not cache.is_fresh(entry)
+        assert entry.conditional_headers() == {"If-None-Match": '"v1"'}
+        entry = cache.revalidated("key", entry)
+        assert cache.is_fresh(entry)
+        assert entry.content == "content"
+
+    def test_lru(self):
+        cache = ResponseCache(maxsize=2)
+        cache.put("a", "A", 200)
+        cache.put("b", "B", 200)
+        cache.get("a")
+        cache.put("c", "C", 200)
+        assert cache.get("a").content == "A"
+        assert cache.get("b") is None
+        assert cache.get("c").content == "C"
+
+    def test_invalid_maxsize(self):
+        with pytest.raises(ValueError):
+            ResponseCache(maxsize=0)
+
+    def test_disk(self, tmp_path):
+        cache_dir = str(tmp_path / "responses")
+        cache = ResponseCache(maxsize=1, cache_dir=cache_dir)
+        cache.put("a", "A", 200, {"Last-Modified": "Wed, 21 Oct 2015 07:28:00 GMT"})
+        cache.put("b", "B", 200)
+        # Evicted from memory, read back from disk.
+        entry = cache.get("a")
+        assert entry.content == "A"
+        assert entry.conditional_headers() == {"If-Modified-Since": "Wed, 21 Oct 2015 07:28:00 GMT"}
+        assert ResponseCache(cache_dir=cache_dir).get("b").content == "B"
+        cache.clear()
+        assert os.listdir(cache_dir) == []
+        assert cache.get("a") is None
@@ -0,0 +1,84 @@
+import pathlib
+
+import aiohttp
+import pytest
+import requests
+
+from pluxee import PluxeeAsyncSessionPool, PluxeeSessionPool
+
+from .conftest import AsyncMockAPIResponse, MockAPIResponse, async_mock
+
+test_data_dir = pathlib.Path(__file__).parent / "test_data"
+
+CONTENT_BALANCE = open(test_data_dir / "content_balance.html", "r", encoding="utf-8").read()
+CONTENT_EXPIRED_COOKIES = open(test_data_dir / "content_empty_balance.html", "r", encoding="utf-8").read()
+
+
+class TestPluxeeSessionPool:
+    def test_invalid_maxsize(self):
+        with pytest.raises(ValueError):
+            PluxeeSessionPool(maxsize=0)
+
+    def test_client(self, mocker):
+        mocker.patch("pluxee.AIASession.cadata_from_url", return_value="my_certificate")
+        mock_post = mocker.patch(
+            "requests.Session.post",
+            side_effect=lambda **kwargs: MockAPIResponse(
+                303, content="coucou", headers={"set-cookie": f"session={kwargs['data']['name']}; path=/"}
+            ),
+        )
+        sessions = []
+
+        def get(session, url, params, timeout):
+            sessions.append(session)
+            logged_in = session.cookies.get("session") is not None
+            return MockAPIResponse(200, content=(CONTENT_BALANCE if logged_in else CONTENT_EXPIRED_COOKIES).encode())
+
+        mocker.patch.object(requests.Session, "get", autospec=True, side_effect=get)
+
+        with PluxeeSessionPool(maxsize=2) as pool:
+            for username in ("Foo", "Bar", "Foo", "Baz", "Bar"):
+                with pool.client(username, "Password") as client:
+                    assert client.get_balance().lunch_pass == 1
+            # Bar was evicted by Baz, it had to log in again.
+            assert (pool.hits, pool.misses) == (1, 4)
+            assert mock_post.call_count == 4
+            assert len(pool) == 2
+            with pool.client("Foo", "Other password"):
+                pass
+            assert pool.misses == 5
+            assert len({id(session.get_adapter("https://users.pluxee.be")) for session in sessions}) == 1
+        assert len(pool) == 0
+
+
+class TestPluxeeAsyncSessionPool:
+    @pytest.mark.asyncio
+    async def test_client(self, mocker):
+        mocker.patch("pluxee.AIASession.async_ssl_context_from_url", side_effect=async_mock)
+        mock_post = mocker.patch(
+            "aiohttp.ClientSession.post",
+            side_effect=lambda **kwargs: AsyncMockAPIResponse(
+                303, content="coucou", headers={"set-cookie": f"session={kwargs['data']['name']}; path=/"}
+            ),
+        )
+        sessions = []
+        connectors = []
+
+        def get(session, url, params):
+            sessions.append(session)
+            connectors.append(session.connector)
+            logged_in = len(session.cookie_jar) > 0
+            return AsyncMockAPIResponse(200, content=CONTENT_BALANCE if logged_in else CONTENT_EXPIRED_COOKIES)
+
+        mocker.patch.object(aiohttp.ClientSession, "get", autospec=True, side_effect=get)
+
+        async with PluxeeAsyncSessionPool(maxsize=2) as pool:
+            for username in ("Foo", "Bar", "Foo", "Baz", "Bar"):
+                async with pool.client(username, "Password") as client:
+                    assert (await client.get_balance()).lunch_pass == 1
+            assert (pool.hits, pool.misses) == (1, 4)
+            assert mock_post.call_count == 4
+            assert len({id(connector) for connector in connectors}) == 1
+            assert all(session.closed for session in sessions)
+            assert not connectors[0].closed
+        assert connectors[0].closed
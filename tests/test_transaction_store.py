@@ -0,0 +1,101 @@
+import threading
+from datetime import date, timedelta
+
+import pytest
+
+from pluxee import PassType, PluxeeTransaction, TransactionStore
+
+
+@pytest.fixture(scope="function")
+def store():
+    store = TransactionStore()
+    yield store
+    store.close()
+
+
+def transaction(day, merchant="MERCHANT"):
+    return PluxeeTransaction(date(2024, 3, day), -1.0, "Paiement", merchant)
+
+
+class TestTransactionStore:
+    def test_missing_ranges(self, store: TransactionStore):
+        assert store.missing_ranges("Foo", PassType.LUNCH) == [(date.min, date.max)]
+        store.add_coverage("Foo", PassType.LUNCH, [(date(2024, 3, 5), date(2024, 3, 10))])
+        store.add_coverage(
+            "Foo", PassType.LUNCH, [(date(2024, 3, 10), date(2024, 3, 15)), (date(2024, 3, 20), date(2024, 3, 25))]
+        )
+        assert store.missing_ranges("Foo", PassType.LUNCH, date(2024, 3, 1), date(2024, 3, 31)) == [
+            (date(2024, 3, 1), date(2024, 3, 5)),
+            (date(2024, 3, 15), date(2024, 3, 20)),
+            (date(2024, 3, 25), date(2024, 3, 31)),
+        ]
+        assert store.missing_ranges("Foo", PassType.LUNCH, date(2024, 3, 6), date(2024, 3, 14)) == []
+        assert store.missing_ranges("Foo", PassType.ECO, date(2024, 3, 6), date(2024, 3, 14)) == [
+            (date(2024, 3, 6), date(2024, 3, 14))
+        ]
+
+    def test_coverage_stops_before_today(self, store: TransactionStore):
+        today = date.today()
+        store.add_coverage("Foo", PassType.LUNCH, [(today - timedelta(days=5), date.max)])
+        assert store.missing_ranges("Foo", PassType.LUNCH, today - timedelta(days=10)) == [
+            (today - timedelta(days=10), today - timedelta(days=5)),
+            (today, date.max),
+        ]
+
+    def test_add_page_and_query(self, store: TransactionStore):
+        ranges = [(date(2024, 3, 2), date(2024, 3, 4))]
+        store.add_page("Foo", PassType.LUNCH, [transaction(4), transaction(3, "B"), transaction(3, "A"), transaction(2)], ranges)
+        store.add_page("Foo", PassType.LUNCH, [transaction(1)], ranges)
+        assert store.query("Foo", PassType.LUNCH) == [transaction(2), transaction(3, "A"), transaction(3, "B")]
+        assert store.query("Foo", PassType.LUNCH, since=date(2024, 3, 3)) == [transaction(3, "A"), transaction(3, "B")]
+        assert store.query("Foo", PassType.LUNCH, until=date(2024, 3, 3)) == [transaction(2)]
+        assert store.query("Foo", PassType.LUNCH, merchant="B") == [transaction(3, "B")]
+        assert store.query("Foo", PassType.ECO) == []
+
+        store.clear_ranges("Foo", PassType.LUNCH, [(date(2024, 3, 3), date(2024, 3, 4))])
+        assert store.query("Foo", PassType.LUNCH) == [transaction(2)]
+
+    def test_transaction(self, store: TransactionStore):
+        ranges = [(date(2024, 3, 2), date(2024, 3, 4))]
+        with store.transaction():
+            store.clear_ranges("Foo", PassType.LUNCH, ranges)
+            store.add_page("Foo", PassType.LUNCH, [transaction(3, "B"), transaction(3, "A")], ranges)
+            store.add_page("Foo", PassType.LUNCH, [transaction(2), transaction(1)], ranges)
+            store.add_coverage("Foo", PassType.LUNCH, ranges)
+        assert store.query("Foo", PassType.LUNCH) == [transaction(2), transaction(3, "A"), transaction(3, "B")]
+        assert store.missing_ranges("Foo", PassType.LUNCH, date(2024, 3, 2), date(2024, 3, 4)) == []
+
+        # The writes of a failed transaction are all rolled back.
+        with pytest.raises(RuntimeError):
+            with store.transaction():
+                store.clear_ranges("Foo", PassType.LUNCH, [(date(2024, 3, 1), date(2024, 3, 5))])
+                store.add_page("Foo", PassType.LUNCH, [transaction(4)], [(date(2024, 3, 1), date(2024, 3, 5))])
+                raise RuntimeError
+        assert store.query("Foo", PassType.LUNCH) == [transaction(2), transaction(3, "A"), transaction(3, "B")]
+        assert store.missing_ranges("Foo", PassType.LUNCH, date(2024, 3, 1), date(2024, 3, 5)) == [
+            (date(2024, 3, 1), date(2024, 3, 2)),
+            (date(2024, 3, 4), date(2024, 3, 5)),
+        ]
+
+    def test_transaction_locks_other_threads(self, store: TransactionStore):
+        ranges = [(date(2024, 3, 1), date(2024, 3, 3))]
+        queried = threading.Event()
+        with store.transaction():
+            thread = threading.Thread(target=lambda: (store.query("Foo", PassType.LUNCH), queried.set()))
+            thread.start()
+            store.add_page("Foo", PassType.LUNCH, [transaction(2)], ranges)
+            assert not queried.wait(0.1)
+        thread.join()
+        assert queried.is_set()
+
+    def test_persistence(self, tmp_path):
+        path = str(tmp_path / "cache" / "transactions.db")
+        store = TransactionStore(path)
+        store.add_page("Foo", PassType.LUNCH, [transaction(2)], [(date.min, date.max)])
+        store.add_coverage("Foo", PassType.LUNCH, [(date(2024, 3, 1), date(2024, 3, 3))])
+        store.close()
+
+        store = TransactionStore(path)
+        assert store.query("Foo", PassType.LUNCH) == [transaction(2)]
+        assert store.missing_ranges("Foo", PassType.LUNCH, date(2024, 3, 1), date(2024, 3, 3)) == []
+        store.close()
@@ -0,0 +1,42 @@
+import json
+from datetime import date
+
+from pluxee import PassType, PluxeeTransaction, TransactionSyncState
+
+
+def transaction(day, merchant="MERCHANT", amount=-1.0):
+    return PluxeeTransaction(date(2024, 3, day), amount, "Paiement", merchant)
+
+
+class TestTransactionSyncState:
+    def test_first_update_returns_everything(self):
+        state = TransactionSyncState()
+        transactions = [transaction(3), transaction(2), transaction(1)]
+        assert state.high_water_mark("Foo", PassType.LUNCH) is None
+        assert state.update("Foo", PassType.LUNCH, transactions) == transactions[::-1]
+        assert state.high_water_mark("Foo", PassType.LUNCH) == date(2024, 3, 3)
+        assert state.high_water_mark("Foo", PassType.ECO) is None
+        assert state.high_water_mark("Bar", PassType.LUNCH) is None
+
+    def test_boundary_duplicates(self):
+        state = TransactionSyncState()
+        state.update("Foo", PassType.LUNCH, [transaction(3), transaction(3), transaction(2)])
+        # Two identical transactions were seen on the 3rd, a third one happened since.
+        new = state.update("Foo", PassType.LUNCH, [transaction(4, "OTHER"), transaction(3), transaction(3), transaction(3)])
+        assert new == [transaction(3), transaction(4, "OTHER")]
+        assert state.high_water_mark("Foo", PassType.LUNCH) == date(2024, 3, 4)
+        assert state.update("Foo", PassType.LUNCH, [transaction(4, "OTHER")]) == []
+
+    def test_nothing_new(self):
+        state = TransactionSyncState()
+        state.update("Foo", PassType.LUNCH, [transaction(3)])
+        assert state.update("Foo", PassType.LUNCH, [transaction(3)]) == []
+        assert state.update("Foo", PassType.LUNCH, []) == []
+        assert state.high_water_mark("Foo", PassType.LUNCH) == date(2024, 3, 3)
+
+    def test_to_dict_from_dict(self):
+        state = TransactionSyncState()
+        state.update("Foo", PassType.LUNCH, [transaction(3), transaction(3), transaction(2)])
+        state = TransactionSyncState.from_dict(json.loads(json.dumps(state.to_dict())))
+        assert state.high_water_mark("Foo", PassType.LUNCH) == date(2024, 3, 3)
+        assert state.update("Foo", PassType.LUNCH, [transaction(3), transaction(3), transaction(3)]) == [transaction(3)]